@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for enumCSh.
+
+Covers template loading (with and without the compiled cache) on synthetic
+template files, placeholder rendering and port display throughput, Nmap
+output parsing through a fake `nmap` stub, and CLI cold start. Results are
+written to a JSON file; pass --baseline to flag regressions against an
+earlier results file.
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import statistics
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest.mock import patch
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import enumcsh  # noqa: E402
+
+DEFAULT_OUTPUT_PATH = ROOT / "benchmarks" / "results.json"
+TEMPLATE_SIZES = (10, 1000, 10000, 65535)
+NMAP_OUTPUT_SIZES = (100, 10000, 65535)
+
+FAKE_NMAP = """#!/usr/bin/env python3
+import os, sys
+with open(os.environ["FAKE_NMAP_OUTPUT"]) as f:
+    sys.stdout.write(f.read())
+"""
+
+def timed(func, repeat: int = 5) -> float:
+    """Return the best wall time of func in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+def make_templates(port_count: int) -> dict:
+    """Build a synthetic templates dict with port_count port entries."""
+    with open(enumcsh.DEFAULT_TEMPLATES_PATH) as f:
+        base = json.load(f)
+    generic = base["ports"]["unknown"]
+    templates = {"ports": {}, "services": {}}
+    for port in range(1, port_count + 1):
+        name = f"svc{port}"
+        templates["ports"][str(port)] = {
+            "service": name,
+            "description": f"Synthetic service {port}",
+            "nmap": f"nmap -sV -p {port} -sC --script={name}-* {{target}}",
+            "metasploit": list(generic["metasploit"]),
+            "manual": list(generic["manual"]),
+        }
+        templates["services"][name] = str(port)
+    templates["ports"]["unknown"] = generic
+    return templates
+
+def make_nmap_output(open_ports: int) -> str:
+    """Build normal Nmap output listing open_ports open TCP ports."""
+    lines = [
+        "Starting Nmap 7.94 ( https://nmap.org )",
+        "Nmap scan report for 10.0.0.5",
+        "Host is up (0.00026s latency).",
+        "PORT      STATE SERVICE",
+    ]
+    lines.extend(f"{port}/tcp open  unknown" for port in range(1, open_ports + 1))
+    lines.append("Nmap done: 1 IP address (1 host up) scanned in 0.05 seconds")
+    return "\n".join(lines) + "\n"
+
+def bench_load_templates(workdir: Path, sizes) -> dict:
+    results = {}
+    for size in sizes:
+        path = workdir / f"templates_{size}.json"
+        with open(path, "w") as f:
+            json.dump(make_templates(size), f)
+        cache_path = enumcsh.template_cache_path(path)
+        
+        def build():
+            if cache_path.exists():
+                os.remove(cache_path)
+            enumcsh.load_templates(path)
+        
+        results[str(size)] = {
+            "json_ms": round(timed(lambda: enumcsh.load_templates(path, use_cache=False)), 3),
+            "cache_build_ms": round(timed(build, repeat=2), 3),
+            "cache_load_ms": round(timed(lambda: enumcsh.load_templates(path)), 3),
+        }
+    return results
+
+def bench_rendering(iterations: int) -> dict:
+    templates = make_templates(1000)
+    ports = [str(port) for port in range(1, 201)]
+    text = templates["ports"]["unknown"]["manual"][0]
+    
+    def render():
+        for index in range(iterations):
+            enumcsh.render_template(text, target="10.0.0.5", port=ports[index % len(ports)])
+    
+    def plans():
+        for port in ports:
+            enumcsh.build_port_plan(port, templates, "10.0.0.5")
+    
+    def display(plain: bool):
+        from rich.console import Console
+        
+        rich_console = Console(file=io.StringIO(), width=120, force_terminal=True)
+        plain_console = enumcsh.PlainConsole(io.StringIO())
+        with patch("enumcsh.console", plain_console if plain else rich_console), \
+                patch("enumcsh.PLAIN_OUTPUT", plain):
+            for port in ports:
+                enumcsh.display_port_info(port, templates, "10.0.0.5")
+    
+    def display_batch():
+        from rich.console import Console
+        
+        # How scan renders a host's ports
+        with patch("enumcsh.console", Console(file=io.StringIO(), width=120, force_terminal=True)):
+            enumcsh.display_ports_info(ports, templates, "10.0.0.5")
+    
+    render_ms = timed(render)
+    return {
+        "render_template_per_sec": round(iterations / (render_ms / 1000)),
+        "build_port_plan_200_ms": round(timed(plans), 3),
+        "display_port_info_rich_200_ms": round(timed(lambda: display(False), repeat=3), 3),
+        "display_port_plans_rich_batch_200_ms": round(timed(display_batch, repeat=3), 3),
+        "display_port_info_plain_200_ms": round(timed(lambda: display(True), repeat=3), 3),
+        "format_plans_json_200_ms": round(timed(
+            lambda: enumcsh.format_plans([enumcsh.build_port_plan(p, templates, "h") for p in ports], "json")
+        ), 3),
+    }
+
+def bench_nmap_parsing(workdir: Path, sizes) -> dict:
+    bin_dir = workdir / "bin"
+    bin_dir.mkdir(exist_ok=True)
+    stub = bin_dir / "nmap"
+    stub.write_text(FAKE_NMAP)
+    stub.chmod(stub.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    
+    results = {}
+    for size in sizes:
+        output_path = workdir / f"nmap_{size}.txt"
+        output = make_nmap_output(size)
+        output_path.write_text(output)
+        
+        def parse_only():
+            for line in output.splitlines():
+                enumcsh.parse_nmap_line(line)
+        
+        environ = {"PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}", "FAKE_NMAP_OUTPUT": str(output_path)}
+        with patch.dict(os.environ, environ), patch("enumcsh.console", enumcsh.PlainConsole(io.StringIO())):
+            found = enumcsh.run_nmap_scan("10.0.0.5", "1-65535")
+            if len(found) != size:
+                raise RuntimeError(f"Fake nmap run found {len(found)} ports, expected {size}")
+            scan_ms = timed(lambda: enumcsh.run_nmap_scan("10.0.0.5", "1-65535"), repeat=3)
+        
+        results[str(size)] = {
+            "parse_lines_ms": round(timed(parse_only), 3),
+            "run_nmap_scan_ms": round(scan_ms, 3),
+        }
+    return results
+
+def run_on_tty(command: list) -> None:
+    """Run command with stdout on a pseudo-terminal, draining its output, and check the exit code."""
+    import pty
+    
+    master, slave = pty.openpty()
+    try:
+        process = subprocess.Popen(command, cwd=ROOT, stdout=slave)
+    finally:
+        os.close(slave)
+    try:
+        while True:
+            try:
+                if not os.read(master, 65536):
+                    break
+            except OSError:
+                # EIO once the child has closed the terminal
+                break
+    finally:
+        os.close(master)
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+def bench_cold_start(runs: int) -> dict:
+    results = {}
+    # Rich output is only used when stdout is a terminal, so that case runs on a pty
+    commands = {
+        "plain_port": (["--plain", "port", "-p", "80", "-t", "10.0.0.5"], False),
+        "rich_port": (["port", "-p", "80", "-t", "10.0.0.5"], True),
+        "help": (["--help"], False),
+    }
+    for name, (args, tty) in commands.items():
+        command = [sys.executable, str(ROOT / "enumcsh.py"), *args]
+        if tty:
+            run = functools.partial(run_on_tty, command)
+        else:
+            run = functools.partial(subprocess.run, command, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        run()
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = {"median_ms": round(statistics.median(timings), 2), "min_ms": round(min(timings), 2)}
+    return results
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """Flatten nested results into {"a.b.c": value}."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+def find_regressions(current: dict, baseline: dict, tolerance: float) -> list:
+    """Return metrics that got worse than the baseline by more than tolerance."""
+    regressions = []
+    now = flatten(current["benchmarks"])
+    before = flatten(baseline.get("benchmarks", {}))
+    for name, value in now.items():
+        old = before.get(name)
+        if not old:
+            continue
+        # Throughput metrics are better when higher, timings when lower
+        ratio = old / value if name.endswith("_per_sec") else value / old
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {old} -> {value}")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT_PATH, help="Where to write the JSON results")
+    parser.add_argument("--baseline", type=Path, help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging (0.25 = 25%%)")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and fewer runs")
+    parser.add_argument("--startup-runs", type=int, default=10, help="Cold starts per CLI command")
+    args = parser.parse_args()
+    
+    template_sizes = TEMPLATE_SIZES[:2] if args.quick else TEMPLATE_SIZES
+    nmap_sizes = NMAP_OUTPUT_SIZES[:2] if args.quick else NMAP_OUTPUT_SIZES
+    startup_runs = 3 if args.quick else args.startup_runs
+    
+    benchmarks = {}
+    with tempfile.TemporaryDirectory() as tmp, patch.dict(os.environ, {"ENUMCSH_NO_DAEMON": "1"}):
+        workdir = Path(tmp)
+        benchmarks["load_templates"] = bench_load_templates(workdir, template_sizes)
+        benchmarks["rendering"] = bench_rendering(20000 if args.quick else 200000)
+        if os.name == "posix":
+            benchmarks["nmap_parsing"] = bench_nmap_parsing(workdir, nmap_sizes)
+        benchmarks["cold_start"] = bench_cold_start(startup_runs)
+    
+    results = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "versions": {},
+        "benchmarks": benchmarks,
+    }
+    for package in ("typer", "rich", "pygments"):
+        with contextlib.suppress(Exception):
+            from importlib.metadata import version
+            results["versions"][package] = version(package)
+    
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(benchmarks, indent=2))
+    print(f"Results written to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Startup budget check for enumCSh.
+
+Times `enumcsh --plain port` cold starts, compares the median against the
+startup budget and appends the result to a JSON Lines history file so the
+numbers can be tracked over time. Going over budget is a warning unless
+--strict is passed, since the timings depend heavily on the machine.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Target median wall time for `enumcsh --plain port -p 80`
+STARTUP_BUDGET_MS = 150.0
+
+DEFAULT_HISTORY_PATH = ROOT / "benchmarks" / "startup_history.jsonl"
+
+def git_revision() -> str:
+    """Return the current git revision, or an empty string outside a checkout."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        )
+        return result.stdout.strip()
+    except OSError:
+        return ""
+
+def measure_startup(runs: int, command: list) -> list:
+    """Run the command several times and return wall times in milliseconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=15, help="Number of cold starts to time")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS, help="Budget for the median in ms")
+    parser.add_argument("--history", type=Path, default=DEFAULT_HISTORY_PATH, help="JSON Lines history file")
+    parser.add_argument("--no-history", action="store_true", help="Do not record this run")
+    parser.add_argument("--strict", action="store_true", help="Exit with status 1 when over budget")
+    args = parser.parse_args()
+    
+    command = [sys.executable, str(ROOT / "enumcsh.py"), "--plain", "port", "-p", "80", "-t", "10.0.0.1"]
+    # Warm the OS file cache and the compiled templates cache first
+    measure_startup(1, command)
+    timings = measure_startup(args.runs, command)
+    
+    record = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "median_ms": round(statistics.median(timings), 2),
+        "min_ms": round(min(timings), 2),
+        "max_ms": round(max(timings), 2),
+        "budget_ms": args.budget,
+    }
+    record["within_budget"] = record["median_ms"] <= args.budget
+    
+    if not args.no_history:
+        args.history.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.history, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    
+    status = "OK" if record["within_budget"] else "OVER BUDGET"
+    print(f"startup median {record['median_ms']} ms (budget {args.budget} ms): {status}")
+    if not record["within_budget"]:
+        if args.strict:
+            return 1
+        print("warning: startup is over budget (pass --strict to fail)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
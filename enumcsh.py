@@ -17,31 +17,403 @@ ASCII_BANNER = r"""
          v0.1.0 - Happy Hacking!
 """
 
+import bisect
+import collections
+import contextlib
+import functools
+import hashlib
+import ipaddress
+import itertools
 import json
+import mmap
+import marshal
 import os
+import queue
+import re
+import shlex
+import shutil
 import subprocess
 import sys
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Iterable, Iterator, Tuple
 
 import typer
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
-from rich.syntax import Syntax
+
+# Rich (and pygments behind rich.syntax) and concurrent.futures are imported
+# inside the functions that use them, so quick lookups start fast.
+
+class LazyConsole:
+    """Rich console proxy that only imports rich on first use."""
+    
+    def __init__(self):
+        self._console = None
+    
+    def __getattr__(self, name: str) -> Any:
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return getattr(self._console, name)
+
+# Rich markup tags used in this module's messages, e.g. [bold red]...[/bold red]
+MARKUP_PATTERN = re.compile(
+    r"\[/?(?:bold|dim|italic|underline|red|green|yellow|blue|magenta|cyan|white)"
+    r"(?: (?:red|green|yellow|blue|magenta|cyan|white))?\]"
+)
+
+class PlainConsole:
+    """Console for --plain and non-TTY output that writes text without importing rich."""
+    
+    def __init__(self, file=None):
+        self.file = file
+        self._rich_console = None
+    
+    def print(self, *objects: Any, **kwargs: Any) -> None:
+        file = self.file or sys.stdout
+        for obj in objects:
+            if isinstance(obj, str):
+                file.write(MARKUP_PATTERN.sub("", obj) + "\n")
+                continue
+            # Tables and panels still need rich, without colors
+            if self._rich_console is None:
+                from rich.console import Console
+                self._rich_console = Console(file=file, no_color=True, highlight=False)
+            self._rich_console.print(obj)
 
 # Initialize Typer app and Rich console
 app = typer.Typer(help="Port enumeration cheatsheet CLI tool")
-console = Console()
+console = LazyConsole()
+
+# Set by --plain or when stdout is not a terminal
+PLAIN_OUTPUT = False
+
+def set_plain_output(enabled: bool = True) -> None:
+    """Switch all output to plain text (no banner, colors or syntax highlighting)."""
+    global PLAIN_OUTPUT, console
+    PLAIN_OUTPUT = enabled
+    console = PlainConsole() if enabled else LazyConsole()
+
+# Callbacks that receive every trace event; see add_trace_hook
+_TRACE_HOOKS: List[Callable[[Dict[str, Any]], None]] = []
+
+# Trace timestamps are relative to module import
+TRACE_EPOCH = time.perf_counter()
+
+def add_trace_hook(hook: Callable[[Dict[str, Any]], None]) -> Callable[[Dict[str, Any]], None]:
+    """Subscribe to timing events. Returns the hook, so it can be used as a decorator.
+
+    Each event is a Chrome trace-event dict, e.g. {"name": "nmap_scan", "cat":
+    "phase", "ph": "X", "ts": ..., "dur": ..., "args": {"cpu_ms": ...}} with
+    times in microseconds. Hooks run in the thread that finished the phase.
+    """
+    _TRACE_HOOKS.append(hook)
+    return hook
+
+def remove_trace_hook(hook: Callable[[Dict[str, Any]], None]) -> None:
+    """Unsubscribe a hook added with add_trace_hook."""
+    if hook in _TRACE_HOOKS:
+        _TRACE_HOOKS.remove(hook)
+
+@contextlib.contextmanager
+def trace_phase(name: str, category: str = "phase", **args: Any) -> Iterator[Dict[str, Any]]:
+    """Time a block and send it to the trace hooks as a complete ("X") event.
+
+    Yields the event's args dict, so the block can attach results such as a
+    return code. Records wall time plus thread and process CPU time, and for
+    the "child" category the CPU time of child processes that exited meanwhile
+    (shared by children running concurrently). Costs nothing beyond the yield
+    when no hook is subscribed.
+    """
+    if not _TRACE_HOOKS:
+        yield args
+        return
+    start = time.perf_counter()
+    thread_cpu = time.thread_time()
+    process_cpu = time.process_time()
+    children_cpu = children_cpu_time() if category == "child" else 0.0
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        args["cpu_ms"] = round((time.thread_time() - thread_cpu) * 1000, 3)
+        args["process_cpu_ms"] = round((time.process_time() - process_cpu) * 1000, 3)
+        if category == "child":
+            args["children_cpu_ms"] = round((children_cpu_time() - children_cpu) * 1000, 3)
+        emit_trace_event(name, category, start, end - start, args)
+
+def emit_trace_event(name: str, category: str, start: float, duration: float, args: Dict[str, Any]) -> None:
+    """Send a complete ("X") event to the trace hooks; start is a perf_counter() value.
+
+    For phases that cannot be wrapped in one block, such as parsing that is
+    interleaved with a child's output.
+    """
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": round((start - TRACE_EPOCH) * 1e6, 1),
+        "dur": round(duration * 1e6, 1),
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "args": args,
+    }
+    for hook in list(_TRACE_HOOKS):
+        hook(event)
+
+def children_cpu_time() -> float:
+    """Return the user + system CPU seconds of all waited-for child processes."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def peak_memory() -> Dict[str, Optional[int]]:
+    """Return the peak resident memory of this process and of its largest child, in KiB."""
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return {"peak_rss_kb": None, "children_peak_rss_kb": None}
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    scale = 1024 if sys.platform == "darwin" else 1
+    return {
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        "children_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale,
+    }
+
+class TraceRecorder:
+    """Trace hook that collects events and writes them as Chrome trace-event JSON.
+
+    The file opens in chrome://tracing or https://ui.perfetto.dev.
+    """
+    
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+    
+    def __call__(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self.events.append(event)
+    
+    def phase_totals(self) -> List[Dict[str, Any]]:
+        """Return per-phase count, total and max wall time and total CPU time, slowest first."""
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault((event["cat"], event["name"]), {
+                "category": event["cat"], "name": event["name"], "count": 0, "wall_ms": 0.0, "max_ms": 0.0, "cpu_ms": 0.0,
+            })
+            wall_ms = event["dur"] / 1000
+            total["count"] += 1
+            total["wall_ms"] += wall_ms
+            total["max_ms"] = max(total["max_ms"], wall_ms)
+            # Child processes are charged their own CPU time, not the waiting thread's
+            total["cpu_ms"] += event["args"].get("children_cpu_ms", event["args"].get("cpu_ms", 0.0))
+        return sorted(totals.values(), key=lambda total: total["wall_ms"], reverse=True)
+    
+    def summary(self) -> Dict[str, Any]:
+        return {"phases": self.phase_totals(), **peak_memory()}
+    
+    def write(self, path: Path) -> None:
+        summary = self.summary()
+        events = list(self.events)
+        # Memory high-water marks as a counter track at the end of the run
+        events.append({
+            "name": "peak_memory_kb", "ph": "C", "ts": round((time.perf_counter() - TRACE_EPOCH) * 1e6, 1),
+            "pid": os.getpid(), "args": {key: value or 0 for key, value in peak_memory().items()},
+        })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": summary}, f, indent=1)
+
+def display_trace_summary(recorder: TraceRecorder) -> None:
+    """Display per-phase timings and peak memory."""
+    from rich.table import Table
+    
+    table = Table(title="Profile")
+    table.add_column("Phase")
+    table.add_column("Kind")
+    table.add_column("Count", justify="right")
+    table.add_column("Wall (ms)", justify="right")
+    table.add_column("Max (ms)", justify="right")
+    table.add_column("CPU (ms)", justify="right")
+    for total in recorder.phase_totals():
+        table.add_row(
+            total["name"], total["category"], str(total["count"]),
+            f"{total['wall_ms']:.1f}", f"{total['max_ms']:.1f}", f"{total['cpu_ms']:.1f}"
+        )
+    console.print(table)
+    memory = peak_memory()
+    if memory["peak_rss_kb"] is not None:
+        console.print(
+            f"Peak memory: {memory['peak_rss_kb'] / 1024:.1f} MiB "
+            f"(largest child {memory['children_peak_rss_kb'] / 1024:.1f} MiB)"
+        )
 
 # Default templates file path
 DEFAULT_TEMPLATES_PATH = Path(os.path.dirname(os.path.abspath(__file__))) / "templates.json"
 
-def load_templates(templates_path: Path = DEFAULT_TEMPLATES_PATH) -> Dict[str, Any]:
-    """Load enumeration templates from JSON file."""
+# Bump when the layout or the index rules of the compiled templates cache change
+TEMPLATE_CACHE_VERSION = 6
+
+# Placeholders such as {target} and {port} inside template commands
+PLACEHOLDER_PATTERN = re.compile(r"\{(\w+)\}")
+
+# Bounds for tokenized template strings and for rendered (template, values) results
+COMPILE_CACHE_SIZE = 1024
+RENDER_CACHE_SIZE = 4096
+
+def compile_template(text: str) -> Tuple[Tuple[bool, str], ...]:
+    """Split a template string into (is_placeholder, text) tokens."""
+    tokens = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        if match.start() > position:
+            tokens.append((False, text[position:match.start()]))
+        tokens.append((True, match.group(1)))
+        position = match.end()
+    if position < len(text):
+        tokens.append((False, text[position:]))
+    return tuple(tokens)
+
+_compile_cached = functools.lru_cache(maxsize=COMPILE_CACHE_SIZE)(compile_template)
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render_cached(text: str, values: Tuple[Tuple[str, str], ...]) -> str:
+    tokens = _compile_cached(text)
+    lookup = dict(values)
+    return "".join(
+        lookup.get(part, "{" + part + "}") if is_placeholder else part
+        for is_placeholder, part in tokens
+    )
+
+def render_template(text: str, **values: str) -> str:
+    """Fill the placeholders of a template string. Unknown placeholders are kept.
+
+    Results are memoized per (template, values) in a bounded LRU cache, so
+    repeated lookups of the same port and target cost a dict hit.
+    """
+    return _render_cached(text, tuple(sorted(values.items())))
+
+def iter_template_strings(templates: Dict[str, Any]) -> Iterator[str]:
+    """Yield every command string in the templates that may contain placeholders."""
+    for port_data in templates.get("ports", {}).values():
+        for key in ("nmap", "metasploit", "manual"):
+            value = port_data.get(key)
+            if isinstance(value, str):
+                yield value
+            elif isinstance(value, list):
+                yield from value
+        for step in port_data.get("steps", []):
+            if "cmd" in step:
+                yield step["cmd"]
+
+def template_cache_path(templates_path: Path) -> Path:
+    """Return the compiled cache path that sits next to a templates file."""
+    templates_path = Path(templates_path)
+    return templates_path.with_name(f".{templates_path.name}.cache")
+
+def read_template_cache(cache_path: Path) -> Optional[Dict[str, Any]]:
+    """Read a compiled templates cache, returning None if it is missing or unreadable.
+
+    The cache holds plain data (dicts, lists, tuples, strings) stored with
+    marshal. marshal is not hardened against crafted input, so the cache is
+    only as trustworthy as the directory of the templates file it sits in.
+    """
     try:
-        with open(templates_path, "r") as f:
-            return json.load(f)
+        with open(cache_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            payload = marshal.loads(data)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != TEMPLATE_CACHE_VERSION:
+        return None
+    return payload
+
+def write_template_cache(cache_path: Path, payload: Dict[str, Any]) -> None:
+    """Atomically write a compiled templates cache. Failures are ignored."""
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            marshal.dump(payload, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def share_strings(value: Any, seen: Dict[str, str]) -> Any:
+    """Return value with equal strings replaced by one shared object.
+
+    marshal writes a shared string once and back-references it afterwards,
+    which halves the cache of a typical templates file and its load time.
+    """
+    if isinstance(value, str):
+        return seen.setdefault(value, value)
+    if isinstance(value, dict):
+        return {share_strings(key, seen): share_strings(item, seen) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(share_strings(item, seen) for item in value)
+    return value
+
+def build_template_cache(templates_path: Path, stat: os.stat_result) -> Dict[str, Any]:
+    """Parse a templates file and compile it into a cache payload."""
+    with open(templates_path, "rb") as f:
+        raw = f.read()
+    templates = share_strings(json.loads(raw), {})
+    return {
+        "version": TEMPLATE_CACHE_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": hashlib.sha256(raw).hexdigest(),
+        "templates": templates,
+        "index": TemplateIndex(templates).to_data(),
+    }
+
+def load_compiled_templates(templates_path: Path) -> Dict[str, Any]:
+    """Load templates through the compiled cache, rebuilding it when the file changed.
+
+    The cache is keyed on the templates file's mtime and size; when those
+    differ the content hash decides whether a rebuild is really needed.
+    """
+    stat = os.stat(templates_path)
+    cache_path = template_cache_path(templates_path)
+    payload = read_template_cache(cache_path)
+    
+    if payload is None or (payload["mtime_ns"], payload["size"]) != (stat.st_mtime_ns, stat.st_size):
+        with open(templates_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if payload is not None and payload["sha256"] == digest:
+            # Touched but unchanged: refresh the cache key only
+            payload.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        else:
+            payload = build_template_cache(templates_path, stat)
+        write_template_cache(cache_path, payload)
+    
+    templates = payload["templates"]
+    _TEMPLATE_INDEX_CACHE.update(
+        templates=templates,
+        index=TemplateIndex.from_data(payload["index"]),
+        search=None,
+        signatures=None,
+    )
+    return templates
+
+def load_templates(templates_path: Path = DEFAULT_TEMPLATES_PATH, use_cache: bool = True) -> Dict[str, Any]:
+    """Load enumeration templates from JSON file.
+
+    Uses the compiled cache next to the file unless use_cache is False or
+    ENUMCSH_NO_CACHE is set.
+    """
+    use_cache = use_cache and not os.environ.get("ENUMCSH_NO_CACHE")
+    try:
+        with trace_phase("load_templates", path=str(templates_path), cached=use_cache):
+            if use_cache:
+                return load_compiled_templates(templates_path)
+            with open(templates_path, "r") as f:
+                return json.load(f)
     except FileNotFoundError:
         console.print(f"[bold red]Error:[/bold red] Templates file not found at {templates_path}")
         console.print("Creating default templates file...")
@@ -49,6 +421,443 @@ def load_templates(templates_path: Path = DEFAULT_TEMPLATES_PATH) -> Dict[str, A
         with open(templates_path, "r") as f:
             return json.load(f)
 
+def parse_port_key(key: str) -> Optional[Tuple[str, List[Tuple[int, int]]]]:
+    """Parse a template key into (protocol, [(start, end), ...]).
+
+    Supported keys: "80", "161/udp", "6000-6063", "8000,8080,8443/tcp".
+    Returns None for keys that are not port specs, such as "unknown".
+    """
+    spec, _, protocol = key.strip().partition("/")
+    protocol = protocol.lower() or "tcp"
+    ranges = []
+    for part in spec.split(","):
+        start, _, end = part.strip().partition("-")
+        if not start.isdigit() or (end and not end.isdigit()):
+            return None
+        ranges.append((int(start), int(end or start)))
+    return protocol, ranges
+
+class TemplateIndex:
+    """Port lookup index supporting ranges, protocols and multi-port keys.
+
+    Single ports live in a dict; ranges are kept sorted by start so a lookup
+    is a bisect plus a short walk bounded by the running maximum range end.
+    """
+    
+    def __init__(self, templates: Optional[Dict[str, Any]] = None):
+        self.exact: Dict[str, str] = {}
+        self.ranges: Dict[str, List[Tuple[int, int, str]]] = {}
+        # Exact entries that came from a comma list, which a single-port key may replace
+        self._listed = set()
+        if templates is not None:
+            for key in templates.get("ports", {}):
+                self.add(key)
+            self._build()
+    
+    def add(self, key: str) -> None:
+        """Add a template key to the index."""
+        parsed = parse_port_key(key)
+        if parsed is None:
+            return
+        protocol, ranges = parsed
+        single = len(ranges) == 1
+        for start, end in ranges:
+            if start == end:
+                port = f"{start}/{protocol}"
+                # A single-port key wins over a comma list whatever their order; otherwise the first key wins
+                if port not in self.exact or (single and port in self._listed):
+                    self.exact[port] = key
+                    if single:
+                        self._listed.discard(port)
+                    else:
+                        self._listed.add(port)
+            else:
+                self.ranges.setdefault(protocol, []).append((start, end, key))
+    
+    def _build(self) -> None:
+        self._starts = {}
+        self._max_ends = {}
+        for protocol, ranges in self.ranges.items():
+            ranges.sort()
+            max_ends = []
+            highest = -1
+            for _, end, _ in ranges:
+                highest = max(highest, end)
+                max_ends.append(highest)
+            self._starts[protocol] = [start for start, _, _ in ranges]
+            self._max_ends[protocol] = max_ends
+    
+    def lookup(self, port: str, protocol: str = "tcp") -> Optional[str]:
+        """Return the template key for a port such as "80" or "161/udp"."""
+        number, _, explicit_protocol = str(port).partition("/")
+        protocol = (explicit_protocol or protocol).lower()
+        if not number.isdigit():
+            return None
+        number = int(number)
+        
+        key = self.exact.get(f"{number}/{protocol}")
+        if key is not None:
+            return key
+        
+        ranges = self.ranges.get(protocol)
+        if not ranges:
+            return None
+        starts = self._starts[protocol]
+        max_ends = self._max_ends[protocol]
+        best = None
+        index = bisect.bisect_right(starts, number) - 1
+        while index >= 0 and max_ends[index] >= number:
+            start, end, key = ranges[index]
+            if end >= number and (best is None or end - start < best[1] - best[0]):
+                # Prefer the narrowest matching range
+                best = (start, end, key)
+            index -= 1
+        return best[2] if best else None
+    
+    def to_data(self) -> Dict[str, Any]:
+        """Return the index as plain data for the compiled templates cache."""
+        return {"exact": self.exact, "ranges": {protocol: [tuple(r) for r in ranges] for protocol, ranges in self.ranges.items()}}
+    
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> "TemplateIndex":
+        """Rebuild an index from data produced by to_data."""
+        index = cls()
+        index.exact = dict(data["exact"])
+        index.ranges = {protocol: [tuple(r) for r in ranges] for protocol, ranges in data["ranges"].items()}
+        index._build()
+        return index
+
+# Index for the most recently loaded templates
+_TEMPLATE_INDEX_CACHE: Dict[str, Any] = {"templates": None, "index": None, "search": None, "signatures": None}
+
+def get_template_index(templates: Dict[str, Any]) -> TemplateIndex:
+    """Return the port index for a templates dict, building it if needed."""
+    if _TEMPLATE_INDEX_CACHE["templates"] is not templates:
+        _TEMPLATE_INDEX_CACHE.update(templates=templates, index=None, search=None, signatures=None)
+    if _TEMPLATE_INDEX_CACHE["index"] is None:
+        _TEMPLATE_INDEX_CACHE["index"] = TemplateIndex(templates)
+    return _TEMPLATE_INDEX_CACHE["index"]
+
+def get_search_index(templates: Dict[str, Any]) -> "SearchIndex":
+    """Return the search index for a templates dict, building it on first use.
+
+    Only search, service misses and completion need it, so it is not part of
+    the compiled cache that every lookup loads.
+    """
+    if _TEMPLATE_INDEX_CACHE["templates"] is not templates:
+        _TEMPLATE_INDEX_CACHE.update(templates=templates, index=None, search=None, signatures=None)
+    if _TEMPLATE_INDEX_CACHE["search"] is None:
+        _TEMPLATE_INDEX_CACHE["search"] = SearchIndex(templates)
+    return _TEMPLATE_INDEX_CACHE["search"]
+
+def find_port_template(port: str, templates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return the template for a port, or None if only the generic template applies."""
+    port_data = templates["ports"].get(port)
+    if port_data is not None:
+        return port_data
+    key = get_template_index(templates).lookup(port)
+    return templates["ports"][key] if key is not None else None
+
+def service_template_keys(service: str, templates: Dict[str, Any]) -> List[str]:
+    """Return the template keys a service name maps to (case-insensitive)."""
+    keys = templates["services"].get(service.lower(), [])
+    return [keys] if isinstance(keys, str) else list(keys)
+
+def template_key_ports(key: str) -> List[str]:
+    """Return concrete ports to render a template key with.
+
+    Comma lists give each member port and ranges their first port, so
+    "8000,8080" gives ["8000", "8080"] and "6000-6063" gives ["6000"].
+    Non-TCP ports keep their protocol, e.g. "161/udp".
+    """
+    parsed = parse_port_key(key)
+    if parsed is None:
+        return [key]
+    protocol, ranges = parsed
+    suffix = "" if protocol == "tcp" else f"/{protocol}"
+    return [f"{start}{suffix}" for start, _ in ranges]
+
+def resolve_service_ports(service: str, templates: Dict[str, Any]) -> List[str]:
+    """Return the concrete ports for a service name (case-insensitive)."""
+    ports = []
+    for key in service_template_keys(service, templates):
+        for port in template_key_ports(key):
+            if port not in ports:
+                ports.append(port)
+    return ports
+
+# Hard-coded port references in single-port templates, e.g. "-p 22" or "{target}:8443"
+TEMPLATE_PORT_PATTERN = r"(-p |\{{target\}}[ :]){}\b"
+
+def retarget_template(port_data: Dict[str, Any], template_port: str) -> Dict[str, Any]:
+    """Return a copy of a single-port template with its hard-coded port replaced by {port}.
+
+    Used when a service's template is applied to a port other than its usual one.
+    """
+    pattern = re.compile(TEMPLATE_PORT_PATTERN.format(re.escape(template_port)))
+    
+    def retarget(command: str) -> str:
+        command = pattern.sub(lambda match: match.group(1) + "{port}", command)
+        # URLs on the default port leave the port out
+        return command.replace("://{target}/", "://{target}:{port}/")
+    
+    retargeted = dict(port_data)
+    for key in ("nmap", "metasploit", "manual"):
+        value = port_data.get(key)
+        if isinstance(value, str):
+            retargeted[key] = retarget(value)
+        elif isinstance(value, list):
+            retargeted[key] = [retarget(cmd) for cmd in value]
+    if "steps" in port_data:
+        retargeted["steps"] = [
+            dict(step, cmd=retarget(step["cmd"])) if "cmd" in step else step for step in port_data["steps"]
+        ]
+    return retargeted
+
+def find_service_template(service: str, templates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return the template of a service (name or alias), ready to render for any port."""
+    ports = find_service_ports(service, templates)
+    port_data = find_port_template(ports[0], templates) if ports else None
+    if port_data is None:
+        return None
+    return retarget_template(port_data, ports[0]) if ports[0].isdigit() else port_data
+
+def resolve_port_template(port: str, templates: Dict[str, Any], service: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Return the template for a port, or for the service identified on it if the port has none."""
+    port_data = find_port_template(port, templates)
+    if port_data is None and service:
+        port_data = find_service_template(service, templates)
+    return port_data
+
+# Words in service names, descriptions and commands, e.g. "microsoft-ds" or "smbclient"
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+WORD_SEPARATOR_PATTERN = re.compile(r"[-_.]")
+
+def word_trigrams(word: str) -> set:
+    """Return the trigrams of a word padded with spaces, e.g. " sm", "smb", "mb "."""
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    """Fuzzy search over template service names, aliases, descriptions and commands.
+
+    Every word is indexed as a term with a per-template weight (names count
+    more than descriptions, descriptions more than command text). Query words
+    are matched against terms exactly, by prefix (bisect over the sorted
+    vocabulary) and by trigram similarity.
+    """
+    
+    FIELD_WEIGHTS = {"name": 3.0, "description": 2.0, "command": 1.0}
+    MIN_SIMILARITY = 0.4
+    
+    def __init__(self, templates: Optional[Dict[str, Any]] = None):
+        self.docs: List[str] = []
+        self.terms: Dict[str, Dict[int, float]] = {}
+        self.grams: Dict[str, List[str]] = {}
+        self.vocabulary: List[str] = []
+        self.names: List[str] = []
+        self._terms_cache: Dict[Tuple[str, bool], List[str]] = {}
+        if templates is not None:
+            names_by_key = {}
+            for name, keys in templates.get("services", {}).items():
+                for key in [keys] if isinstance(keys, str) else keys:
+                    names_by_key.setdefault(key, []).append(name)
+            for key, port_data in templates.get("ports", {}).items():
+                if key != "unknown":
+                    self.add_document(key, port_data, names_by_key.get(key, []))
+            self._build()
+    
+    def add_document(self, key: str, port_data: Dict[str, Any], names: Iterable[str] = ()) -> None:
+        """Index one port template under its key."""
+        doc = len(self.docs)
+        self.docs.append(key)
+        fields = {
+            "name": [key, port_data.get("service", ""), *port_data.get("aliases", []), *names],
+            "description": [port_data.get("description", "")],
+            "command": list(iter_template_strings({"ports": {key: port_data}})),
+        }
+        weights = {}
+        for field, texts in fields.items():
+            weight = self.FIELD_WEIGHTS[field]
+            for text in texts:
+                for term in self._text_terms(text, field == "name"):
+                    if weight > weights.get(term, 0.0):
+                        weights[term] = weight
+                if field == "name":
+                    self.names.extend(WORD_PATTERN.findall(text.lower()))
+        for term, weight in weights.items():
+            self.terms.setdefault(term, {})[doc] = weight
+    
+    def _text_terms(self, text: str, keep_numbers: bool) -> List[str]:
+        """Return the index terms of a text: words, plus the parts of compound words."""
+        cache_key = (text, keep_numbers)
+        terms = self._terms_cache.get(cache_key)
+        if terms is None:
+            terms = set()
+            for word in WORD_PATTERN.findall(text.lower()):
+                terms.add(word)
+                if any(separator in word for separator in "-_."):
+                    terms.update(part for part in WORD_SEPARATOR_PATTERN.split(word) if part)
+            if not keep_numbers:
+                terms = {term for term in terms if not term.isdigit()}
+            # Template command lines repeat across ports, so remember their terms
+            terms = self._terms_cache[cache_key] = list(terms)
+        return terms
+    
+    def _build(self) -> None:
+        self._terms_cache = {}
+        self.vocabulary = sorted(self.terms)
+        self.names = sorted(set(self.names))
+        self.grams = {}
+        for term in self.vocabulary:
+            for gram in word_trigrams(term):
+                self.grams.setdefault(gram, []).append(term)
+    
+    def _match_terms(self, word: str) -> Dict[str, float]:
+        """Return {term: similarity} for terms that match a query word."""
+        matches = {}
+        query_grams = word_trigrams(word)
+        shared = {}
+        for gram in query_grams:
+            for term in self.grams.get(gram, ()):
+                shared[term] = shared.get(term, 0) + 1
+        for term, count in shared.items():
+            similarity = count / (len(query_grams) + len(term) - count)
+            if similarity >= self.MIN_SIMILARITY:
+                matches[term] = similarity
+        
+        # Prefix matches rank just below an exact match
+        index = bisect.bisect_left(self.vocabulary, word)
+        while index < len(self.vocabulary) and self.vocabulary[index].startswith(word):
+            term = self.vocabulary[index]
+            matches[term] = 1.0 if term == word else max(matches.get(term, 0.0), 0.9)
+            index += 1
+        return matches
+    
+    def search(self, query: str, limit: int = 10) -> List[Tuple[float, str]]:
+        """Return up to limit (score, template key) pairs, best first. Scores are 0-1."""
+        words = WORD_PATTERN.findall(query.lower())
+        if not words:
+            return []
+        scores = {}
+        for word in words:
+            best = {}
+            for term, similarity in self._match_terms(word).items():
+                for doc, weight in self.terms[term].items():
+                    best[doc] = max(best.get(doc, 0.0), similarity * weight)
+            for doc, score in best.items():
+                scores[doc] = scores.get(doc, 0.0) + score
+        
+        top_weight = self.FIELD_WEIGHTS["name"] * len(words)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.docs[item[0]]))
+        return [(round(score / top_weight, 3), self.docs[doc]) for doc, score in ranked[:limit]]
+    
+    def complete(self, prefix: str, limit: int = 20) -> List[str]:
+        """Return service names and aliases starting with prefix."""
+        prefix = prefix.lower()
+        index = bisect.bisect_left(self.names, prefix)
+        matches = []
+        while index < len(self.names) and self.names[index].startswith(prefix) and len(matches) < limit:
+            matches.append(self.names[index])
+            index += 1
+        return matches
+
+def search_templates(query: str, templates: Dict[str, Any], limit: int = 10) -> List[Tuple[float, str]]:
+    """Fuzzy search the templates, returning (score, template key) pairs."""
+    return get_search_index(templates).search(query, limit)
+
+def find_service_ports(service: str, templates: Dict[str, Any]) -> List[str]:
+    """Return the concrete ports for a service name or alias such as "microsoft-ds"."""
+    service_ports = resolve_service_ports(service, templates)
+    if service_ports:
+        return service_ports
+    # An exact name or alias hit scores 1.0
+    keys = [key for score, key in search_templates(service, templates, limit=5) if score >= 1.0]
+    return template_key_ports(keys[0]) if keys else []
+
+def service_suggestions(service: str, templates: Dict[str, Any], limit: int = 3) -> List[str]:
+    """Return "service (port)" labels for the closest matches to a service name."""
+    return [
+        f"{templates['ports'][key].get('service', key)} ({key})"
+        for _, key in search_templates(service, templates, limit=limit)
+    ]
+
+def suggest_services(service: str, templates: Dict[str, Any]) -> None:
+    """Print the closest templates for a service name that was not found."""
+    suggestions = service_suggestions(service, templates)
+    if suggestions:
+        console.print(f"[bold yellow]Did you mean:[/bold yellow] {', '.join(suggestions)}")
+
+def enable_service_completion(templates: Dict[str, Any]) -> None:
+    """Complete service names and aliases with Tab at interactive prompts, where readline exists."""
+    try:
+        import readline
+    except ImportError:
+        return
+    index = get_search_index(templates)
+    
+    def complete(text: str, state: int) -> Optional[str]:
+        matches = index.complete(text)
+        return matches[state] if state < len(matches) else None
+    
+    readline.set_completer(complete)
+    readline.set_completer_delims(" \t\n")
+    if "libedit" in (readline.__doc__ or ""):
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+
+def import_nmap_services(
+    services_path: Path,
+    templates: Dict[str, Any],
+    min_frequency: float = 0.0,
+) -> int:
+    """Add generic templates for every entry of an nmap-services style file.
+
+    Lines look like "http  80/tcp  0.484143  # World Wide Web HTTP". Existing
+    templates, including ranges and lists covering the port, are left
+    untouched; the service then maps to the port itself. Returns the number
+    of templates added.
+    """
+    generic = templates["ports"].get("unknown", {})
+    covered = TemplateIndex(templates)
+    added = 0
+    with open(services_path, "r", errors="replace") as f:
+        for line in f:
+            line, _, comment = line.partition("#")
+            fields = line.split()
+            if len(fields) < 2 or fields[0] == "unknown":
+                continue
+            name = fields[0].lower()
+            number, _, protocol = fields[1].partition("/")
+            if not number.isdigit() or protocol not in ("tcp", "udp"):
+                continue
+            try:
+                frequency = float(fields[2]) if len(fields) > 2 else 0.0
+            except ValueError:
+                frequency = 0.0
+            if frequency < min_frequency:
+                continue
+            
+            key = number if protocol == "tcp" else f"{number}/{protocol}"
+            if key not in templates["ports"] and covered.lookup(key) is None:
+                scan_type = "-sU -sV" if protocol == "udp" else "-sV -sC"
+                templates["ports"][key] = {
+                    "service": name,
+                    "description": comment.strip() or name,
+                    "nmap": f"nmap {scan_type} -p {{port}} {{target}}",
+                    "metasploit": list(generic.get("metasploit", [])),
+                    "manual": list(generic.get("manual", [])),
+                }
+                added += 1
+            
+            if key not in resolve_service_ports(name, templates):
+                keys = service_template_keys(name, templates) + [key]
+                templates["services"][name] = keys[0] if len(keys) == 1 else keys
+    
+    _TEMPLATE_INDEX_CACHE.update(templates=None, index=None, search=None)
+    return added
+
 def create_default_templates(templates_path: Path) -> None:
     """Create default templates file if it doesn't exist."""
     default_templates = {
@@ -62,7 +871,7 @@ def create_default_templates(templates_path: Path) -> None:
                     "use auxiliary/scanner/ftp/anonymous"
                 ],
                 "manual": [
-                    "ftp {target}",
+                    "ftp {target} {port}",
                     "Try anonymous:anonymous login",
                     "Check if PUT/GET commands are allowed"
                 ]
@@ -76,7 +885,7 @@ def create_default_templates(templates_path: Path) -> None:
                     "use auxiliary/scanner/ssh/ssh_enumusers"
                 ],
                 "manual": [
-                    "ssh -v {target}",
+                    "ssh -v -p {port} {target}",
                     "Check for weak credentials",
                     "Try username enumeration"
                 ]
@@ -90,7 +899,7 @@ def create_default_templates(templates_path: Path) -> None:
                     "use auxiliary/scanner/telnet/telnet_login"
                 ],
                 "manual": [
-                    "telnet {target}",
+                    "telnet {target} {port}",
                     "Check for default credentials",
                     "Look for banner information"
                 ]
@@ -135,7 +944,7 @@ def create_default_templates(templates_path: Path) -> None:
                 "manual": [
                     "curl -vk https://{target}/",
                     "gobuster dir -u https://{target}/ -w /usr/share/wordlists/dirb/common.txt -k",
-                    "sslscan {target}"
+                    "sslscan {target}:{port}"
                 ]
             },
             "3306": {
@@ -147,7 +956,7 @@ def create_default_templates(templates_path: Path) -> None:
                     "use auxiliary/scanner/mysql/mysql_login"
                 ],
                 "manual": [
-                    "mysql -h {target} -u root -p",
+                    "mysql -h {target} -P {port} -u root -p",
                     "Check for default credentials",
                     "Try common username/password combinations"
                 ]
@@ -183,91 +992,2333 @@ def create_default_templates(templates_path: Path) -> None:
         json.dump(default_templates, f, indent=4)
     console.print(f"[bold green]Created default templates at {templates_path}[/bold green]")
 
-def display_port_info(port: str, templates: Dict[str, Any], target: Optional[str] = "target") -> None:
-    """Display enumeration information for a specific port."""
-    port_data = templates["ports"].get(port)
+def make_port_plan(port: str, port_data: Dict[str, Any], target: str) -> Dict[str, Any]:
+    """Render a port template into a plan: a plain dict of ready-to-run commands."""
+    plan = {
+        "port": port,
+        "target": target,
+        "service": port_data.get("service", "unknown"),
+        "description": port_data.get("description", ""),
+        "nmap": None,
+        "metasploit": [],
+        "manual": [],
+    }
+    if "nmap" in port_data:
+        plan["nmap"] = render_template(port_data["nmap"], target=target, port=port)
+    for key in ("metasploit", "manual"):
+        if key in port_data:
+            plan[key] = [render_template(cmd, target=target, port=port) for cmd in port_data[key]]
+    return plan
+
+def build_port_plan(
+    port: str, templates: Dict[str, Any], target: str = "target", service: Optional[str] = None
+) -> Dict[str, Any]:
+    """Build the plan for a port, falling back to the generic template.
+
+    service is the service identified on the port (e.g. from its banner); its
+    template is used when the port has none. The "generic" key tells whether
+    the generic template was used.
+    """
+    port_data = resolve_port_template(port, templates, service)
+    plan = make_port_plan(port, port_data or templates["ports"]["unknown"], target)
+    plan["generic"] = port_data is None
+    if port_data is None and service:
+        plan["service"] = service
+    return plan
+
+def format_port_plain(plan: Dict[str, Any]) -> str:
+    """Format a port plan as plain text."""
+    lines = [f"Port {plan['port']} - {plan['service']} ({plan['description']})"]
+    sections = [("Nmap", [plan["nmap"]] if plan["nmap"] else []), ("Metasploit", plan["metasploit"]), ("Manual", plan["manual"])]
+    for title, commands in sections:
+        if commands:
+            lines.append(f"{title}:")
+            lines.extend("  " + cmd for cmd in commands)
+    return "\n".join(lines) + "\n"
+
+def display_port_plans(plans: List[Dict[str, Any]]) -> None:
+    """Display port plans as rich tables, or as plain text in plain mode.
+
+    All commands of the batch are syntax highlighted in one pass per language
+    and then split back into the tables, instead of one pygments pass per cell.
+    """
+    with trace_phase("render", plans=len(plans), format="plain" if PLAIN_OUTPUT else "rich"):
+        if PLAIN_OUTPUT:
+            console.print("\n".join(format_port_plain(plan) for plan in plans))
+        elif plans:
+            display_rich_port_plans(plans)
+
+def display_rich_port_plans(plans: List[Dict[str, Any]]) -> None:
+    """Display port plans as rich tables with batched syntax highlighting."""
+    from rich.syntax import Syntax
+    from rich.table import Table
     
-    if not port_data:
-        console.print(f"[bold yellow]No specific template for port {port}. Using generic template.[/bold yellow]")
-        port_data = templates["ports"]["unknown"]
-        # Replace {port} placeholder in commands
-        for key in ["nmap", "manual"]:
-            if isinstance(port_data.get(key), str):
-                port_data[key] = port_data[key].replace("{port}", port)
-            elif isinstance(port_data.get(key), list):
-                port_data[key] = [cmd.replace("{port}", port) for cmd in port_data[key]]
+    def highlight_lines(lines: List[str], lexer: str) -> List[Any]:
+        if not lines:
+            return []
+        text = Syntax("", lexer, theme="monokai").highlight("\n".join(lines))
+        text.rstrip()
+        return text.split("\n")
     
-    # Create a table for the port information
-    table = Table(title=f"Port {port} - {port_data['service']} ({port_data['description']})")
+    bash_lines = []
+    ruby_lines = []
+    for plan in plans:
+        bash_lines.extend([plan["nmap"]] if plan["nmap"] else [])
+        bash_lines.extend(plan["manual"])
+        ruby_lines.extend(plan["metasploit"])
+    bash_text = iter(highlight_lines(bash_lines, "bash"))
+    ruby_text = iter(highlight_lines(ruby_lines, "ruby"))
     
-    # Display Nmap commands
-    if "nmap" in port_data:
-        nmap_cmd = port_data["nmap"].replace("{target}", target)
-        table.add_row("Nmap", Syntax(nmap_cmd, "bash", theme="monokai"))
+    def take(lines: Iterator[Any], count: int) -> Any:
+        from rich.text import Text
+        
+        return Text("\n").join(next(lines) for _ in range(count))
+    
+    for plan in plans:
+        # Create a table for the port information
+        table = Table(title=f"Port {plan['port']} - {plan['service']} ({plan['description']})")
+        
+        # Display Nmap commands
+        if plan["nmap"]:
+            table.add_row("Nmap", take(bash_text, 1))
+        
+        # Display Metasploit commands
+        if plan["metasploit"]:
+            table.add_row("Metasploit", take(ruby_text, len(plan["metasploit"])))
+        
+        # Display manual commands
+        if plan["manual"]:
+            table.add_row("Manual", take(bash_text, len(plan["manual"])))
+        
+        console.print(table)
+
+def display_port_plan(plan: Dict[str, Any]) -> None:
+    """Display a single port plan."""
+    display_port_plans([plan])
+
+# Output formats for port plans; "rich" is the interactive default
+OUTPUT_FORMATS = ("rich", "plain", "json", "markdown", "sh")
+
+def format_plans_markdown(plans: List[Dict[str, Any]]) -> str:
+    """Format port plans as Markdown, grouped by target."""
+    parts = []
+    current_target = None
+    for plan in plans:
+        if plan["target"] != current_target:
+            current_target = plan["target"]
+            parts.append(f"## {current_target}\n")
+        parts.append(f"### Port {plan['port']} - {plan['service']} ({plan['description']})\n")
+        sections = [("Nmap", "bash", [plan["nmap"]] if plan["nmap"] else []),
+                    ("Metasploit", "text", plan["metasploit"]),
+                    ("Manual", "bash", plan["manual"])]
+        for title, language, commands in sections:
+            if commands:
+                parts.append(f"**{title}**\n\n```{language}\n" + "\n".join(commands) + "\n```\n")
+    return "\n".join(parts)
+
+def format_plans_shell(plans: List[Dict[str, Any]]) -> str:
+    """Format port plans as a shell script.
+
+    Nmap commands and manual lines whose program is installed become commands;
+    everything else (Metasploit lines, prose notes) is kept as comments.
+    """
+    lines = [SHELL_SCRIPT_HEADER]
+    for plan in plans:
+        lines.extend(format_plan_shell_lines(plan))
+    return "\n".join(lines) + "\n"
+
+SHELL_SCRIPT_HEADER = "#!/bin/sh\n# Generated by enumcsh"
+
+def format_plan_shell_lines(plan: Dict[str, Any]) -> List[str]:
+    """Return the shell script lines for one port plan, starting with a blank line."""
+    lines = ["", f"# {plan['target']} port {plan['port']} - {plan['service']} ({plan['description']})"]
+    if plan["nmap"]:
+        lines.append(plan["nmap"])
+    lines.extend(f"# msf> {cmd}" for cmd in plan["metasploit"])
+    lines.extend(cmd if is_runnable_command(cmd) else f"# {cmd}" for cmd in plan["manual"])
+    return lines
+
+def iter_formatted_plans(groups: Iterable[List[Dict[str, Any]]], output_format: str) -> Iterator[str]:
+    """Format groups of port plans (e.g. one per host) as text chunks, as soon as each group arrives.
+
+    The chunks join up to exactly what format_plans returns for all plans at
+    once, so large imports can be written without holding every plan.
+    """
+    import textwrap
+    
+    first = True
+    if output_format == "json":
+        yield "["
+    elif output_format == "sh":
+        yield SHELL_SCRIPT_HEADER
+    for plans in groups:
+        if not plans:
+            continue
+        if output_format == "json":
+            for plan in plans:
+                yield ("\n" if first else ",\n") + textwrap.indent(json.dumps(plan, indent=2), "  ")
+                first = False
+        elif output_format == "markdown":
+            yield ("" if first else "\n") + format_plans_markdown(plans)
+        elif output_format == "sh":
+            yield "\n" + "\n".join(line for plan in plans for line in format_plan_shell_lines(plan))
+        else:
+            yield ("" if first else "\n") + "\n".join(format_port_plain(plan) for plan in plans)
+        first = False
+    if output_format == "json":
+        yield "]\n" if first else "\n]\n"
+    elif output_format == "sh":
+        yield "\n"
+
+def format_plans(plans: List[Dict[str, Any]], output_format: str) -> str:
+    """Format port plans in bulk as plain text, JSON, Markdown or a shell script."""
+    return "".join(iter_formatted_plans([plans], output_format))
+
+def write_plans(plans: List[Dict[str, Any]], output_format: str, output_file: Optional[Path] = None) -> None:
+    """Write port plans in one go, to a file or stdout. "rich" renders tables."""
+    if output_format == "rich":
+        display_port_plans(plans)
+        return
+    with trace_phase("render", plans=len(plans), format=output_format):
+        text = format_plans(plans, output_format)
+    if output_file:
+        with open(output_file, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+def write_plan_groups(
+    groups: Iterable[List[Dict[str, Any]]], output_format: str, output_file: Optional[Path] = None
+) -> None:
+    """Write groups of port plans one group at a time, to a file or stdout. "rich" renders tables per group."""
+    if output_format == "rich":
+        for plans in groups:
+            display_port_plans(plans)
+        return
+    with contextlib.ExitStack() as stack:
+        out = stack.enter_context(open(output_file, "w")) if output_file else sys.stdout
+        for chunk in iter_formatted_plans(groups, output_format):
+            out.write(chunk)
+        out.flush()
+
+def check_output_format(output_format: str) -> None:
+    """Exit with an error for unknown --format values; send status messages to stderr for bulk formats."""
+    global console
+    if output_format not in OUTPUT_FORMATS:
+        console.print(f"[bold red]Error:[/bold red] Unknown format '{output_format}'. Choose from: {', '.join(OUTPUT_FORMATS)}")
+        raise typer.Exit(code=1)
+    if output_format != "rich":
+        console = PlainConsole(sys.stderr)
+
+def display_ports_info(
+    ports: List[str],
+    templates: Dict[str, Any],
+    target: Optional[str] = "target",
+    services: Optional[Dict[str, Optional[str]]] = None,
+) -> List[Dict[str, Any]]:
+    """Display enumeration information for several ports of a target in one batch and return their plans.
+
+    services maps ports to the service identified on them, used when a port
+    has no template. The shared templates are only read, never modified.
+    """
+    services = services or {}
+    plans = []
+    for port in ports:
+        service = services.get(port)
+        plan = build_port_plan(port, templates, target, service)
+        if plan["generic"] and not service:
+            console.print(f"[bold yellow]No specific template for port {port}. Using generic template.[/bold yellow]")
+        plans.append(plan)
+    if plans:
+        display_port_plans(plans)
+    return plans
+
+def display_port_info(
+    port: str, templates: Dict[str, Any], target: Optional[str] = "target", service: Optional[str] = None
+) -> Dict[str, Any]:
+    """Display enumeration information for a specific port and return its plan.
+
+    service is the service identified on the port, used when the port has no
+    template. The shared templates are only read, never modified.
+    """
+    return display_ports_info([port], templates, target, {port: service})[0]
+
+# Where command logs go unless --log-dir says otherwise
+DEFAULT_LOG_DIR = Path("enumcsh-logs")
+
+# Bytes read from a child per call, and the output tail kept in memory
+CAPTURE_CHUNK_SIZE = 64 * 1024
+CAPTURE_TAIL_SIZE = 64 * 1024
+
+# Kill functions of the commands run_captured is running, so an interrupted scan can stop them
+_RUNNING_COMMANDS = set()
+_RUNNING_COMMANDS_LOCK = threading.Lock()
+
+def stop_running_commands() -> None:
+    """Kill every command run_captured is running in any thread, e.g. after Ctrl-C."""
+    with _RUNNING_COMMANDS_LOCK:
+        kills = list(_RUNNING_COMMANDS)
+    for kill in kills:
+        kill()
+
+def command_log_name(command: str, prefix: str = "") -> str:
+    """Return a safe compressed log file name for a command, e.g. "003-nmap.log.gz"."""
+    tool = re.sub(r"[^A-Za-z0-9_.-]", "_", command.split()[0] if command.split() else "command")
+    return f"{prefix}{tool}.log.gz"
+
+def run_captured(
+    command: str,
+    log_path: Optional[Path] = None,
+    echo: bool = False,
+    timeout: Optional[float] = None,
+    line_handler: Optional[Callable[[str], None]] = None,
+    stdin: Any = subprocess.DEVNULL,
+    phase: Optional[str] = None,
+    on_start: Optional[Callable[[Callable[[], None]], None]] = None,
+) -> Dict[str, Any]:
+    """Run a shell command, streaming its output (stderr included) as it arrives.
+
+    Output is copied to the terminal when echo is set, to a gzip log at
+    log_path and, line by line, to line_handler. Only the last
+    CAPTURE_TAIL_SIZE bytes are kept in memory, so memory stays flat however
+    much a tool prints. The result holds the command, returncode (None on
+    timeout), duration, output "bytes", compressed "log_bytes", "log" path and
+    decoded output "tail". The run is traced as a "child" phase named phase,
+    or after the tool. Raises OSError if the command cannot be started.
+
+    On POSIX the command runs in its own session, so it cannot take the
+    controlling terminal and a timeout kills the whole process tree, not just
+    the shell. Commands given the terminal's stdin (stdin=None) stay in the
+    foreground process group instead, so prompts and Ctrl-C still reach them.
+    If reading is interrupted (Ctrl-C, or line_handler raising), the command
+    is killed before the exception propagates. on_start is called with a
+    function that kills the command, e.g. to stop it from another thread.
+    """
+    import gzip
     
-    # Display Metasploit commands
-    if "metasploit" in port_data:
-        msf_cmds = "\n".join(port_data["metasploit"])
-        msf_cmds = msf_cmds.replace("{target}", target)
-        table.add_row("Metasploit", Syntax(msf_cmds, "ruby", theme="monokai"))
+    start = time.monotonic()
+    tail = bytearray()
+    partial = bytearray()
+    total = 0
+    timed_out = threading.Event()
+    log = None
+    if log_path is not None:
+        log_path = Path(log_path)
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        log = gzip.open(log_path, "wb")
+        log.write(f"$ {command}\n".encode())
+    terminal = getattr(sys.stdout, "buffer", None) if echo else None
     
-    # Display manual commands
-    if "manual" in port_data:
-        manual_cmds = "\n".join(port_data["manual"])
-        manual_cmds = manual_cmds.replace("{target}", target)
-        table.add_row("Manual", Syntax(manual_cmds, "bash", theme="monokai"))
+    own_group = os.name == "posix" and stdin is not None
     
-    console.print(table)
+    def kill_tree() -> None:
+        if process.returncode is not None:
+            # Already reaped; its process group id may belong to someone else by now
+            return
+        if own_group:
+            import signal
+            
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        else:
+            process.kill()
+    
+    def kill() -> None:
+        timed_out.set()
+        kill_tree()
+    
+    if phase is None:
+        phase = os.path.basename(command.split()[0].strip("\"'")) if command.split() else "command"
+    with trace_phase(phase, "child", command=command) as trace_args:
+        try:
+            process = subprocess.Popen(
+                command, shell=True, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                start_new_session=own_group,
+            )
+            timer = threading.Timer(timeout, kill) if timeout else None
+            if timer:
+                timer.start()
+            with _RUNNING_COMMANDS_LOCK:
+                _RUNNING_COMMANDS.add(kill_tree)
+            try:
+                if on_start is not None:
+                    on_start(kill_tree)
+                fd = process.stdout.fileno()
+                while True:
+                    # os.read returns whatever is available, so prompts without a newline show up at once
+                    chunk = os.read(fd, CAPTURE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    if echo:
+                        if terminal is not None:
+                            terminal.write(chunk)
+                            terminal.flush()
+                        else:
+                            sys.stdout.write(chunk.decode(errors="replace"))
+                    if log is not None:
+                        log.write(chunk)
+                    tail += chunk
+                    del tail[:-CAPTURE_TAIL_SIZE]
+                    if line_handler is not None:
+                        partial += chunk
+                        *lines, rest = partial.split(b"\n")
+                        # Overlong lines are cut to their first CAPTURE_TAIL_SIZE bytes
+                        for line in lines:
+                            line_handler(line[:CAPTURE_TAIL_SIZE].decode(errors="replace"))
+                        partial = bytearray(rest[:CAPTURE_TAIL_SIZE])
+                returncode = process.wait()
+            finally:
+                if timer:
+                    timer.cancel()
+                with _RUNNING_COMMANDS_LOCK:
+                    _RUNNING_COMMANDS.discard(kill_tree)
+                # Nothing else would stop a child in its own session once we stop reading
+                if process.poll() is None:
+                    kill_tree()
+                    process.wait()
+                process.stdout.close()
+            if line_handler is not None and partial:
+                line_handler(partial[:CAPTURE_TAIL_SIZE].decode(errors="replace"))
+        finally:
+            if log is not None:
+                if timed_out.is_set():
+                    log.write(f"\n[enumcsh] Command timed out after {timeout} seconds\n".encode())
+                log.close()
+        
+        trace_args.update(returncode=None if timed_out.is_set() else returncode, bytes=total)
+    
+    return {
+        "command": command,
+        "log": str(log_path) if log_path is not None else "",
+        "returncode": None if timed_out.is_set() else returncode,
+        "duration": time.monotonic() - start,
+        "bytes": total,
+        "log_bytes": log_path.stat().st_size if log_path is not None else 0,
+        "tail": tail.decode(errors="replace"),
+    }
+
+def execute_command(command: str, log_dir: Path = DEFAULT_LOG_DIR) -> None:
+    """Execute a shell command with user confirmation.
 
-def execute_command(command: str) -> None:
-    """Execute a shell command with user confirmation."""
+    Output is shown as it arrives and kept in a compressed log under <log_dir>/commands/.
+    """
     console.print(f"[bold yellow]About to execute:[/bold yellow] {command}")
     confirm = typer.confirm("Do you want to proceed?")
     if confirm:
         try:
             console.print(f"[bold green]Executing:[/bold green] {command}")
-            subprocess.run(command, shell=True)
+            log_path = Path(log_dir) / "commands" / command_log_name(command, datetime.now().strftime("%Y%m%d-%H%M%S-"))
+            # stdin stays attached so interactive tools still work
+            result = run_captured(command, log_path, echo=True, stdin=None)
+            console.print(
+                f"[bold green]Exit code {result['returncode']}[/bold green] after {result['duration']:.1f}s, "
+                f"{result['bytes']} bytes of output (log: {result['log']})"
+            )
         except Exception as e:
             console.print(f"[bold red]Error executing command:[/bold red] {str(e)}")
     else:
         console.print("[bold yellow]Command execution cancelled.[/bold yellow]")
 
-def run_nmap_scan(target: str, ports: Optional[str] = None) -> List[str]:
-    """Run a quick Nmap scan and return discovered ports."""
-    scan_cmd = f"nmap -T4 -F {target}"
+def build_scan_command(
+    target: str,
+    ports: Optional[str] = None,
+    verbose: bool = False,
+    service_detection: bool = False,
+    timing: int = 4,
+) -> str:
+    """Build the Nmap discovery command for a target. timing is the -T0..-T5 template."""
+    scan_cmd = f"nmap -T{timing} -F {target}"
     if ports:
-        scan_cmd = f"nmap -T4 -p {ports} {target}"
+        scan_cmd = f"nmap -T{timing} -p {ports} {target}"
+    if service_detection:
+        scan_cmd = scan_cmd.replace("nmap ", "nmap -sV ", 1)
+    if verbose:
+        # Verbose mode makes Nmap report each open port as soon as it is found
+        scan_cmd = scan_cmd.replace("nmap ", "nmap -v ", 1)
+    return scan_cmd
+
+def parse_nmap_line(line: str) -> Optional[str]:
+    """Return the port number if an Nmap output line reports an open TCP port."""
+    line = line.strip()
+    if line.startswith("Discovered open port "):
+        # e.g. "Discovered open port 80/tcp on 192.168.1.10"
+        port_proto = line.split()[3]
+        return port_proto.split("/")[0] if port_proto.endswith("/tcp") else None
+    if "/tcp" in line and "open" in line:
+        return line.split("/")[0].strip()
+    return None
+
+def is_runnable_command(command: str) -> bool:
+    """Return True if a template line is a shell command whose program is installed."""
+    try:
+        parts = shlex.split(command)
+    except ValueError:
+        return False
+    return bool(parts) and shutil.which(parts[0]) is not None
+
+# Clients that open a session or prompt for a password, which unattended runs must not start
+INTERACTIVE_CLIENTS = {
+    "ftp", "sftp", "ssh", "telnet", "nc", "ncat", "netcat", "mysql", "psql", "smbclient", "redis-cli", "mongo", "mongosh",
+}
+
+# Per-command timeout for --execute-all and pipeline steps, in seconds
+DEFAULT_COMMAND_TIMEOUT = 900.0
+
+def is_interactive_command(command: str) -> bool:
+    """Return True if a command starts an interactive client such as ssh or mysql."""
+    words = command.split()
+    return bool(words) and os.path.basename(words[0]).lower() in INTERACTIVE_CLIENTS
+
+def collect_followup_commands(
+    port: str, templates: Dict[str, Any], target: str, include_nmap: bool = True, service: Optional[str] = None
+) -> List[str]:
+    """Return the follow-up commands (Nmap and manual lines) for a port that can run unattended.
+
+    Manual lines whose tool is not installed or is an interactive client are left out.
+    """
+    port_data = resolve_port_template(port, templates, service) or templates["ports"]["unknown"]
     
-    console.print(f"[bold green]Running scan:[/bold green] {scan_cmd}")
+    commands = []
+    if include_nmap and "nmap" in port_data:
+        commands.append(port_data["nmap"])
+    for line in port_data.get("manual", []):
+        if is_runnable_command(line) and not is_interactive_command(line):
+            commands.append(line)
+    return [render_template(cmd, target=target, port=port) for cmd in commands]
+
+def parse_nmap_template(command: str) -> Tuple[Tuple[str, ...], List[str], List[str]]:
+    """Split an Nmap template command into (other options, ports, scripts)."""
+    options = []
+    ports = []
+    scripts = []
+    tokens = shlex.split(command)[1:]
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token == "-p" and index + 1 < len(tokens):
+            ports.extend(tokens[index + 1].split(","))
+            index += 1
+        elif token.startswith("-p") and token[2:3].isdigit():
+            ports.extend(token[2:].split(","))
+        elif token == "--script" and index + 1 < len(tokens):
+            scripts.extend(tokens[index + 1].split(","))
+            index += 1
+        elif token.startswith("--script="):
+            scripts.extend(token[len("--script="):].split(","))
+        elif token != "{target}":
+            options.append(token)
+        index += 1
+    return tuple(options), ports, scripts
+
+def plan_nmap_runs(
+    findings: Iterable[Tuple[str, str]],
+    templates: Dict[str, Any],
+    services: Optional[Dict[Tuple[str, str], str]] = None,
+) -> List[Dict[str, Any]]:
+    """Merge per-port template Nmap commands into as few Nmap runs as possible.
+
+    Templates for the same target that share the same options (e.g. -sV -sC)
+    are combined into one run with a unioned -p list and merged --script set.
+    Each run keeps a "sources" list mapping back to the original port templates.
+    services maps (target, port) to the service identified on ports without a template.
+    """
+    services = services or {}
+    groups = {}
+    for target, port in findings:
+        port_data = resolve_port_template(port, templates, services.get((target, port))) or templates["ports"]["unknown"]
+        if "nmap" not in port_data:
+            continue
+        template_cmd = render_template(port_data["nmap"], port=port)
+        options, run_ports, scripts = parse_nmap_template(template_cmd)
+        run = groups.setdefault((target, options), {
+            "target": target,
+            "options": options,
+            "ports": [],
+            "scripts": [],
+            "sources": [],
+        })
+        for value in run_ports or [port]:
+            if value not in run["ports"]:
+                run["ports"].append(value)
+        for script in scripts:
+            if script not in run["scripts"]:
+                run["scripts"].append(script)
+        run["sources"].append({"port": port, "command": render_template(template_cmd, target=target)})
+    
+    plan = []
+    for run in groups.values():
+        run["ports"].sort(key=lambda value: int(value) if value.isdigit() else 0)
+        parts = ["nmap", *run.pop("options"), "-p", ",".join(run["ports"])]
+        if run["scripts"]:
+            parts.append("--script=" + ",".join(run["scripts"]))
+        parts.append(run["target"])
+        run["command"] = " ".join(parts)
+        plan.append(run)
+    return plan
+
+def display_nmap_plan(plan: List[Dict[str, Any]]) -> None:
+    """Display a merged Nmap plan without running it."""
+    from rich.table import Table
     
+    table = Table(title="Merged Nmap plan (dry run)")
+    table.add_column("Target")
+    table.add_column("Command", overflow="fold")
+    table.add_column("Replaces")
+    
+    for run in plan:
+        sources = "\n".join(f"{source['port']}: {source['command']}" for source in run["sources"])
+        table.add_row(run["target"], run["command"], sources)
+    console.print(table)
+    
+    merged = sum(len(run["sources"]) for run in plan)
+    console.print(f"[bold green]{merged} template Nmap commands merged into {len(plan)} run(s)[/bold green]")
+
+def run_logged_command(command: str, log_path: Path, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """Run a command non-interactively, writing its stdout/stderr to a gzip log file.
+
+    Returns the run_captured result without the output tail.
+    """
+    start = time.monotonic()
     try:
-        result = subprocess.run(scan_cmd, shell=True, capture_output=True, text=True)
-        output = result.stdout
+        result = run_captured(command, log_path, timeout=timeout)
+    except Exception as e:
+        import gzip
         
-        # Parse Nmap output to extract open ports
-        open_ports = []
-        for line in output.splitlines():
-            if "/tcp" in line and "open" in line:
-                port = line.split("/")[0].strip()
-                open_ports.append(port)
+        Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(log_path, "wt") as log:
+            log.write(f"$ {command}\n\n[enumcsh] Error executing command: {str(e)}\n")
+        return {"command": command, "log": str(log_path), "returncode": None, "duration": time.monotonic() - start, "bytes": 0}
+    del result["tail"]
+    return result
+
+def execute_all(
+    jobs: Iterable[Tuple[str, str, str]],
+    log_dir: Path,
+    workers: int = 4,
+    timeout: Optional[float] = DEFAULT_COMMAND_TIMEOUT,
+) -> List[Dict[str, Any]]:
+    """Run (target, port, command) jobs on a bounded worker pool.
+
+    Each command gets its own log file under <log_dir>/<target>/<port>/ and
+    runs without the terminal; it is killed after timeout seconds (None or 0
+    for no limit). Returns one result dict per job in completion order.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    
+    results = []
+    with trace_phase("execute_all", workers=workers), ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {}
+        for index, (target, port, command) in enumerate(jobs, 1):
+            log_path = Path(log_dir) / re.sub(r"[^A-Za-z0-9_.-]", "_", target) / port / command_log_name(command, f"{index:03d}-")
+            futures[executor.submit(run_logged_command, command, log_path, timeout)] = (target, port)
+        
+        for future in as_completed(futures):
+            target, port = futures[future]
+            result = future.result()
+            result.update(target=target, port=port)
+            status = "[green]done[/green]" if result["returncode"] == 0 else "[red]failed[/red]"
+            console.print(f"{status} {target}:{port} {result['command']}")
+            results.append(result)
+    return results
+
+def step_conditions(step: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return a step's "when" conditions as a list."""
+    when = step.get("when", [])
+    return [when] if isinstance(when, dict) else list(when)
+
+def template_steps(port_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return a template's pipeline steps.
+
+    The Nmap command and installed, non-interactive manual commands are
+    steps named after their tool ("nmap", "curl", "gobuster"; repeats get
+    "-2", "-3"). Entries in "steps" refine the step with the same id (after,
+    when, weight) or add a step with their own "cmd". Refinements of tools
+    that are not installed are dropped along with the steps that depend on
+    them.
+    """
+    commands = [port_data["nmap"]] if port_data.get("nmap") else []
+    commands += [
+        line for line in port_data.get("manual", []) if is_runnable_command(line) and not is_interactive_command(line)
+    ]
+    steps = {}
+    for command in commands:
+        tool = os.path.basename(command.split()[0]).lower()
+        step_id = tool
+        count = 1
+        while step_id in steps:
+            count += 1
+            step_id = f"{tool}-{count}"
+        steps[step_id] = {"id": step_id, "cmd": command}
+    
+    def dependencies(step: Dict[str, Any]) -> List[str]:
+        return list(step.get("after", [])) + [condition["step"] for condition in step_conditions(step)]
+    
+    unavailable = set()
+    for step in port_data.get("steps", []):
+        if step["id"] in steps:
+            steps[step["id"]] = dict(steps[step["id"]], **step)
+        elif "cmd" in step:
+            steps[step["id"]] = dict(step)
+        else:
+            unavailable.add(step["id"])
+    # Derived steps of missing tools are never created, so anything waiting on them goes too
+    unavailable.update(
+        dependency for step in steps.values() for dependency in dependencies(step) if dependency not in steps
+    )
+    while unavailable:
+        dropped = {step_id for step_id, step in steps.items() if unavailable.intersection(dependencies(step))}
+        for step_id in dropped:
+            del steps[step_id]
+        unavailable = dropped
+    return list(steps.values())
+
+def build_pipeline(
+    findings: Iterable[Tuple[str, str]],
+    templates: Dict[str, Any],
+    services: Optional[Dict[Tuple[str, str], str]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Build the step DAG for (target, port) findings, keyed "target:port:step id" in dependency order.
+
+    Raises ValueError for unknown dependencies or cycles.
+    """
+    services = services or {}
+    nodes = {}
+    for target, port in findings:
+        port_data = resolve_port_template(port, templates, services.get((target, port))) or templates["ports"]["unknown"]
+        prefix = f"{target}:{port}:"
+        for step in template_steps(port_data):
+            when = step_conditions(step)
+            # A condition on a step implies waiting for it, but not that it succeeded
+            after = list(dict.fromkeys(list(step.get("after", [])) + [condition["step"] for condition in when]))
+            nodes[prefix + step["id"]] = {
+                "key": prefix + step["id"],
+                "target": target,
+                "port": port,
+                "id": step["id"],
+                "command": render_template(step["cmd"], target=target, port=port),
+                "after": [prefix + dependency for dependency in after],
+                "requires": [prefix + dependency for dependency in step.get("after", [])],
+                "when": [dict(condition, step=prefix + condition["step"]) for condition in when],
+                "weight": max(1, int(step.get("weight", 1))),
+            }
+    
+    # Kahn's algorithm both validates the graph and orders it
+    for node in nodes.values():
+        for dependency in node["after"]:
+            if dependency not in nodes:
+                raise ValueError(f"Step {node['key']} depends on unknown step {dependency}")
+    waiting = {key: len(node["after"]) for key, node in nodes.items()}
+    dependents = {key: [] for key in nodes}
+    for key, node in nodes.items():
+        for dependency in node["after"]:
+            dependents[dependency].append(key)
+    ready = [key for key, count in waiting.items() if count == 0]
+    ordered = {}
+    while ready:
+        key = ready.pop(0)
+        ordered[key] = nodes[key]
+        for dependent in dependents[key]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+    if len(ordered) != len(nodes):
+        cycle = sorted(set(nodes) - set(ordered))
+        raise ValueError(f"Pipeline steps form a cycle: {', '.join(cycle)}")
+    return ordered
+
+def check_step_conditions(node: Dict[str, Any], results: Dict[str, Dict[str, Any]]) -> bool:
+    """Return True if a step's "after" dependencies succeeded and its "when" conditions hold.
+
+    A condition names an earlier step, which must have run, and may require
+    its "exit" code (any, including non-zero) and an "output" regex that must
+    match a line of the step's log. The log is read line by line, so large
+    logs are never loaded whole.
+    """
+    import gzip
+    
+    if any(results[dependency].get("returncode") != 0 for dependency in node["requires"]):
+        return False
+    for condition in node["when"]:
+        result = results[condition["step"]]
+        if result.get("skipped"):
+            return False
+        if "exit" in condition and result.get("returncode") != condition["exit"]:
+            return False
+        if "output" in condition:
+            pattern = re.compile(condition["output"])
+            log_path = result.get("log", "")
+            opener = gzip.open if log_path.endswith(".gz") else open
+            try:
+                with opener(log_path, "rt", errors="replace") as f:
+                    if not any(pattern.search(line) for line in f):
+                        return False
+            except OSError:
+                return False
+    return True
+
+class PipelineState:
+    """JSON file recording finished pipeline steps, so a rerun skips what already ran."""
+    
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else None
+        self.steps = {}
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            with open(self.path, "r") as f:
+                self.steps = json.load(f).get("steps", {})
+    
+    def get(self, key: str, command: str) -> Optional[Dict[str, Any]]:
+        """Return the recorded result of a step that succeeded, unless its command changed since."""
+        result = self.steps.get(key)
+        if result is None or result["command"] != command or result["returncode"] != 0:
+            return None
+        return result
+    
+    def record(self, key: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self.steps[key] = result
+            if self.path is None:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump({"steps": self.steps}, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+def run_pipeline(
+    nodes: Dict[str, Dict[str, Any]],
+    log_dir: Path,
+    capacity: int = 4,
+    timeout: Optional[float] = DEFAULT_COMMAND_TIMEOUT,
+    state: Optional[PipelineState] = None,
+) -> List[Dict[str, Any]]:
+    """Run a step DAG from build_pipeline with as much parallelism as capacity allows.
+
+    A step starts once its dependencies finished, if its weight fits in the
+    free capacity. Steps whose dependencies failed or were skipped, or whose
+    conditions do not hold, are skipped along with everything after them.
+    Steps recorded in state are not run again. Returns one result per step.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    
+    state = state or PipelineState()
+    capacity = max(1, capacity)
+    pending = dict(nodes)
+    results = {}
+    running = {}
+    free = capacity
+    
+    def finish(node: Dict[str, Any], result: Dict[str, Any]) -> None:
+        result.update(target=node["target"], port=node["port"], step=node["id"])
+        results[node["key"]] = result
+        if result.get("skipped"):
+            console.print(f"[yellow]skipped[/yellow] {node['target']}:{node['port']} {node['id']}")
+        elif not result.get("cached"):
+            status = "[green]done[/green]" if result["returncode"] == 0 else "[red]failed[/red]"
+            console.print(f"{status} {node['target']}:{node['port']} {node['id']}: {result['command']}")
+    
+    with trace_phase("pipeline", steps=len(nodes), capacity=capacity), ThreadPoolExecutor(max_workers=capacity) as executor:
+        while pending or running:
+            for key, node in list(pending.items()):
+                if any(dependency not in results for dependency in node["after"]):
+                    continue
+                if not check_step_conditions(node, results):
+                    del pending[key]
+                    finish(node, {"command": node["command"], "returncode": None, "duration": 0.0, "log": "", "skipped": True})
+                    continue
+                previous = state.get(key, node["command"])
+                if previous is not None:
+                    del pending[key]
+                    finish(node, dict(previous, cached=True))
+                    continue
+                # Oversized steps run alone instead of never
+                weight = min(node["weight"], capacity)
+                if weight > free:
+                    continue
+                del pending[key]
+                free -= weight
+                step_name = re.sub(r"[^A-Za-z0-9_.-]", "_", node["id"])
+                log_path = Path(log_dir) / re.sub(r"[^A-Za-z0-9_.-]", "_", node["target"]) / node["port"] / f"{step_name}.log.gz"
+                running[executor.submit(run_logged_command, node["command"], log_path, timeout)] = (node, weight)
+            
+            if not running:
+                # Skipping or reusing results may have unblocked more steps
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node, weight = running.pop(future)
+                free += weight
+                result = future.result()
+                state.record(node["key"], result)
+                finish(node, dict(result))
+    return [results[key] for key in nodes]
+
+def display_pipeline(nodes: Dict[str, Dict[str, Any]]) -> None:
+    """Display a step DAG without running it."""
+    from rich.table import Table
+    
+    table = Table(title="Enumeration pipeline")
+    table.add_column("Step")
+    table.add_column("After")
+    table.add_column("Weight", justify="right")
+    table.add_column("Command")
+    for node in nodes.values():
+        after = ", ".join(dependency.rsplit(":", 1)[1] for dependency in node["after"])
+        table.add_row(f"{node['target']}:{node['port']} {node['id']}", after, str(node["weight"]), node["command"])
+    console.print(table)
+
+def run_pipeline_command(
+    findings: List[Tuple[str, str]],
+    templates: Dict[str, Any],
+    log_dir: Path,
+    workers: int,
+    timeout: Optional[float],
+    state_path: Optional[Path],
+    services: Optional[Dict[Tuple[str, str], str]] = None,
+    dry_run: bool = False,
+) -> None:
+    """Build, show or run the pipeline for findings on behalf of the CLI commands."""
+    try:
+        nodes = build_pipeline(findings, templates, services)
+    except ValueError as e:
+        console.print(f"[bold red]Error:[/bold red] {str(e)}")
+        raise typer.Exit(code=1)
+    if dry_run:
+        display_pipeline(nodes)
+        return
+    state_path = state_path or Path(log_dir) / "pipeline-state.json"
+    console.print(f"[bold yellow]Running {len(nodes)} pipeline steps with capacity {workers} (state: {state_path})[/bold yellow]")
+    display_execution_summary(run_pipeline(nodes, log_dir, workers, timeout, PipelineState(state_path)))
+
+def display_execution_summary(results: List[Dict[str, Any]]) -> None:
+    """Display a summary table of executed follow-up commands."""
+    from rich.table import Table
+    
+    table = Table(title="Follow-up command summary")
+    table.add_column("Target")
+    table.add_column("Port")
+    table.add_column("Command")
+    table.add_column("Exit")
+    table.add_column("Time (s)", justify="right")
+    table.add_column("Log")
+    
+    for result in sorted(results, key=lambda r: (r["target"], int(r["port"]) if r["port"].isdigit() else 0)):
+        if result.get("skipped"):
+            exit_code = "skipped"
+        else:
+            exit_code = "timeout" if result["returncode"] is None else str(result["returncode"])
+        table.add_row(
+            result["target"], result["port"], result["command"], exit_code,
+            f"{result['duration']:.1f}", result["log"]
+        )
+    console.print(table)
+
+def run_nmap_scan(
+    target: str,
+    ports: Optional[str] = None,
+    raise_errors: bool = False,
+    service_detection: bool = False,
+    timing: int = 4,
+    on_line: Optional[Callable[[str], None]] = None,
+    verbose: bool = False,
+) -> List[str]:
+    """Run a quick Nmap scan and return discovered ports.
+
+    Errors are reported and an empty list is returned, unless raise_errors is
+    set, in which case a failed scan raises instead. on_line receives every
+    output line, e.g. to watch for dropped probes (which Nmap only reports
+    with verbose set).
+    """
+    scan_cmd = build_scan_command(target, ports, verbose=verbose, service_detection=service_detection, timing=timing)
+    
+    console.print(f"[bold green]Running scan:[/bold green] {scan_cmd}")
+    
+    # Nmap output is parsed as it streams in rather than held in memory
+    open_ports = []
+    seen = set()
+    # Parsing is interleaved with the child's output, so it is timed line by line and traced as its own phase
+    tracing = bool(_TRACE_HOOKS)
+    parsing = {"start": time.perf_counter(), "wall": 0.0, "cpu": 0.0, "lines": 0}
+    
+    def handle_line(line: str) -> None:
+        if on_line is not None:
+            on_line(line)
+        if tracing:
+            wall, cpu = time.perf_counter(), time.thread_time()
+        port = parse_nmap_line(line)
+        if port and port not in seen:
+            seen.add(port)
+            open_ports.append(port)
+        if tracing:
+            parsing["wall"] += time.perf_counter() - wall
+            parsing["cpu"] += time.thread_time() - cpu
+            parsing["lines"] += 1
+    
+    try:
+        result = run_captured(scan_cmd, line_handler=handle_line, phase="nmap")
+        if tracing:
+            emit_trace_event("parse_nmap_output", "phase", parsing["start"], parsing["wall"], {
+                "lines": parsing["lines"], "cpu_ms": round(parsing["cpu"] * 1000, 3),
+            })
+        if result["returncode"] != 0:
+            raise RuntimeError(f"Nmap exited with status {result['returncode']}: {result['tail'].strip()[-500:]}")
         
         console.print(f"[bold green]Discovered open ports:[/bold green] {', '.join(open_ports)}")
         return open_ports
     except Exception as e:
         console.print(f"[bold red]Error running Nmap scan:[/bold red] {str(e)}")
+        if raise_errors:
+            raise
         return []
 
-def interactive_mode(templates: Dict[str, Any]) -> None:
-    """Run the tool in interactive mode."""
-    # Display ASCII banner
-    console.print(f"[bold green]{ASCII_BANNER}[/bold green]")
-    console.print(Panel.fit("Welcome to Interactive Mode", border_style="green"))
+def expand_port_spec(ports: str) -> Optional[List[int]]:
+    """Expand a numeric port spec such as "22,80,1000-5000" into sorted port numbers.
+
+    Returns None for Nmap-only syntax (e.g. service names or T:/U: prefixes).
+    """
+    numbers = set()
+    for part in ports.split(","):
+        start, _, end = part.strip().partition("-")
+        if not start.isdigit() or (end and not end.isdigit()):
+            return None
+        numbers.update(range(int(start), int(end or start) + 1))
+    return sorted(numbers)
+
+def split_port_spec(ports: Optional[str], chunk_size: int = 1000) -> List[Optional[str]]:
+    """Split a port spec such as "22,80,1000-5000" into chunks of at most chunk_size ports.
+
+    Each chunk is itself a valid Nmap port spec. A missing spec (Nmap's -F
+    fast scan) is a single chunk.
+    """
+    if not ports:
+        return [None]
     
-    target = typer.prompt("Enter target IP/hostname")
+    ordered = expand_port_spec(ports)
+    if ordered is None:
+        # Nmap-only syntax is scanned in one go
+        return [ports]
     
-    while True:
-        console.print("\n[bold]Choose an option:[/bold]")
-        console.print("1. Enter port number")
+    chunks = []
+    for offset in range(0, len(ordered), max(1, chunk_size)):
+        chunk = ordered[offset:offset + chunk_size]
+        # Collapse consecutive ports back into ranges
+        parts = []
+        first = previous = chunk[0]
+        for number in chunk[1:] + [None]:
+            if number is not None and number == previous + 1:
+                previous = number
+                continue
+            parts.append(str(first) if first == previous else f"{first}-{previous}")
+            if number is not None:
+                first = previous = number
+        chunks.append(",".join(parts))
+    return chunks
+
+# Port spec swept by the pre-scanner when no --ports are given
+FULL_PORT_RANGE = "1-65535"
+
+class RateLimiter:
+    """Async limiter that spaces connection attempts to at most rate per second."""
+    
+    def __init__(self, rate: float = 0):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+    
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # Reserve the next slot before sleeping so concurrent callers queue up behind it
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+# File descriptors left for logs, pipes and child processes when sizing the socket budget
+SOCKET_FD_RESERVE = 128
+
+# Attempts and first delay when creating a socket fails for lack of file descriptors
+SOCKET_BACKOFF_ATTEMPTS = 8
+SOCKET_BACKOFF_DELAY = 0.01
+
+class SocketBudget:
+    """Caps the sockets the pre-scanner has open at once, across every host and event loop.
+
+    Hosts are pre-scanned in separate threads, each with its own event loop,
+    so waiters are woken with call_soon_threadsafe on their own loop. A
+    released slot is handed straight to the oldest waiter.
+    """
+    
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+    
+    async def acquire(self) -> None:
+        import asyncio
+        
+        with self._lock:
+            if self.in_use < self.limit:
+                self.in_use += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        await waiter
+    
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                loop, waiter = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._hand_over, waiter)
+                    return
+                except RuntimeError:
+                    # That host's loop already closed
+                    continue
+            self.in_use -= 1
+    
+    def _hand_over(self, waiter) -> None:
+        if waiter.cancelled():
+            self.release()
+        else:
+            waiter.set_result(None)
+
+_SOCKET_BUDGET: Optional[SocketBudget] = None
+
+def get_socket_budget() -> SocketBudget:
+    """Return the process-wide pre-scan socket budget, sized from the open-file limit."""
+    global _SOCKET_BUDGET
+    if _SOCKET_BUDGET is None:
+        try:
+            import resource
+            
+            soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft == resource.RLIM_INFINITY:
+                soft = 65536
+        except (ImportError, ValueError, OSError):
+            # No rlimit on Windows; stay within the default select() limit
+            soft = 512 + SOCKET_FD_RESERVE
+        _SOCKET_BUDGET = SocketBudget(min(soft, 65536) - SOCKET_FD_RESERVE)
+    return _SOCKET_BUDGET
+
+async def open_probe_socket(family: int):
+    """Create a non-blocking TCP socket, backing off while the process is out of file descriptors."""
+    import asyncio
+    import errno
+    import socket
+    
+    delay = SOCKET_BACKOFF_DELAY
+    for attempt in range(SOCKET_BACKOFF_ATTEMPTS):
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError as e:
+            if e.errno not in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS) or attempt == SOCKET_BACKOFF_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
+            continue
+        sock.setblocking(False)
+        return sock
+
+async def probe_tcp_port(
+    host: str, port: int, timeout: float, retries: int, limiter: RateLimiter, budget: Optional[SocketBudget] = None
+) -> bool:
+    """Return True if a TCP connect to host:port succeeds.
+
+    A refused connection is final; timeouts and other errors are retried up
+    to retries more times. Each attempt holds a slot of budget while its
+    socket is open.
+    """
+    import asyncio
+    import socket
+    
+    loop = asyncio.get_running_loop()
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    for _ in range(max(0, retries) + 1):
+        await limiter.wait()
+        if budget is not None:
+            await budget.acquire()
+        try:
+            # A bare non-blocking socket avoids the stream reader/writer setup of open_connection
+            sock = await open_probe_socket(family)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, (host, port)), timeout)
+                return True
+            except ConnectionRefusedError:
+                return False
+            except (OSError, asyncio.TimeoutError):
+                continue
+            finally:
+                sock.close()
+        finally:
+            if budget is not None:
+                budget.release()
+    return False
+
+async def tcp_connect_scan_async(
+    host: str,
+    ports: Iterable[int],
+    concurrency: int = 500,
+    timeout: float = 1.0,
+    retries: int = 1,
+    rate: float = 0,
+) -> List[str]:
+    """Probe ports on host with at most concurrency connections in flight; return open ports."""
+    import asyncio
+    import socket
+    
+    # Resolve once up front instead of on every connection attempt
+    addresses = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    address = addresses[0][4][0]
+    limiter = RateLimiter(rate)
+    # Shared by every host scanned at once, so together they stay below the open-file limit
+    budget = get_socket_budget()
+    pending = iter(ports)
+    open_ports = []
+    
+    async def worker() -> None:
+        # Workers share one iterator so a 65535-port sweep never creates 65535 tasks
+        for port in pending:
+            if await probe_tcp_port(address, port, timeout, retries, limiter, budget):
+                open_ports.append(port)
+    
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, budget.limit)))))
+    return [str(port) for port in sorted(open_ports)]
+
+def tcp_connect_scan(
+    host: str,
+    ports: Optional[str] = None,
+    concurrency: int = 500,
+    timeout: float = 1.0,
+    retries: int = 1,
+    rate: float = 0,
+) -> List[str]:
+    """Run the asyncio TCP connect scan on a numeric port spec (all ports by default)."""
+    import asyncio
+    
+    numbers = expand_port_spec(ports or FULL_PORT_RANGE)
+    if numbers is None:
+        raise ValueError(f"The pre-scanner needs numeric ports, got: {ports}")
+    return asyncio.run(tcp_connect_scan_async(host, numbers, concurrency, timeout, retries, rate))
+
+def run_prescan_scan(
+    target: str,
+    ports: Optional[str] = None,
+    concurrency: int = 500,
+    timeout: float = 1.0,
+    retries: int = 1,
+    rate: float = 0,
+    raise_errors: bool = False,
+) -> List[str]:
+    """Two-phase discovery: a TCP connect sweep, then Nmap service detection on the open ports only.
+
+    If the Nmap stage fails (e.g. Nmap is not installed) the ports found by
+    the sweep are returned as they are.
+    """
+    console.print(f"[bold green]Pre-scanning {target}:[/bold green] {ports or FULL_PORT_RANGE}")
+    try:
+        with trace_phase("prescan", target=target, ports=ports or FULL_PORT_RANGE, concurrency=concurrency):
+            open_ports = tcp_connect_scan(target, ports, concurrency, timeout, retries, rate)
+    except Exception as e:
+        console.print(f"[bold red]Error running pre-scan:[/bold red] {str(e)}")
+        if raise_errors:
+            raise
+        return []
+    
+    console.print(f"[bold green]Pre-scan found open ports:[/bold green] {', '.join(open_ports)}")
+    if not open_ports:
+        return []
+    try:
+        return run_nmap_scan(target, ",".join(open_ports), raise_errors=True, service_detection=True)
+    except Exception:
+        console.print("[bold yellow]Using pre-scan results without service detection.[/bold yellow]")
+        return open_ports
+
+# Probes sent to ports without a template: wait for a greeting first, then try HTTP
+BANNER_PROBES = (b"", b"GET / HTTP/1.0\r\n\r\n")
+BANNER_READ_SIZE = 1024
+
+class SignatureMatcher:
+    """Matches banners against every signature in one pass.
+
+    All signature patterns are combined into a single regex of named
+    alternatives; the name of the matching alternative identifies the service.
+    """
+    
+    def __init__(self, signatures: Iterable[Dict[str, str]]):
+        self.services = []
+        alternatives = []
+        for signature in signatures:
+            try:
+                re.compile(signature["pattern"])
+            except re.error as e:
+                console.print(f"[bold yellow]Skipping invalid signature for {signature['service']}:[/bold yellow] {e}")
+                continue
+            alternatives.append(f"(?P<s{len(self.services)}>{signature['pattern']})")
+            self.services.append(signature["service"])
+        self.pattern = re.compile("|".join(alternatives)) if alternatives else None
+    
+    def match(self, banner: str) -> Optional[str]:
+        """Return the service whose signature matches the banner, or None."""
+        if self.pattern is None or not banner:
+            return None
+        match = self.pattern.search(banner)
+        return self.services[int(match.lastgroup[1:])] if match else None
+
+def get_signature_matcher(templates: Dict[str, Any]) -> SignatureMatcher:
+    """Return the banner signature matcher for a templates dict, building it if needed."""
+    if _TEMPLATE_INDEX_CACHE["templates"] is not templates:
+        _TEMPLATE_INDEX_CACHE.update(templates=templates, index=None, search=None, signatures=None)
+    if _TEMPLATE_INDEX_CACHE["signatures"] is None:
+        _TEMPLATE_INDEX_CACHE["signatures"] = SignatureMatcher(templates.get("signatures", []))
+    return _TEMPLATE_INDEX_CACHE["signatures"]
+
+async def grab_banner(host: str, port: int, timeout: float = 2.0) -> str:
+    """Return the first response to BANNER_PROBES from host:port, decoded as latin-1."""
+    import asyncio
+    
+    for probe in BANNER_PROBES:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return ""
+        try:
+            if probe:
+                writer.write(probe)
+                await writer.drain()
+            data = await asyncio.wait_for(reader.read(BANNER_READ_SIZE), timeout)
+        except (OSError, asyncio.TimeoutError):
+            data = b""
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        if data:
+            return data.decode("latin-1")
+    return ""
+
+def grab_banners(
+    endpoints: Iterable[Tuple[str, str]], timeout: float = 2.0, concurrency: int = 100
+) -> Dict[Tuple[str, str], str]:
+    """Grab banners from many (host, port) endpoints at once."""
+    import asyncio
+    
+    endpoints = list(endpoints)
+    
+    async def grab_all() -> List[str]:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def grab(host: str, port: str) -> str:
+            async with semaphore:
+                return await grab_banner(host, int(port), timeout)
+        
+        return await asyncio.gather(*(grab(host, port) for host, port in endpoints))
+    
+    return dict(zip(endpoints, asyncio.run(grab_all())))
+
+def identify_services(
+    endpoints: Iterable[Tuple[str, str]], templates: Dict[str, Any], timeout: float = 2.0, concurrency: int = 100
+) -> Dict[Tuple[str, str], str]:
+    """Banner-grab the (host, port) endpoints that have no template; return the services identified."""
+    unknown = [(host, port) for host, port in endpoints if port.isdigit() and find_port_template(port, templates) is None]
+    if not unknown:
+        return {}
+    matcher = get_signature_matcher(templates)
+    services = {}
+    with trace_phase("banner_grab", endpoints=len(unknown)):
+        banners = grab_banners(unknown, timeout, concurrency)
+    for endpoint, banner in banners.items():
+        service = matcher.match(banner)
+        if service:
+            services[endpoint] = service
+    return services
+
+# Default location of the scan result store
+DEFAULT_STORE_PATH = Path(os.environ.get("ENUMCSH_STORE", Path.home() / ".enumcsh" / "results.db"))
+
+class ResultStore:
+    """SQLite store of discovery results, keyed by target, port spec and scan options.
+
+    Each scan is split into port chunks; a chunk is recorded as soon as it
+    finishes so an interrupted scan can resume where it stopped.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS scans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            target TEXT NOT NULL,
+            port_spec TEXT NOT NULL,
+            options TEXT NOT NULL,
+            started REAL NOT NULL,
+            finished REAL
+        );
+        CREATE INDEX IF NOT EXISTS scans_key ON scans (target, port_spec, options, finished);
+        CREATE TABLE IF NOT EXISTS chunks (
+            scan_id INTEGER NOT NULL REFERENCES scans (id),
+            chunk TEXT NOT NULL,
+            finished REAL NOT NULL,
+            PRIMARY KEY (scan_id, chunk)
+        );
+        CREATE TABLE IF NOT EXISTS ports (
+            scan_id INTEGER NOT NULL REFERENCES scans (id),
+            port TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (scan_id, port)
+        );
+    """
+    
+    def __init__(self, path: Path = DEFAULT_STORE_PATH):
+        import sqlite3
+        
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+    
+    def close(self) -> None:
+        self._db.close()
+    
+    def fresh_scan(self, target: str, port_spec: str, options: str, ttl: float) -> Optional[int]:
+        """Return the newest completed scan finished less than ttl seconds ago."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM scans WHERE target = ? AND port_spec = ? AND options = ? "
+                "AND finished IS NOT NULL AND finished >= ? ORDER BY finished DESC LIMIT 1",
+                (target, port_spec, options, time.time() - ttl),
+            ).fetchone()
+        return row[0] if row else None
+    
+    def resumable_scan(self, target: str, port_spec: str, options: str) -> Optional[int]:
+        """Return the newest unfinished scan for a key, if any."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM scans WHERE target = ? AND port_spec = ? AND options = ? "
+                "AND finished IS NULL ORDER BY started DESC LIMIT 1",
+                (target, port_spec, options),
+            ).fetchone()
+        return row[0] if row else None
+    
+    def start_scan(self, target: str, port_spec: str, options: str) -> int:
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO scans (target, port_spec, options, started) VALUES (?, ?, ?, ?)",
+                (target, port_spec, options, time.time()),
+            )
+        return cursor.lastrowid
+    
+    def completed_chunks(self, scan_id: int) -> set:
+        with self._lock:
+            rows = self._db.execute("SELECT chunk FROM chunks WHERE scan_id = ?", (scan_id,)).fetchall()
+        return {row[0] for row in rows}
+    
+    def record_chunk(self, scan_id: int, chunk: str, open_ports: Iterable[str]) -> None:
+        """Record a finished chunk and its open ports in one transaction."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO ports (scan_id, port, state) VALUES (?, ?, 'open')",
+                [(scan_id, port) for port in open_ports],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO chunks (scan_id, chunk, finished) VALUES (?, ?, ?)",
+                (scan_id, chunk, time.time()),
+            )
+    
+    def finish_scan(self, scan_id: int) -> None:
+        with self._lock, self._db:
+            self._db.execute("UPDATE scans SET finished = ? WHERE id = ?", (time.time(), scan_id))
+    
+    def open_ports(self, scan_id: int) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT port FROM ports WHERE scan_id = ? AND state = 'open'", (scan_id,)
+            ).fetchall()
+        return sorted((row[0] for row in rows), key=lambda port: int(port) if port.isdigit() else 0)
+    
+    def completed_scans(self, target: str, port_spec: str, options: str, before: Optional[float] = None) -> List[Tuple[int, float]]:
+        """Return (scan_id, finished) for completed scans of a key, newest first."""
+        query = (
+            "SELECT id, finished FROM scans WHERE target = ? AND port_spec = ? AND options = ? "
+            "AND finished IS NOT NULL"
+        )
+        params = [target, port_spec, options]
+        if before is not None:
+            query += " AND finished < ?"
+            params.append(before)
+        with self._lock:
+            return self._db.execute(query + " ORDER BY finished DESC", params).fetchall()
+    
+    def changes(self, target: str, port_spec: str, options: str, since: Optional[float] = None) -> List[Tuple[str, str, str]]:
+        """Return (port, before, now) for ports whose state changed between runs.
+
+        Compares the newest completed scan with the one before it, or with the
+        newest scan finished before since when it is given.
+        """
+        scans = self.completed_scans(target, port_spec, options)
+        if not scans:
+            return []
+        if since is not None:
+            baseline = self.completed_scans(target, port_spec, options, before=since)[:1]
+        else:
+            baseline = scans[1:2]
+        
+        now = set(self.open_ports(scans[0][0]))
+        before = set(self.open_ports(baseline[0][0])) if baseline else set()
+        changed = [(port, "closed", "open") for port in now - before]
+        changed += [(port, "open", "closed") for port in before - now]
+        return sorted(changed, key=lambda change: int(change[0]) if change[0].isdigit() else 0)
+
+# Scan options that are part of the result store key
+NMAP_SCAN_OPTIONS = "-T4"
+PRESCAN_SCAN_OPTIONS = "prescan -sV -T4"
+
+def run_stored_scan(
+    target: str,
+    ports: Optional[str],
+    store: ResultStore,
+    ttl: float = 3600,
+    chunk_size: int = 1000,
+    chunk_scan: Optional[Callable[[str, Optional[str]], List[str]]] = None,
+    options: str = NMAP_SCAN_OPTIONS,
+) -> List[str]:
+    """Run a discovery scan through the result store.
+
+    Reuses a completed scan younger than ttl seconds, and resumes an
+    interrupted scan by skipping port chunks that already finished.
+    chunk_scan scans one chunk and must raise on failure; it defaults to
+    run_nmap_scan. options is part of the store key.
+    """
+    chunk_scan = chunk_scan or (lambda host, chunk: run_nmap_scan(host, chunk, raise_errors=True))
+    port_spec = ports or "fast"
+    scan_id = store.fresh_scan(target, port_spec, options, ttl) if ttl > 0 else None
+    if scan_id is not None:
+        open_ports = store.open_ports(scan_id)
+        console.print(f"[bold green]Reusing stored results for {target}:[/bold green] {', '.join(open_ports)}")
+        return open_ports
+    
+    scan_id = store.resumable_scan(target, port_spec, options)
+    if scan_id is None:
+        scan_id = store.start_scan(target, port_spec, options)
+    
+    done = store.completed_chunks(scan_id)
+    chunks = split_port_spec(ports, chunk_size)
+    if done:
+        console.print(f"[bold yellow]Resuming scan of {target}: {len(done)}/{len(chunks)} chunks already done[/bold yellow]")
+    
+    for chunk in chunks:
+        key = chunk or "fast"
+        if key in done:
+            continue
+        store.record_chunk(scan_id, key, chunk_scan(target, chunk))
+    
+    store.finish_scan(scan_id)
+    return store.open_ports(scan_id)
+
+def display_port_changes(target: str, changes: List[Tuple[str, str, str]]) -> None:
+    """Display ports whose state changed since the previous run."""
+    from rich.table import Table
+    
+    if not changes:
+        console.print(f"[bold green]No port state changes for {target} since the previous run.[/bold green]")
+        return
+    
+    table = Table(title=f"Port changes for {target}")
+    table.add_column("Port")
+    table.add_column("Before")
+    table.add_column("Now")
+    for port, before, now in changes:
+        table.add_row(port, before, now)
+    console.print(table)
+
+def stream_nmap_scan(target: str, ports: Optional[str] = None) -> Iterator[str]:
+    """Run an Nmap scan and yield each open port as soon as Nmap reports it.
+
+    Nmap runs through run_captured in a worker thread, so its output is
+    bounded the same way as other scans and it is killed if the caller stops
+    consuming results early. A failed scan is reported like run_nmap_scan.
+    """
+    # Verbose text is the only output Nmap writes per port: -oG and -oX only list a host's ports once it finishes
+    scan_cmd = build_scan_command(target, ports, verbose=True)
+    
+    console.print(f"[bold green]Running scan:[/bold green] {scan_cmd}")
+    
+    found = queue.Queue()
+    finished = object()
+    stopped = threading.Event()
+    kills = []
+    seen = set()
+    
+    def on_start(kill: Callable[[], None]) -> None:
+        kills.append(kill)
+        if stopped.is_set():
+            kill()
+    
+    def handle_line(line: str) -> None:
+        port = parse_nmap_line(line)
+        if port and port not in seen:
+            seen.add(port)
+            found.put(port)
+    
+    def run() -> None:
+        try:
+            result = run_captured(scan_cmd, line_handler=handle_line, phase="nmap", on_start=on_start)
+            if result["returncode"] != 0 and not stopped.is_set():
+                found.put(RuntimeError(f"Nmap exited with status {result['returncode']}: {result['tail'].strip()[-500:]}"))
+        except Exception as e:
+            found.put(e)
+        finally:
+            found.put(finished)
+    
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = found.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                console.print(f"[bold red]Error running Nmap scan:[/bold red] {str(item)}")
+                continue
+            yield item
+    finally:
+        # Stop Nmap if the caller stopped consuming results early
+        stopped.set()
+        for kill in kills:
+            kill()
+        worker.join()
+
+def stream_targets(targets: Iterable[str], ports: Optional[str] = None, concurrency: int = 4) -> Iterator[Tuple[str, str]]:
+    """Stream scans for many hosts at once, yielding (target, port) as ports are found."""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    results = queue.Queue()
+    done = object()
+    
+    def worker(host: str) -> None:
+        try:
+            for port in stream_nmap_scan(host, ports):
+                results.put((host, port))
+        finally:
+            results.put(done)
+    
+    targets = list(targets)
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        for host in targets:
+            executor.submit(worker, host)
+        remaining = len(targets)
+        while remaining:
+            item = results.get()
+            if item is done:
+                remaining -= 1
+            else:
+                yield item
+    except BaseException:
+        # Ctrl-C or a caller that stopped early: stop the running scans too
+        executor.shutdown(wait=False, cancel_futures=True)
+        stop_running_commands()
+        raise
+    executor.shutdown()
+
+def parse_address_range(part: str) -> Optional[Tuple[Any, Any]]:
+    """Return (first, last) addresses of a range such as 10.0.0.1-20 or 10.0.0.1-10.0.0.20.
+
+    Returns None if part is not an address range, e.g. a hostname containing
+    a dash. Raises ValueError for a range that ends before it starts.
+    """
+    if "-" not in part:
+        return None
+    start, _, end = part.partition("-")
+    try:
+        first = ipaddress.ip_address(start.strip())
+    except ValueError:
+        return None
+    end = end.strip()
+    if end.isdigit() and first.version == 4:
+        last = ipaddress.ip_address(start.strip().rsplit(".", 1)[0] + "." + end)
+    else:
+        last = ipaddress.ip_address(end)
+    if int(last) < int(first):
+        raise ValueError(f"Invalid target range: {part}")
+    return first, last
+
+# Most hosts one scan accepts (a /16); larger networks would be expanded before any scan starts
+MAX_TARGET_HOSTS = 65536
+
+def expand_targets(spec: str, max_hosts: int = MAX_TARGET_HOSTS) -> List[str]:
+    """Expand a target spec into individual hosts.
+
+    Accepts a single host, CIDR notation (10.0.0.0/24), a last-octet range
+    (10.0.0.1-20), a full address range (10.0.0.1-10.0.0.20) or a
+    comma-separated list of any of these. Raises ValueError if the spec
+    covers more than max_hosts hosts, before expanding it.
+    """
+    hosts = []
+    
+    def check_size(part: str, count: int) -> None:
+        if len(hosts) + count > max_hosts:
+            raise ValueError(f"Target {part} has {count} hosts; at most {max_hosts} can be scanned at once")
+    
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "/" in part:
+            try:
+                network = ipaddress.ip_network(part, strict=False)
+            except ValueError:
+                hosts.append(part)
+                continue
+            if network.num_addresses == 1:
+                hosts.append(str(network.network_address))
+            else:
+                check_size(part, network.num_addresses)
+                hosts.extend(str(host) for host in network.hosts())
+            continue
+        address_range = parse_address_range(part)
+        if address_range:
+            first, last = address_range
+            check_size(part, int(last) - int(first) + 1)
+            hosts.extend(str(ipaddress.ip_address(value)) for value in range(int(first), int(last) + 1))
+            continue
+        hosts.append(part)
+    
+    # Drop duplicates while keeping the order targets were given in
+    return list(dict.fromkeys(hosts))
+
+def load_targets_file(path: Path, max_hosts: int = MAX_TARGET_HOSTS) -> List[str]:
+    """Read target specs from a file, one per line. Lines starting with # are ignored.
+
+    Raises ValueError if the file covers more than max_hosts hosts.
+    """
+    hosts = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                hosts.extend(expand_targets(line, max_hosts - len(hosts)))
+    return list(dict.fromkeys(hosts))
+
+def scan_targets(
+    targets: Iterable[str],
+    ports: Optional[str] = None,
+    concurrency: int = 4,
+    scan_func: Callable[[str, Optional[str]], List[str]] = None,
+) -> Iterator[Tuple[str, List[str]]]:
+    """Run discovery scans for many hosts at once.
+
+    Yields (target, open_ports) tuples as each host finishes, so callers can
+    render results without waiting for the whole batch. scan_func defaults to
+    run_nmap_scan.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    
+    scan_func = scan_func or run_nmap_scan
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        futures = {executor.submit(scan_func, target, ports): target for target in targets}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    except BaseException:
+        # Ctrl-C or a caller that stopped early: drop the queued hosts and stop the running scans
+        executor.shutdown(wait=False, cancel_futures=True)
+        stop_running_commands()
+        raise
+    executor.shutdown()
+
+def count_child_processes() -> Optional[int]:
+    """Return how many live child processes this process has, or None where /proc is unavailable."""
+    pid = os.getpid()
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    children = 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            # The process exited while we were looking
+            continue
+        # The command name may contain spaces or parentheses; the parent PID follows the state after the last ")"
+        fields = stat.rsplit(b")", 1)[-1].split()
+        if len(fields) > 1 and fields[1] == str(pid).encode():
+            children += 1
+    return children
+
+# Nmap output lines that mean probes are being lost
+NMAP_LOSS_PATTERN = re.compile(r"dropped probes|retransmission cap hit|giving up on port")
+
+class AdaptiveScheduler:
+    """Runs discovery scans with concurrency and Nmap timing adapted to the machine and link.
+
+    After every scan the scheduler looks at the load average per CPU, the
+    number of child processes, the scan's duration against a moving average and
+    Nmap's packet-loss warnings. Any sign of overload halves concurrency (and
+    loss or a latency spike lowers the -T timing); clean scans add one slot
+    at a time and restore timing after a few clean runs. Targets with a
+    higher priority start first.
+    """
+    
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        timing: int = 4,
+        min_timing: int = 2,
+        load_limit: float = 1.0,
+        latency_factor: float = 2.0,
+        clean_runs_to_speed_up: int = 3,
+    ):
+        self.cpu_count = os.cpu_count() or 1
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        # Start low and grow, rather than start high and drop probes
+        self.concurrency = min(self.max_concurrency, max(self.min_concurrency, 2))
+        self.max_timing = timing
+        self.min_timing = min(min_timing, timing)
+        self.timing = timing
+        self.load_limit = load_limit
+        self.latency_factor = latency_factor
+        self.clean_runs_to_speed_up = clean_runs_to_speed_up
+        self.latency = None
+        self.clean_runs = 0
+        self.adjustments = []
+    
+    def load_per_cpu(self) -> Optional[float]:
+        """Return the 1-minute load average per CPU, or None where it is unavailable."""
+        try:
+            return os.getloadavg()[0] / self.cpu_count
+        except (AttributeError, OSError):
+            return None
+    
+    def observe(self, duration: float, loss_signals: int, running: int) -> None:
+        """Adjust concurrency and timing after a scan that took duration seconds.
+
+        running is the number of scans still in flight; it stands in for the
+        child process count where /proc is unavailable.
+        """
+        reasons = []
+        load = self.load_per_cpu()
+        if load is not None and load > self.load_limit:
+            reasons.append(f"load {load:.2f} per CPU")
+        children = count_child_processes()
+        if children is None:
+            if running > self.cpu_count * 2:
+                reasons.append(f"{running} scans on {self.cpu_count} CPUs")
+        elif children > self.cpu_count * 2:
+            reasons.append(f"{children} child processes on {self.cpu_count} CPUs")
+        slow = self.latency is not None and duration > self.latency * self.latency_factor
+        if slow:
+            reasons.append(f"scan took {duration:.1f}s against {self.latency:.1f}s on average")
+        if loss_signals:
+            reasons.append(f"{loss_signals} packet-loss warning(s)")
+        self.latency = duration if self.latency is None else 0.7 * self.latency + 0.3 * duration
+        
+        before = (self.concurrency, self.timing)
+        if reasons:
+            self.clean_runs = 0
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            if loss_signals or slow:
+                self.timing = max(self.min_timing, self.timing - 1)
+        else:
+            self.clean_runs += 1
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            if self.clean_runs >= self.clean_runs_to_speed_up and self.timing < self.max_timing:
+                self.timing += 1
+                self.clean_runs = 0
+        
+        if (self.concurrency, self.timing) != before:
+            reason = "; ".join(reasons) or "clean scans"
+            self.adjustments.append((before, (self.concurrency, self.timing), reason))
+            console.print(f"[dim]Scheduler: concurrency {self.concurrency}, -T{self.timing} ({reason})[/dim]")
+    
+    def run(
+        self,
+        targets: Iterable[str],
+        ports: Optional[str],
+        scan_func: Callable[[str, Optional[str], int, Callable[[str], None]], List[str]],
+        priorities: Optional[Any] = None,
+    ) -> Iterator[Tuple[str, List[str]]]:
+        """Scan targets, highest priority first, yielding (target, open_ports) as each finishes.
+
+        scan_func(target, ports, timing, on_line) runs one scan and passes
+        every Nmap output line to on_line. priorities is a dict or a
+        TargetPriorities.
+        """
+        import heapq
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        
+        priorities = priorities or {}
+        waiting = [(-priorities.get(target, 0), index, target) for index, target in enumerate(targets)]
+        heapq.heapify(waiting)
+        
+        def timed_scan(target: str, timing: int) -> Tuple[List[str], float, int]:
+            losses = []
+            
+            def on_line(line: str) -> None:
+                if NMAP_LOSS_PATTERN.search(line):
+                    losses.append(line)
+            
+            start = time.monotonic()
+            open_ports = scan_func(target, ports, timing, on_line)
+            return open_ports, time.monotonic() - start, len(losses)
+        
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            running = {}
+            while waiting or running:
+                while waiting and len(running) < self.concurrency:
+                    target = heapq.heappop(waiting)[2]
+                    running[executor.submit(timed_scan, target, self.timing)] = target
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    target = running.pop(future)
+                    open_ports, duration, losses = future.result()
+                    self.observe(duration, losses, len(running) + 1)
+                    yield target, open_ports
+        except BaseException:
+            # Ctrl-C or a caller that stopped early: stop the running scans instead of waiting for them
+            executor.shutdown(wait=False, cancel_futures=True)
+            stop_running_commands()
+            raise
+        executor.shutdown()
+
+class TargetPriorities:
+    """Scan priorities for hosts, networks and address ranges.
+
+    Targets are matched by network or range membership rather than by
+    expanding each spec, so a /8 costs the same as a single host. When
+    several rules match, the one given last wins.
+    """
+    
+    def __init__(self):
+        self.rules = []
+    
+    def add(self, spec: str, priority: int) -> None:
+        """Give every host of a target spec (as accepted by expand_targets) a priority."""
+        for part in spec.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            if "/" in part:
+                try:
+                    network = ipaddress.ip_network(part, strict=False)
+                except ValueError:
+                    self.rules.append((part, None, priority))
+                    continue
+                self.rules.append((network.network_address, network.broadcast_address, priority))
+                continue
+            address_range = parse_address_range(part)
+            if address_range:
+                self.rules.append((*address_range, priority))
+                continue
+            try:
+                address = ipaddress.ip_address(part)
+            except ValueError:
+                # A hostname only matches itself
+                self.rules.append((part, None, priority))
+                continue
+            self.rules.append((address, address, priority))
+    
+    def get(self, target: str, default: int = 0) -> int:
+        """Return the priority of the last rule that matches target."""
+        try:
+            address = ipaddress.ip_address(target)
+        except ValueError:
+            address = None
+        for first, last, priority in reversed(self.rules):
+            if last is None:
+                if first == target:
+                    return priority
+            elif address is not None and address.version == first.version and first <= address <= last:
+                return priority
+        return default
+
+def parse_priorities(specs: Iterable[str]) -> TargetPriorities:
+    """Parse --priority values such as "10.0.0.5=10" or "10.0.0.0/28=5".
+
+    Raises ValueError for malformed values.
+    """
+    priorities = TargetPriorities()
+    for spec in specs:
+        target, separator, value = spec.rpartition("=")
+        if not separator or not target or not value.lstrip("-").isdigit():
+            raise ValueError(f"Invalid priority '{spec}', expected TARGET=NUMBER")
+        priorities.add(target, int(value))
+    return priorities
+
+def iter_batch_records(stream: Iterable[str], input_format: str = "auto") -> Iterator[Dict[str, str]]:
+    """Yield lookup records from JSON Lines or CSV input.
+
+    Records have a "target" and either a "port" or a "service". CSV input
+    needs a header row. With "auto", JSON Lines is assumed when the first
+    non-blank line starts with "{".
+    """
+    lines = iter(stream)
+    if input_format == "auto":
+        first = ""
+        for first in lines:
+            if first.strip():
+                break
+        input_format = "jsonl" if first.lstrip().startswith("{") else "csv"
+        lines = itertools.chain([first], lines)
+    
+    if input_format == "csv":
+        import csv
+        
+        for row in csv.DictReader(lines):
+            yield {key.strip().lower(): (value or "").strip() for key, value in row.items() if key}
+        return
+    
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield {"_error": f"Invalid JSON on line {number}: {e}"}
+            continue
+        yield record if isinstance(record, dict) else {"_error": f"Line {number} is not a JSON object"}
+
+def resolve_batch_record(record: Dict[str, Any], templates: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Resolve one batch record into port plans, or a single error object."""
+    if "_error" in record:
+        return [{"error": record["_error"]}]
+    
+    target = str(record.get("target") or "target")
+    port = str(record.get("port") or "").strip()
+    service_name = str(record.get("service") or "").strip()
+    if port:
+        return [build_port_plan(port, templates, target)]
+    if service_name:
+        service_ports = find_service_ports(service_name, templates)
+        if not service_ports:
+            return [{"error": f"Service '{service_name}' not found in templates.", "record": record}]
+        return [build_port_plan(service_port, templates, target) for service_port in service_ports]
+    return [{"error": "Record needs a port or a service", "record": record}]
+
+def run_batch(
+    input_stream: Iterable[str],
+    output_stream,
+    templates: Dict[str, Any],
+    input_format: str = "auto",
+) -> int:
+    """Resolve every input record and write the plans as JSON Lines. Returns the record count."""
+    count = 0
+    write = output_stream.write
+    for record in iter_batch_records(input_stream, input_format):
+        for result in resolve_batch_record(record, templates):
+            write(json.dumps(result))
+            write("\n")
+        count += 1
+    output_stream.flush()
+    return count
+
+# Result file formats accepted by `enumcsh import`
+SCAN_FILE_FORMATS = ("auto", "xml", "gnmap", "masscan")
+
+# Service names that say nothing about what is listening
+VAGUE_SERVICE_NAMES = {"", "unknown", "tcpwrapped"}
+
+# One "port/state/protocol/owner/service/rpc/version/" entry of a grepable Nmap Ports: field
+GNMAP_PORT_PATTERN = re.compile(r"(?:^|, )(\d+)/([^/]*)/([^/]*)/[^/]*/([^/]*)/")
+
+def detect_scan_format(head: str) -> str:
+    """Guess a result file's format from its first few kilobytes."""
+    stripped = head.lstrip()
+    if stripped.startswith("<"):
+        return "xml"
+    if "\nHost: " in "\n" + stripped or stripped.startswith("# Nmap"):
+        return "gnmap"
+    return "masscan"
+
+def iter_nmap_xml(stream, chunk_size: int = 1 << 20) -> Iterator[Tuple[str, str, str, Optional[str]]]:
+    """Yield (host, port, protocol, service) for open ports in Nmap (or masscan) XML.
+
+    Feeds the file to expat in chunks and keeps only the current <host>, so
+    memory stays flat however large the file is. Raises ValueError on
+    malformed XML.
+    """
+    import xml.parsers.expat
+    
+    found = []
+    ports = []
+    port = None
+    address = None
+    in_host = False
+    
+    def start(name: str, attrs: Dict[str, str]) -> None:
+        nonlocal port, address, in_host
+        if name == "host":
+            in_host = True
+            address = None
+            ports.clear()
+        elif not in_host:
+            # e.g. the <address> of a <hosthint> block
+            return
+        elif name == "port":
+            port = [attrs.get("portid"), attrs.get("protocol", "tcp"), None, None]
+        elif port is not None and name == "state":
+            port[2] = attrs.get("state")
+        elif port is not None and name == "service":
+            port[3] = attrs.get("name")
+        elif name == "address" and address is None and attrs.get("addrtype") in ("ipv4", "ipv6"):
+            address = attrs.get("addr")
+    
+    def end(name: str) -> None:
+        nonlocal port, address, in_host
+        if name == "port" and port is not None:
+            ports.append(port)
+            port = None
+        elif name == "host":
+            if address is not None:
+                found.extend((address, portid, protocol, service) for portid, protocol, state, service in ports if state == "open")
+            ports.clear()
+            address = None
+            in_host = False
+    
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    while True:
+        chunk = stream.read(chunk_size)
+        try:
+            parser.Parse(chunk, not chunk)
+        except xml.parsers.expat.ExpatError as e:
+            raise ValueError(f"Invalid XML: {e}") from None
+        yield from found
+        found.clear()
+        if not chunk:
+            return
+
+def iter_gnmap(lines: Iterable[str]) -> Iterator[Tuple[str, str, str, Optional[str]]]:
+    """Yield (host, port, protocol, service) for open ports in grepable Nmap output (-oG)."""
+    for line in lines:
+        if not line.startswith("Host: ") or "Ports: " not in line:
+            continue
+        host = line[len("Host: "):].split(None, 1)[0]
+        ports_field = line.split("Ports: ", 1)[1].split("\t", 1)[0]
+        for match in GNMAP_PORT_PATTERN.finditer(ports_field):
+            port, state, protocol, service = match.groups()
+            if state == "open":
+                yield host, port, protocol or "tcp", service
+
+def iter_masscan(lines: Iterable[str]) -> Iterator[Tuple[str, str, str, Optional[str]]]:
+    """Yield (host, port, protocol, service) from masscan JSON (-oJ), NDJSON (-oD) or list (-oL) output.
+
+    The JSON array masscan writes has one record per line, so it is read line
+    by line like NDJSON.
+    """
+    for line in lines:
+        line = line.strip().rstrip(",")
+        if not line or line in ("[", "]") or line.startswith("#"):
+            continue
+        if not line.startswith("{"):
+            # List format: "open tcp 80 10.0.0.5 1700000000"
+            fields = line.split()
+            if len(fields) >= 4 and fields[0] == "open":
+                yield fields[3], fields[2], fields[1], None
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        host = record.get("ip")
+        for port in record.get("ports", []):
+            service = port.get("service") or {}
+            # Banner records carry a service instead of a status
+            if host and port.get("port") is not None and port.get("status", "open") == "open":
+                yield host, str(port["port"]), port.get("proto", "tcp"), service.get("name")
+
+def iter_scan_file(path: Path, input_format: str = "auto") -> Iterator[Tuple[str, str, str, Optional[str]]]:
+    """Stream open-port findings from an Nmap XML, grepable Nmap or masscan file (optionally gzipped)."""
+    import gzip
+    
+    path = Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    if input_format == "auto":
+        with opener(path, "rt", errors="replace") as f:
+            input_format = detect_scan_format(f.read(4096))
+    if input_format == "xml":
+        with opener(path, "rb") as f:
+            yield from iter_nmap_xml(f)
+        return
+    parse = iter_gnmap if input_format == "gnmap" else iter_masscan
+    with opener(path, "rt", errors="replace") as f:
+        yield from parse(f)
+
+def add_scan_finding(ports: Dict[str, Optional[str]], port: str, protocol: str, service: Optional[str]) -> None:
+    """Record a finding in {port key: service}, keeping the first specific service name.
+
+    Port keys follow the template convention: "80" for TCP, "161/udp" otherwise.
+    """
+    key = port if protocol == "tcp" else f"{port}/{protocol}"
+    if service and service not in VAGUE_SERVICE_NAMES:
+        ports[key] = ports.get(key) or service
+    else:
+        ports.setdefault(key, None)
+
+def iter_host_findings(
+    findings: Iterable[Tuple[str, str, str, Optional[str]]],
+) -> Iterator[Tuple[str, Dict[str, Optional[str]]]]:
+    """Group consecutive findings per host, yielding (host, {port key: service}) as each host ends.
+
+    Nmap XML and grepable output list each host once, so only one host's
+    ports are held at a time. masscan interleaves hosts, so a host can come
+    up in several groups there.
+    """
+    for host, host_findings in itertools.groupby(findings, key=lambda finding: finding[0]):
+        ports = {}
+        for _, port, protocol, service in host_findings:
+            add_scan_finding(ports, port, protocol, service)
+        yield host, ports
+
+def plan_scan_findings(
+    hosts: Iterable[Tuple[str, Dict[str, Optional[str]]]], templates: Dict[str, Any]
+) -> Iterator[List[Dict[str, Any]]]:
+    """Resolve (host, {port key: service}) groups to one list of port plans per group.
+
+    Ports without a template use the scanner's service name.
+    """
+    for host, ports in hosts:
+        yield [
+            build_port_plan(port, templates, host, ports[port])
+            for port in sorted(ports, key=lambda key: (int(key.split("/")[0]), key))
+        ]
+
+# Where a running `enumcsh serve` daemon records its address
+DEFAULT_DAEMON_STATE_PATH = Path(os.environ.get("ENUMCSH_DAEMON_STATE", Path.home() / ".enumcsh" / "serve.json"))
+DEFAULT_DAEMON_PORT = 8765
+
+class TemplateHolder:
+    """Keeps templates loaded in memory, reloading them when the file changes."""
+    
+    def __init__(self, templates_path: Path):
+        self.path = Path(templates_path).resolve()
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._templates = None
+    
+    def get(self) -> Dict[str, Any]:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if self._templates is None or mtime != self._mtime:
+                self._templates = load_templates(self.path)
+                self._mtime = mtime
+            return self._templates
+
+def handle_daemon_query(holder: TemplateHolder, path: str, params: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+    """Answer a daemon query. Returns (HTTP status, JSON response)."""
+    if path == "/health":
+        return 200, {"status": "ok", "pid": os.getpid(), "templates": str(holder.path)}
+    
+    templates = holder.get()
+    target = params.get("target", "target")
+    if path in ("/port", "/render") and params.get("port"):
+        plans = [build_port_plan(params["port"], templates, target)]
+    elif path in ("/service", "/render") and params.get("service"):
+        service_ports = find_service_ports(params["service"], templates)
+        if not service_ports:
+            return 404, {
+                "error": f"Service '{params['service']}' not found in templates.",
+                "suggestions": service_suggestions(params["service"], templates),
+            }
+        plans = [build_port_plan(port, templates, target) for port in service_ports]
+    elif path in ("/port", "/service", "/render"):
+        return 400, {"error": "Missing port or service parameter"}
+    else:
+        return 404, {"error": f"Unknown endpoint: {path}"}
+    
+    if path == "/render":
+        return 200, {"text": "".join(format_port_plain(plan) for plan in plans)}
+    return 200, {"plans": plans}
+
+def make_daemon_server(holder: TemplateHolder, host: str = "127.0.0.1", port: int = DEFAULT_DAEMON_PORT):
+    """Create the threaded HTTP server that answers lookup queries as JSON."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qsl, urlsplit
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            try:
+                status, response = handle_daemon_query(holder, url.path, dict(parse_qsl(url.query)))
+            except Exception as e:
+                status, response = 500, {"error": str(e)}
+            body = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format: str, *args: Any) -> None:
+            # Keep the daemon quiet; clients get errors in the JSON response
+            pass
+    
+    return ThreadingHTTPServer((host, port), Handler)
+
+def query_daemon(endpoint: str, params: Dict[str, str], templates_path: Path) -> Optional[Dict[str, Any]]:
+    """Forward a lookup to a running daemon serving the same templates file.
+
+    Returns None when no daemon is available, so callers fall back to a
+    local lookup. Set ENUMCSH_NO_DAEMON to always look up locally.
+    """
+    if os.environ.get("ENUMCSH_NO_DAEMON"):
+        return None
+    try:
+        with open(DEFAULT_DAEMON_STATE_PATH, "r") as f:
+            state = json.load(f)
+        if state["templates"] != str(Path(templates_path).resolve()):
+            return None
+        
+        import http.client
+        from urllib.parse import urlencode
+        
+        connection = http.client.HTTPConnection(state["host"], state["port"], timeout=1)
+        try:
+            connection.request("GET", f"{endpoint}?{urlencode(params)}")
+            response = connection.getresponse()
+            return json.loads(response.read())
+        finally:
+            connection.close()
+    except (OSError, ValueError, KeyError):
+        return None
+
+def interactive_mode(templates: Dict[str, Any]) -> None:
+    """Run the tool in interactive mode."""
+    from rich.panel import Panel
+    
+    # Display ASCII banner
+    console.print(f"[bold green]{ASCII_BANNER}[/bold green]")
+    console.print(Panel.fit("Welcome to Interactive Mode", border_style="green"))
+    
+    target = typer.prompt("Enter target IP/hostname")
+    enable_service_completion(templates)
+    
+    while True:
+        console.print("\n[bold]Choose an option:[/bold]")
+        console.print("1. Enter port number")
         console.print("2. Enter service name")
         console.print("3. Run Nmap scan")
         console.print("4. Exit")
@@ -276,27 +3327,23 @@ def interactive_mode(templates: Dict[str, Any]) -> None:
         
         if choice == 1:
             port = typer.prompt("Enter port number")
-            display_port_info(port, templates, target)
+            plan = display_port_info(port, templates, target)
             
             # Ask if user wants to execute Nmap command
-            nmap_cmd = templates["ports"].get(port, templates["ports"]["unknown"])["nmap"].replace("{target}", target)
-            if "{port}" in nmap_cmd:
-                nmap_cmd = nmap_cmd.replace("{port}", port)
-            
-            if typer.confirm("Do you want to execute the Nmap command?"):
-                execute_command(nmap_cmd)
+            if plan["nmap"] and typer.confirm("Do you want to execute the Nmap command?"):
+                execute_command(plan["nmap"])
                 
         elif choice == 2:
             service = typer.prompt("Enter service name").lower()
-            if service in templates["services"]:
-                port = templates["services"][service]
-                display_port_info(port, templates, target)
+            service_ports = find_service_ports(service, templates)
+            if service_ports:
+                display_ports_info(service_ports, templates, target)
             else:
                 console.print(f"[bold red]Service '{service}' not found in templates.[/bold red]")
+                suggest_services(service, templates)
                 
         elif choice == 3:
-            ports = run_nmap_scan(target)
-            for port in ports:
+            for port in stream_nmap_scan(target):
                 display_port_info(port, templates, target)
                 
         elif choice == 4:
@@ -311,52 +3358,471 @@ def port(
     port: str = typer.Option(None, "--port", "-p", help="Port number to enumerate"),
     target: str = typer.Option("target", "--target", "-t", help="Target IP/hostname"),
     execute: bool = typer.Option(False, "--execute", "-e", help="Execute the Nmap command"),
+    output_format: str = typer.Option("rich", "--format", help="Output format: rich, plain, json, markdown or sh"),
+    output_file: Path = typer.Option(None, "--output", "-o", help="Write --format output to this file"),
     templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
 ):
     """Enumerate a specific port."""
+    check_output_format(output_format)
+    response = query_daemon("/port", {"port": port, "target": target}, templates_path)
+    
+    if output_format != "rich":
+        if response is not None and "plans" in response:
+            plan = response["plans"][0]
+        else:
+            plan = build_port_plan(port, load_templates(templates_path), target)
+        write_plans([plan], output_format, output_file)
+        if execute and plan["nmap"]:
+            execute_command(plan["nmap"])
+        return
+    
+    if response is not None and "plans" in response:
+        plan = response["plans"][0]
+        if plan["generic"]:
+            console.print(f"[bold yellow]No specific template for port {port}. Using generic template.[/bold yellow]")
+        display_port_plan(plan)
+        if execute and plan["nmap"]:
+            execute_command(plan["nmap"])
+        return
+    
     templates = load_templates(templates_path)
-    display_port_info(port, templates, target)
+    plan = display_port_info(port, templates, target)
     
-    if execute:
-        port_data = templates["ports"].get(port, templates["ports"]["unknown"])
-        nmap_cmd = port_data["nmap"].replace("{target}", target)
-        if "{port}" in nmap_cmd:
-            nmap_cmd = nmap_cmd.replace("{port}", port)
-        execute_command(nmap_cmd)
+    if execute and plan["nmap"]:
+        execute_command(plan["nmap"])
 
 @app.command()
 def service(
     service_name: str = typer.Option(None, "--service", "-s", help="Service name to enumerate"),
     target: str = typer.Option("target", "--target", "-t", help="Target IP/hostname"),
     execute: bool = typer.Option(False, "--execute", "-e", help="Execute the Nmap command"),
+    output_format: str = typer.Option("rich", "--format", help="Output format: rich, plain, json, markdown or sh"),
+    output_file: Path = typer.Option(None, "--output", "-o", help="Write --format output to this file"),
     templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
 ):
     """Enumerate a specific service."""
+    check_output_format(output_format)
+    response = query_daemon("/service", {"service": service_name, "target": target}, templates_path)
+    
+    if output_format != "rich" and (response is None or "plans" not in response):
+        templates = load_templates(templates_path)
+        service_ports = find_service_ports(service_name, templates)
+        if not service_ports:
+            console.print(f"[bold red]Service '{service_name}' not found in templates.[/bold red]")
+            suggest_services(service_name, templates)
+            raise typer.Exit(code=1)
+        response = {"plans": [build_port_plan(port, templates, target) for port in service_ports]}
+    if output_format != "rich":
+        write_plans(response["plans"], output_format, output_file)
+        if execute:
+            for plan in response["plans"]:
+                if plan["nmap"]:
+                    execute_command(plan["nmap"])
+        return
+    
+    if response is not None and ("plans" in response or "error" in response):
+        if "error" in response:
+            console.print(f"[bold red]{response['error']}[/bold red]")
+            if response.get("suggestions"):
+                console.print(f"[bold yellow]Did you mean:[/bold yellow] {', '.join(response['suggestions'])}")
+            return
+        display_port_plans(response["plans"])
+        if execute:
+            for plan in response["plans"]:
+                if plan["nmap"]:
+                    execute_command(plan["nmap"])
+        return
+    
     templates = load_templates(templates_path)
     
-    if service_name.lower() in templates["services"]:
-        port = templates["services"][service_name.lower()]
-        display_port_info(port, templates, target)
+    service_ports = find_service_ports(service_name, templates)
+    if service_ports:
+        plans = display_ports_info(service_ports, templates, target)
         
         if execute:
-            port_data = templates["ports"][port]
-            nmap_cmd = port_data["nmap"].replace("{target}", target)
-            execute_command(nmap_cmd)
+            for plan in plans:
+                if plan["nmap"]:
+                    execute_command(plan["nmap"])
     else:
         console.print(f"[bold red]Service '{service_name}' not found in templates.[/bold red]")
+        suggest_services(service_name, templates)
 
 @app.command()
 def scan(
-    target: str = typer.Option(..., "--target", "-t", help="Target IP/hostname to scan"),
+    target: str = typer.Option(None, "--target", "-t", help="Target to scan: host, CIDR (10.0.0.0/24), range (10.0.0.1-20) or comma list"),
+    targets_file: Path = typer.Option(None, "--targets-file", "-f", help="File with one target spec per line"),
     ports: str = typer.Option(None, "--ports", help="Ports to scan (e.g., '80,443,8080' or '1-1000')"),
+    concurrency: int = typer.Option(4, "--concurrency", "-c", help="Maximum number of hosts scanned at once"),
+    adaptive: bool = typer.Option(False, "--adaptive", help="Adapt concurrency (up to --concurrency) and Nmap -T timing to load, latency and packet loss"),
+    priority: List[str] = typer.Option(None, "--priority", help="Scan some targets first, e.g. --priority 10.0.0.5=10 (repeatable; default 0, with --adaptive)"),
+    stream: bool = typer.Option(False, "--stream", help="Show suggestions as soon as each open port is found"),
+    execute_all_cmds: bool = typer.Option(False, "--execute-all", help="Run every discovered port's follow-up commands"),
+    workers: int = typer.Option(4, "--workers", "-w", help="Maximum number of follow-up commands run at once"),
+    log_dir: Path = typer.Option(DEFAULT_LOG_DIR, "--log-dir", help="Directory for follow-up command logs"),
+    timeout: float = typer.Option(DEFAULT_COMMAND_TIMEOUT, "--timeout", help="Per-command timeout in seconds for --execute-all and --pipeline (0 for none)"),
+    merge_nmap: bool = typer.Option(False, "--merge-nmap", help="Merge per-port template Nmap commands for --execute-all"),
+    show_plan: bool = typer.Option(False, "--plan", help="Print the merged Nmap follow-up plan without running it"),
+    use_store: bool = typer.Option(False, "--store", help="Keep results in the local result store; reuse fresh results and resume interrupted scans"),
+    store_path: Path = typer.Option(DEFAULT_STORE_PATH, "--store-path", help="Path to the SQLite result store"),
+    ttl: float = typer.Option(3600, "--ttl", help="Reuse stored results younger than this many seconds (0 disables reuse)"),
+    chunk_size: int = typer.Option(1000, "--chunk-size", help="Ports per resumable scan chunk"),
+    diff: bool = typer.Option(False, "--diff", help="Only list ports whose state changed since the previous run (implies --store)"),
+    since: str = typer.Option(None, "--since", help="With --diff, compare against the last run before this date (e.g. 2024-05-01T12:00)"),
+    prescan: bool = typer.Option(False, "--prescan", help="Find open ports with a TCP connect sweep (all ports unless --ports), then run Nmap -sV on those only"),
+    prescan_concurrency: int = typer.Option(500, "--prescan-concurrency", help="Maximum connection attempts in flight per host for --prescan"),
+    prescan_timeout: float = typer.Option(1.0, "--prescan-timeout", help="Connect timeout in seconds for --prescan"),
+    prescan_retries: int = typer.Option(1, "--prescan-retries", help="Retries for ports that time out during --prescan"),
+    rate: float = typer.Option(0, "--rate", help="Maximum connection attempts per second per host for --prescan (0 = unlimited)"),
+    pipeline: bool = typer.Option(False, "--pipeline", help="Run the templates' dependency-aware step pipeline for every discovered port (capacity --workers)"),
+    pipeline_state: Path = typer.Option(None, "--pipeline-state", help="Pipeline state file; steps that succeeded there are not rerun (default: <log-dir>/pipeline-state.json)"),
+    banners: bool = typer.Option(False, "--banners", help="Grab banners from open ports without a template and use the matched service's template"),
+    banner_timeout: float = typer.Option(2.0, "--banner-timeout", help="Connect and read timeout in seconds for --banners"),
+    output_format: str = typer.Option("rich", "--format", help="Output format: rich, plain, json, markdown or sh"),
+    output_file: Path = typer.Option(None, "--output", "-o", help="Write --format output to this file"),
     templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
 ):
-    """Scan target and provide enumeration suggestions."""
+    """Scan target(s) and provide enumeration suggestions."""
+    check_output_format(output_format)
+    targets = []
+    try:
+        if target:
+            targets.extend(expand_targets(target))
+        if targets_file:
+            targets.extend(load_targets_file(targets_file, MAX_TARGET_HOSTS - len(targets)))
+    except (OSError, ValueError) as e:
+        console.print(f"[bold red]Error:[/bold red] {str(e)}")
+        raise typer.Exit(code=1)
+    targets = list(dict.fromkeys(targets))
+    
+    if not targets:
+        console.print("[bold red]Error:[/bold red] Provide --target or --targets-file")
+        raise typer.Exit(code=1)
+    
+    try:
+        priorities = parse_priorities(priority or [])
+    except ValueError as e:
+        console.print(f"[bold red]Error:[/bold red] {str(e)}")
+        raise typer.Exit(code=1)
+    
+    since_time = None
+    if since:
+        try:
+            since_time = datetime.fromisoformat(since).timestamp()
+        except ValueError:
+            console.print(f"[bold red]Error:[/bold red] Invalid --since date: {since}")
+            raise typer.Exit(code=1)
+        diff = True
+    
     templates = load_templates(templates_path)
-    discovered_ports = run_nmap_scan(target, ports)
+    findings = []
     
-    for port in discovered_ports:
-        display_port_info(port, templates, target)
+    scan_func = run_nmap_scan
+    chunk_scan = None
+    scan_options = NMAP_SCAN_OPTIONS
+    if prescan:
+        if ports and expand_port_spec(ports) is None:
+            console.print(f"[bold red]Error:[/bold red] --prescan needs numeric ports, got: {ports}")
+            raise typer.Exit(code=1)
+        if stream:
+            console.print("[bold yellow]--prescan is not used with --stream.[/bold yellow]")
+        else:
+            ports = ports or FULL_PORT_RANGE
+            scan_options = PRESCAN_SCAN_OPTIONS
+            
+            def scan_func(host: str, host_ports: Optional[str]) -> List[str]:
+                return run_prescan_scan(host, host_ports, prescan_concurrency, prescan_timeout, prescan_retries, rate)
+            
+            def chunk_scan(host: str, chunk: Optional[str]) -> List[str]:
+                return run_prescan_scan(
+                    host, chunk, prescan_concurrency, prescan_timeout, prescan_retries, rate, raise_errors=True
+                )
+    
+    store = None
+    # Hosts whose stored scan failed; they are neither finished in the store nor diffed
+    failed_hosts = set()
+    if use_store or diff:
+        if stream:
+            console.print("[bold yellow]The result store is not used with --stream.[/bold yellow]")
+        else:
+            store = ResultStore(store_path)
+            
+            def scan_func(host: str, host_ports: Optional[str]) -> List[str]:
+                try:
+                    return run_stored_scan(host, host_ports, store, ttl, chunk_size, chunk_scan, scan_options)
+                except Exception:
+                    # Already reported; the unfinished chunks are retried next run
+                    failed_hosts.add(host)
+                    return []
+    
+    plans = []
+    identified = {}
+    
+    def note(host: str, port: str) -> Optional[str]:
+        service = identified.get((host, port))
+        if service:
+            console.print(f"[bold cyan]{host}:{port} identified as {service} from its banner[/bold cyan]")
+        findings.append((host, port))
+        return service
+    
+    def emit(host: str, port: str) -> None:
+        service = note(host, port)
+        # Rich output is shown as results arrive; other formats are written in bulk at the end
+        if output_format == "rich":
+            display_port_info(port, templates, host, service)
+        else:
+            plans.append(build_port_plan(port, templates, host, service))
+    
+    def report(host: str, discovered_ports: List[str]) -> None:
+        if host in failed_hosts:
+            console.print(f"[bold red]Scan of {host} failed;[/bold red] no results were stored or compared")
+            return
+        if store is not None and diff:
+            changes = store.changes(host, ports or "fast", scan_options, since_time)
+            display_port_changes(host, changes)
+            discovered_ports = [port for port, _, now in changes if now == "open"]
+        if banners:
+            # Every unknown port of the host is probed at once
+            identified.update(identify_services([(host, port) for port in discovered_ports], templates, banner_timeout))
+        services = {port: note(host, port) for port in discovered_ports}
+        if output_format == "rich":
+            # One batch per host, so its commands are highlighted in one pass per language
+            display_ports_info(discovered_ports, templates, host, services)
+        else:
+            plans.extend(build_port_plan(port, templates, host, services[port]) for port in discovered_ports)
+    
+    if adaptive and stream:
+        console.print("[bold yellow]--adaptive is not used with --stream.[/bold yellow]")
+    if priority and not (adaptive and not stream):
+        console.print("[bold yellow]--priority only applies with --adaptive and is ignored.[/bold yellow]")
+    
+    try:
+        if adaptive and not stream:
+            scheduler = AdaptiveScheduler(max_concurrency=concurrency)
+            
+            def adaptive_scan(host: str, host_ports: Optional[str], timing: int, on_line: Callable[[str], None]) -> List[str]:
+                # Timing and loss signals only apply to plain Nmap discovery; other modes still get adaptive concurrency
+                if scan_func is run_nmap_scan:
+                    # Nmap only prints its "dropped probes" warnings at -v
+                    return run_nmap_scan(host, host_ports, timing=timing, on_line=on_line, verbose=True)
+                return scan_func(host, host_ports)
+            
+            console.print(f"[bold green]Scanning {len(targets)} host(s) adaptively, up to {concurrency} at once[/bold green]")
+            for host, discovered_ports in scheduler.run(targets, ports, adaptive_scan, priorities):
+                if len(targets) > 1:
+                    from rich.panel import Panel
+                    
+                    console.print(Panel.fit(f"Host {host} - {len(discovered_ports)} open port(s)", border_style="green"))
+                report(host, discovered_ports)
+        elif stream:
+            for host, port in stream_targets(targets, ports, concurrency):
+                if banners:
+                    identified.update(identify_services([(host, port)], templates, banner_timeout))
+                emit(host, port)
+        elif len(targets) == 1:
+            report(targets[0], scan_func(targets[0], ports))
+        else:
+            from rich.panel import Panel
+            
+            console.print(f"[bold green]Scanning {len(targets)} hosts with concurrency {concurrency}[/bold green]")
+            for host, discovered_ports in scan_targets(targets, ports, concurrency, scan_func):
+                console.print(Panel.fit(f"Host {host} - {len(discovered_ports)} open port(s)", border_style="green"))
+                report(host, discovered_ports)
+    
+    finally:
+        if store is not None:
+            store.close()
+    
+    if output_format != "rich":
+        write_plans(plans, output_format, output_file)
+    
+    if show_plan and findings:
+        display_nmap_plan(plan_nmap_runs(findings, templates, identified))
+    
+    if pipeline and findings:
+        run_pipeline_command(findings, templates, log_dir, workers, timeout, pipeline_state, identified)
+    elif execute_all_cmds and findings:
+        jobs = [
+            (host, port, command)
+            for host, port in findings
+            for command in collect_followup_commands(
+                port, templates, host, include_nmap=not merge_nmap, service=identified.get((host, port))
+            )
+        ]
+        if merge_nmap:
+            jobs = [(run["target"], "merged", run["command"]) for run in plan_nmap_runs(findings, templates, identified)] + jobs
+        console.print(f"[bold yellow]Running {len(jobs)} follow-up commands with {workers} workers[/bold yellow]")
+        results = execute_all(jobs, log_dir, workers, timeout)
+        display_execution_summary(results)
+
+@app.command()
+def plan(
+    ports: str = typer.Option(..., "--ports", "-p", help="Comma-separated open ports (e.g., '21,22,80')"),
+    target: str = typer.Option("target", "--target", "-t", help="Target IP/hostname"),
+    templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
+):
+    """Show the merged Nmap follow-up plan for a list of open ports."""
+    templates = load_templates(templates_path)
+    findings = [(target, port.strip()) for port in ports.split(",") if port.strip()]
+    display_nmap_plan(plan_nmap_runs(findings, templates))
+
+@app.command("pipeline")
+def pipeline_command(
+    ports: str = typer.Option(..., "--ports", "-p", help="Comma-separated open ports (e.g., '22,80,443')"),
+    target: str = typer.Option(..., "--target", "-t", help="Target IP/hostname"),
+    workers: int = typer.Option(4, "--workers", "-w", help="Total step weight allowed to run at once"),
+    log_dir: Path = typer.Option(DEFAULT_LOG_DIR, "--log-dir", help="Directory for step logs"),
+    timeout: float = typer.Option(DEFAULT_COMMAND_TIMEOUT, "--timeout", help="Per-step timeout in seconds (0 for none)"),
+    state_path: Path = typer.Option(None, "--state", help="State file; steps that succeeded there are not rerun (default: <log-dir>/pipeline-state.json)"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Show the steps and their dependencies without running them"),
+    templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
+):
+    """Run the dependency-aware enumeration pipeline for known open ports."""
+    templates = load_templates(templates_path)
+    findings = [(target, port.strip()) for port in ports.split(",") if port.strip()]
+    run_pipeline_command(findings, templates, log_dir, workers, timeout, state_path, dry_run=dry_run)
+
+@app.command("import-services")
+def import_services(
+    services_file: Path = typer.Argument(..., help="nmap-services style file to import"),
+    min_frequency: float = typer.Option(0.0, "--min-frequency", help="Skip entries with a lower open-frequency"),
+    templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
+):
+    """Import generic templates for every port in an nmap-services file."""
+    templates = load_templates(templates_path, use_cache=False)
+    try:
+        added = import_nmap_services(services_file, templates, min_frequency)
+    except OSError as e:
+        console.print(f"[bold red]Error:[/bold red] {str(e)}")
+        raise typer.Exit(code=1)
+    
+    with open(templates_path, "w") as f:
+        json.dump(templates, f, indent=4)
+    console.print(f"[bold green]Imported {added} templates into {templates_path}[/bold green]")
+
+@app.command()
+def search(
+    query: str = typer.Argument(..., help="Service name, alias, description or command words"),
+    limit: int = typer.Option(10, "--limit", "-n", help="Maximum number of results"),
+    templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
+):
+    """Fuzzy search templates by service, alias, description and command text."""
+    templates = load_templates(templates_path)
+    matches = search_templates(query, templates, limit)
+    if not matches:
+        console.print(f"[bold red]No templates match '{query}'.[/bold red]")
+        raise typer.Exit(code=1)
+    
+    if PLAIN_OUTPUT:
+        for score, key in matches:
+            port_data = templates["ports"][key]
+            console.print(f"{score:.3f}\t{key}\t{port_data.get('service', '')}\t{port_data.get('description', '')}")
+        return
+    
+    from rich.table import Table
+    
+    table = Table(title=f"Templates matching '{query}'")
+    table.add_column("Score", justify="right")
+    table.add_column("Port")
+    table.add_column("Service")
+    table.add_column("Description")
+    for score, key in matches:
+        port_data = templates["ports"][key]
+        table.add_row(f"{score:.2f}", key, port_data.get("service", ""), port_data.get("description", ""))
+    console.print(table)
+
+@app.command()
+def batch(
+    input_file: Path = typer.Argument(None, help="JSON Lines or CSV input (default: stdin)"),
+    input_format: str = typer.Option("auto", "--input-format", "-i", help="Input format: auto, jsonl or csv"),
+    output_file: Path = typer.Option(None, "--output", "-o", help="Write JSON Lines here instead of stdout"),
+    templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
+):
+    """Resolve many (target, port|service) records and stream the plans as JSON Lines."""
+    if input_format not in ("auto", "jsonl", "csv"):
+        console.print(f"[bold red]Error:[/bold red] Unknown input format: {input_format}")
+        raise typer.Exit(code=1)
+    
+    templates = load_templates(templates_path)
+    input_stream = open(input_file, "r", newline="") if input_file else sys.stdin
+    output_stream = open(output_file, "w") if output_file else sys.stdout
+    try:
+        run_batch(input_stream, output_stream, templates, input_format)
+    finally:
+        if input_file:
+            input_stream.close()
+        if output_file:
+            output_stream.close()
+
+@app.command("import")
+def import_results(
+    scan_file: Path = typer.Argument(..., help="Nmap XML (-oX), grepable Nmap (-oG) or masscan JSON/NDJSON/list file; .gz is read directly"),
+    input_format: str = typer.Option("auto", "--input-format", "-i", help="Input format: auto, xml, gnmap or masscan"),
+    output_format: str = typer.Option("rich", "--format", help="Output format: rich, plain, json, markdown or sh"),
+    output_file: Path = typer.Option(None, "--output", "-o", help="Write --format output to this file"),
+    templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
+):
+    """Build enumeration plans from existing Nmap or masscan results."""
+    check_output_format(output_format)
+    if input_format not in SCAN_FILE_FORMATS:
+        console.print(f"[bold red]Error:[/bold red] Unknown input format '{input_format}'. Choose from: {', '.join(SCAN_FILE_FORMATS)}")
+        raise typer.Exit(code=1)
+    
+    templates = load_templates(templates_path)
+    counts = {"hosts": 0, "ports": 0}
+    
+    def count(hosts: Iterable[Tuple[str, Dict[str, Optional[str]]]]) -> Iterator[Tuple[str, Dict[str, Optional[str]]]]:
+        for host, ports in hosts:
+            counts["hosts"] += 1
+            counts["ports"] += len(ports)
+            yield host, ports
+    
+    # Plans are written host by host while the file is parsed, so memory stays flat
+    try:
+        with trace_phase("import", path=str(scan_file), format=input_format) as phase:
+            hosts = count(iter_host_findings(iter_scan_file(scan_file, input_format)))
+            write_plan_groups(plan_scan_findings(hosts, templates), output_format, output_file)
+            phase.update(counts)
+    except (OSError, ValueError) as e:
+        console.print(f"[bold red]Error:[/bold red] Could not read {scan_file}: {str(e)}")
+        raise typer.Exit(code=1)
+    
+    console.print(f"[bold green]Imported {counts['ports']} open port(s) on {counts['hosts']} host(s)[/bold green]")
+
+@app.command()
+def serve(
+    host: str = typer.Option("127.0.0.1", "--host", help="Address to listen on"),
+    listen_port: int = typer.Option(DEFAULT_DAEMON_PORT, "--port", "-p", help="Port to listen on"),
+    templates_path: Path = typer.Option(DEFAULT_TEMPLATES_PATH, "--templates", help="Path to templates JSON file")
+):
+    """Keep templates loaded and answer lookups over local HTTP as JSON."""
+    holder = TemplateHolder(templates_path)
+    holder.get()
+    server = make_daemon_server(holder, host, listen_port)
+    address, bound_port = server.server_address[:2]
+    
+    DEFAULT_DAEMON_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(DEFAULT_DAEMON_STATE_PATH, "w") as f:
+        json.dump({"host": address, "port": bound_port, "pid": os.getpid(), "templates": str(holder.path)}, f)
+    
+    console.print(f"[bold green]Serving {holder.path} on http://{address}:{bound_port}[/bold green]")
+    console.print("Endpoints: /port?port=80&target=X, /service?service=http&target=X, /render?port=80, /health")
+    
+    def stop(signum: int, frame: Any) -> None:
+        raise KeyboardInterrupt
+    
+    # Clean up the state file when stopped with Ctrl-C or SIGTERM
+    import signal
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(DEFAULT_DAEMON_STATE_PATH)
+        except OSError:
+            pass
 
 @app.command()
 def interactive(
@@ -366,12 +3832,41 @@ def interactive(
     templates = load_templates(templates_path)
     interactive_mode(templates)
 
+# Commands whose stdout is machine-readable and must not get the banner
+MACHINE_OUTPUT_COMMANDS = {"batch"}
+
+def enable_tracing(ctx: typer.Context, trace_path: Optional[Path], profile: bool) -> None:
+    """Record trace events for this run; write them and/or show a profile when the command ends."""
+    recorder = add_trace_hook(TraceRecorder())
+    
+    def finish() -> None:
+        remove_trace_hook(recorder)
+        if trace_path:
+            recorder.write(trace_path)
+            console.print(f"[bold green]Trace written to {trace_path}[/bold green]")
+        if profile:
+            display_trace_summary(recorder)
+    
+    ctx.call_on_close(finish)
+
 @app.callback()
-def main():
+def main(
+    ctx: typer.Context,
+    plain: bool = typer.Option(False, "--plain", help="Plain text output: no banner, colors or highlighting"),
+    trace: Path = typer.Option(None, "--trace", help="Write phase timings, child processes and peak memory as a Chrome trace-event JSON file"),
+    profile: bool = typer.Option(False, "--profile", help="Show per-phase wall/CPU time and peak memory when the command ends"),
+):
     """enumCSh - A CLI tool for port enumeration cheatsheets."""
+    if trace or profile:
+        enable_tracing(ctx, trace, profile)
+    
+    # Pipes and editor integrations get the fast plain-text path
+    if plain or not sys.stdout.isatty() or ctx.invoked_subcommand in MACHINE_OUTPUT_COMMANDS:
+        set_plain_output(True)
+        return
+    
     # Display ASCII banner when the tool is launched
     console.print(f"[bold green]{ASCII_BANNER}[/bold green]")
-    pass
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
@@ -3,8 +3,15 @@
 Test script for enumCSh.
 """
 
+import gzip
+import io
 import os
 import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from pathlib import Path
 from unittest.mock import patch, MagicMock
@@ -12,6 +19,10 @@ from unittest.mock import patch, MagicMock
 # Import the main module
 import enumcsh
 
+def load_json_copy(data):
+    """Return a deep copy of JSON-compatible test data."""
+    return json.loads(json.dumps(data))
+
 class TestEnumCSh(unittest.TestCase):
     """Test cases for enumCSh."""
     
@@ -55,9 +66,10 @@ class TestEnumCSh(unittest.TestCase):
     
     def tearDown(self):
         """Clean up after tests."""
-        # Remove the test templates file
-        if self.test_templates_path.exists():
-            os.remove(self.test_templates_path)
+        # Remove the test templates file and its compiled cache
+        for path in (self.test_templates_path, enumcsh.template_cache_path(self.test_templates_path)):
+            if path.exists():
+                os.remove(path)
     
     def test_load_templates(self):
         """Test loading templates from file."""
@@ -65,6 +77,32 @@ class TestEnumCSh(unittest.TestCase):
         self.assertEqual(templates["ports"]["80"]["service"], "http")
         self.assertEqual(templates["services"]["http"], "80")
     
+    def test_load_templates_cache(self):
+        """Test that templates are served from the compiled cache until the file changes."""
+        enumcsh.load_templates(self.test_templates_path)
+        self.assertTrue(enumcsh.template_cache_path(self.test_templates_path).exists())
+        
+        with patch("enumcsh.build_template_cache") as mock_build:
+            templates = enumcsh.load_templates(self.test_templates_path)
+            mock_build.assert_not_called()
+        self.assertEqual(templates["ports"]["80"]["service"], "http")
+        # The fuzzy search index is only built when something searches
+        self.assertIsNone(enumcsh._TEMPLATE_INDEX_CACHE["search"])
+        self.assertEqual(enumcsh.search_templates("http", templates)[0][1], "80")
+        
+        self.test_templates["ports"]["80"]["service"] = "www"
+        with open(self.test_templates_path, "w") as f:
+            json.dump(self.test_templates, f, indent=2)
+        templates = enumcsh.load_templates(self.test_templates_path)
+        self.assertEqual(templates["ports"]["80"]["service"], "www")
+    
+    def test_render_template(self):
+        """Test filling placeholders from pre-tokenized templates."""
+        self.assertEqual(
+            enumcsh.render_template("nc -nv {target} {port} {other}", target="10.0.0.5", port="8081"),
+            "nc -nv 10.0.0.5 8081 {other}"
+        )
+    
     @patch("enumcsh.console")
     def test_display_port_info_known_port(self, mock_console):
         """Test displaying information for a known port."""
@@ -81,22 +119,91 @@ class TestEnumCSh(unittest.TestCase):
             "[bold yellow]No specific template for port 12345. Using generic template.[/bold yellow]"
         )
     
-    @patch("enumcsh.subprocess.run")
+    @patch("enumcsh.console")
+    def test_display_port_info_keeps_generic_template(self, mock_console):
+        """Test that unknown ports never write their port into the shared generic template."""
+        unknown = load_json_copy(self.test_templates["ports"]["unknown"])
+        first = enumcsh.display_port_info("12345", self.test_templates, "192.168.1.1")
+        second = enumcsh.display_port_info("23456", self.test_templates, "192.168.1.1")
+        self.assertEqual(self.test_templates["ports"]["unknown"], unknown)
+        self.assertIn("23456", second["nmap"])
+        self.assertNotIn("12345", second["nmap"])
+        self.assertIn("12345", first["nmap"])
+    
+    def test_render_cache_is_bounded(self):
+        """Test that rendering is memoized and the cache stays within its bound."""
+        enumcsh._render_cached.cache_clear()
+        for _ in range(3):
+            enumcsh.render_template("nmap -p {port} {target}", target="10.0.0.5", port="22")
+        info = enumcsh._render_cached.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
+        for port in range(enumcsh.RENDER_CACHE_SIZE + 100):
+            enumcsh.render_template("nc {target} {port}", target="10.0.0.5", port=str(port))
+        self.assertEqual(enumcsh._render_cached.cache_info().currsize, enumcsh.RENDER_CACHE_SIZE)
+    
+    @patch("enumcsh.run_captured")
     @patch("enumcsh.typer.confirm", return_value=True)
     @patch("enumcsh.console")
     def test_execute_command(self, mock_console, mock_confirm, mock_run):
         """Test executing a command with confirmation."""
-        enumcsh.execute_command("echo test")
+        mock_run.return_value = {"returncode": 0, "duration": 0.1, "bytes": 5, "log": "test.log.gz"}
+        enumcsh.execute_command("echo test", log_dir=Path("logs"))
         mock_confirm.assert_called_once()
-        mock_run.assert_called_once_with("echo test", shell=True)
+        mock_run.assert_called_once()
+        self.assertEqual(mock_run.call_args.args[0], "echo test")
+        self.assertTrue(mock_run.call_args.args[1].name.endswith("-echo.log.gz"))
+        self.assertTrue(mock_run.call_args.kwargs["echo"])
     
-    @patch("enumcsh.subprocess.run")
+    def test_run_captured(self):
+        """Test streaming capture to a compressed log with a bounded tail."""
+        script = "import sys; sys.stdout.write('x' * 300000 + '\\nlast line'); sys.exit(2)"
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = Path(tmp) / "out.log.gz"
+            lines = []
+            result = enumcsh.run_captured(f'"{sys.executable}" -c "{script}"', log_path, line_handler=lines.append)
+            with gzip.open(log_path, "rt") as f:
+                log = f.read()
+        self.assertEqual(result["returncode"], 2)
+        self.assertEqual(result["bytes"], 300000 + len("\nlast line"))
+        self.assertLess(result["log_bytes"], 10000)
+        self.assertEqual(len(result["tail"]), enumcsh.CAPTURE_TAIL_SIZE)
+        self.assertTrue(result["tail"].endswith("last line"))
+        self.assertIn("x" * 300000, log)
+        # The overlong first line is cut to the tail size
+        self.assertEqual([len(line) for line in lines], [enumcsh.CAPTURE_TAIL_SIZE, len("last line")])
+        
+        result = enumcsh.run_captured(f'"{sys.executable}" -c "import time; time.sleep(5)"', timeout=0.2)
+        self.assertIsNone(result["returncode"])
+        self.assertLess(result["duration"], 4)
+        
+        # The timeout kills the whole tree; a surviving grandchild would keep the output open
+        tree = "import subprocess, sys; subprocess.run([sys.executable, '-c', 'import time; time.sleep(30)'])"
+        result = enumcsh.run_captured(f'"{sys.executable}" -c "{tree}"', timeout=0.2)
+        self.assertIsNone(result["returncode"])
+        self.assertLess(result["duration"], 4)
+        if os.name == "posix":
+            result = enumcsh.run_captured(f'"{sys.executable}" -c "import os; print(os.getsid(0))"')
+            self.assertNotEqual(int(result["tail"]), os.getsid(0))
+        
+        # An exception while reading (e.g. Ctrl-C) kills the command instead of leaving it running
+        with tempfile.TemporaryDirectory() as tmp:
+            marker = Path(tmp) / "marker"
+            script = f"import time; print('ready', flush=True); time.sleep(0.5); open({str(marker)!r}, 'w').close()"
+            
+            def interrupt(line):
+                raise KeyboardInterrupt
+            
+            with self.assertRaises(KeyboardInterrupt):
+                enumcsh.run_captured(f'"{sys.executable}" -c "{script}"', line_handler=interrupt)
+            time.sleep(1)
+            self.assertFalse(marker.exists())
+    
+    @patch("enumcsh.build_scan_command")
     @patch("enumcsh.console")
-    def test_run_nmap_scan(self, mock_console, mock_run):
+    def test_run_nmap_scan(self, mock_console, mock_build):
         """Test running an Nmap scan."""
-        # Mock the subprocess.run result
-        mock_process = MagicMock()
-        mock_process.stdout = """
+        # A stand-in for nmap that prints recorded output
+        output = """
         Starting Nmap 7.80 ( https://nmap.org )
         Nmap scan report for localhost (127.0.0.1)
         Host is up (0.00026s latency).
@@ -108,10 +215,752 @@ class TestEnumCSh(unittest.TestCase):
         
         Nmap done: 1 IP address (1 host up) scanned in 0.05 seconds
         """
-        mock_run.return_value = mock_process
-        
-        ports = enumcsh.run_nmap_scan("127.0.0.1")
+        with tempfile.TemporaryDirectory() as tmp:
+            output_path = Path(tmp) / "nmap.txt"
+            output_path.write_text(output)
+            mock_build.return_value = f'"{sys.executable}" -c "import sys; sys.stdout.write(open(sys.argv[1]).read())" "{output_path}"'
+            ports = enumcsh.run_nmap_scan("127.0.0.1")
         self.assertEqual(ports, ["22", "80", "443"])
+        
+        mock_build.return_value = f'"{sys.executable}" -c "import sys; sys.exit(1)"'
+        self.assertEqual(enumcsh.run_nmap_scan("127.0.0.1"), [])
+        with self.assertRaises(RuntimeError):
+            enumcsh.run_nmap_scan("127.0.0.1", raise_errors=True)
+
+    def test_expand_targets(self):
+        """Test expanding CIDR, range and list target specs."""
+        self.assertEqual(enumcsh.expand_targets("10.0.0.0/30"), ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(enumcsh.expand_targets("10.0.0.1-3"), ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+        self.assertEqual(enumcsh.expand_targets("10.0.0.9-10.0.0.10"), ["10.0.0.9", "10.0.0.10"])
+        self.assertEqual(enumcsh.expand_targets("web-01,10.0.0.1/32,web-01"), ["web-01", "10.0.0.1"])
+        # Oversized networks are rejected before they are expanded
+        with self.assertRaises(ValueError):
+            enumcsh.expand_targets("10.0.0.0/8")
+        with self.assertRaises(ValueError):
+            enumcsh.expand_targets("10.0.0.1,10.0.1.1-10", max_hosts=10)
+    
+    @patch("enumcsh.run_nmap_scan", side_effect=lambda target, ports=None: ["22"] if target.endswith("1") else [])
+    def test_scan_targets(self, mock_scan):
+        """Test scanning many hosts through the worker pool."""
+        results = dict(enumcsh.scan_targets(["10.0.0.1", "10.0.0.2"], concurrency=2))
+        self.assertEqual(results, {"10.0.0.1": ["22"], "10.0.0.2": []})
+        self.assertEqual(mock_scan.call_count, 2)
+        
+        # Stopping early (e.g. Ctrl-C) drops the queued hosts instead of scanning them all
+        started = []
+        
+        def slow_scan(target, ports=None):
+            started.append(target)
+            time.sleep(0.2)
+            return []
+        
+        scans = enumcsh.scan_targets([f"10.0.0.{i}" for i in range(1, 9)], concurrency=2, scan_func=slow_scan)
+        next(scans)
+        with patch("enumcsh.stop_running_commands") as mock_stop:
+            scans.close()
+        mock_stop.assert_called_once()
+        time.sleep(0.5)
+        self.assertLess(len(started), 8)
+
+    @patch("enumcsh.build_scan_command")
+    @patch("enumcsh.console")
+    def test_stream_nmap_scan(self, mock_console, mock_build):
+        """Test that streamed scans yield each open port once, report failures and stop Nmap early."""
+        output = (
+            "Discovered open port 80/tcp on 127.0.0.1\n"
+            "Discovered open port 22/tcp on 127.0.0.1\n"
+            "PORT   STATE SERVICE\n"
+            "22/tcp open  ssh\n"
+            "80/tcp open  http\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            output_path = Path(tmp) / "nmap.txt"
+            output_path.write_text(output)
+            mock_build.return_value = f'"{sys.executable}" -c "import sys; sys.stdout.write(open(sys.argv[1]).read())" "{output_path}"'
+            ports = list(enumcsh.stream_nmap_scan("127.0.0.1"))
+        self.assertEqual(ports, ["80", "22"])
+        mock_build.assert_called_with("127.0.0.1", None, verbose=True)
+        
+        # Errors go to stderr; they are captured and reported instead of being discarded
+        script = "import sys; sys.stderr.write('Failed to resolve nohost.invalid.'); sys.exit(1)"
+        mock_build.return_value = f'"{sys.executable}" -c "{script}"'
+        self.assertEqual(list(enumcsh.stream_nmap_scan("nohost.invalid")), [])
+        printed = " ".join(str(call) for call in mock_console.print.call_args_list)
+        self.assertIn("Nmap exited with status 1: Failed to resolve nohost.invalid.", printed)
+        
+        # A caller that stops early kills Nmap rather than waiting for it
+        script = "import time; print('Discovered open port 22/tcp on 127.0.0.1', flush=True); time.sleep(30)"
+        mock_build.return_value = f'"{sys.executable}" -c "{script}"'
+        start = time.monotonic()
+        scan = enumcsh.stream_nmap_scan("127.0.0.1")
+        self.assertEqual(next(scan), "22")
+        scan.close()
+        self.assertLess(time.monotonic() - start, 10)
+
+    @patch("enumcsh.shutil.which", side_effect=lambda name: "/usr/bin/" + name if name in ("nc", "curl") else None)
+    def test_collect_followup_commands(self, mock_which):
+        """Test collecting runnable follow-up commands for an unknown port."""
+        commands = enumcsh.collect_followup_commands("8081", self.test_templates, "10.0.0.5")
+        # nc is an interactive client, so it is not run unattended
+        self.assertEqual(commands, ["nmap -sV -p 8081 -sC 10.0.0.5"])
+        commands = enumcsh.collect_followup_commands("80", self.test_templates, "10.0.0.5", include_nmap=False)
+        self.assertEqual(commands, ["curl -v http://10.0.0.5/"])
+        self.assertTrue(enumcsh.is_interactive_command("/usr/bin/mysql -h 10.0.0.5 -P 3306 -u root -p"))
+        # The shared generic template must not be modified
+        self.assertIn("{port}", self.test_templates["ports"]["unknown"]["nmap"])
+    
+    @patch("enumcsh.console")
+    def test_execute_all(self, mock_console):
+        """Test running follow-up commands in parallel with per-port logs."""
+        with tempfile.TemporaryDirectory() as log_dir:
+            jobs = [("10.0.0.5", "80", "echo web"), ("10.0.0.5", "22", "echo ssh")]
+            results = enumcsh.execute_all(jobs, Path(log_dir), workers=2)
+            self.assertEqual(len(results), 2)
+            for result in results:
+                self.assertEqual(result["returncode"], 0)
+                with gzip.open(result["log"], "rt") as f:
+                    self.assertIn(result["command"].split()[1], f.read())
+                self.assertIn(os.path.join("10.0.0.5", result["port"]), result["log"])
+
+    def test_plan_nmap_runs(self):
+        """Test merging template Nmap commands into one run per option set."""
+        templates = load_json_copy(self.test_templates)
+        templates["ports"]["443"] = {
+            "service": "https",
+            "description": "HTTPS Web Server",
+            "nmap": "nmap -sV -p 443 -sC --script=http-* --script=ssl-* {target}",
+        }
+        plan = enumcsh.plan_nmap_runs(
+            [("10.0.0.5", "443"), ("10.0.0.5", "80"), ("10.0.0.5", "8081")], templates
+        )
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan[0]["command"], "nmap -sV -sC -p 80,443,8081 --script=http-*,ssl-* 10.0.0.5")
+        self.assertEqual([source["port"] for source in plan[0]["sources"]], ["443", "80", "8081"])
+
+    def test_template_index(self):
+        """Test lookups for ranges, protocol-qualified and multi-port keys."""
+        templates = {"ports": {
+            "80": {}, "8000,8080,8443": {}, "6000-6063": {}, "6010-6012": {}, "161/udp": {}, "unknown": {}
+        }}
+        index = enumcsh.TemplateIndex(templates)
+        self.assertEqual(index.lookup("80"), "80")
+        self.assertEqual(index.lookup("8443"), "8000,8080,8443")
+        self.assertEqual(index.lookup("6001"), "6000-6063")
+        self.assertEqual(index.lookup("6011"), "6010-6012")
+        self.assertEqual(index.lookup("161/udp"), "161/udp")
+        self.assertIsNone(index.lookup("161"))
+        self.assertIsNone(index.lookup("6064"))
+        
+        restored = enumcsh.TemplateIndex.from_data(index.to_data())
+        self.assertEqual(restored.lookup("6050"), "6000-6063")
+        
+        # A single-port key wins over a comma list in either order
+        for ports in ({"8000,8080": {"service": "A"}, "8080": {"service": "B"}},
+                      {"8080": {"service": "B"}, "8000,8080": {"service": "A"}}):
+            templates = {"ports": dict(ports, unknown={})}
+            self.assertEqual(enumcsh.TemplateIndex(templates).lookup("8080/tcp"), "8080")
+            self.assertEqual(enumcsh.TemplateIndex(templates).lookup("8000"), "8000,8080")
+            self.assertEqual(enumcsh.find_port_template("8080/tcp", templates)["service"], "B")
+        # Between two comma lists the first key wins
+        index = enumcsh.TemplateIndex({"ports": {"8000,8080": {}, "8080,8443": {}}})
+        self.assertEqual(index.lookup("8080"), "8000,8080")
+    
+    def test_import_nmap_services(self):
+        """Test importing templates from an nmap-services style file."""
+        templates = load_json_copy(self.test_templates)
+        with tempfile.NamedTemporaryFile("w", suffix=".services", delete=False) as f:
+            f.write("# Fields: service port/proto freq\n")
+            f.write("http\t80/tcp\t0.484143\t# World Wide Web HTTP\n")
+            f.write("http-alt\t8080/tcp\t0.0418\t# HTTP Alternate\n")
+            f.write("http\t8008/tcp\t0.0003\n")
+            f.write("snmp\t161/udp\t0.433467\n")
+        try:
+            added = enumcsh.import_nmap_services(Path(f.name), templates)
+        finally:
+            os.remove(f.name)
+        
+        self.assertEqual(added, 3)
+        self.assertEqual(templates["ports"]["80"]["description"], "HTTP Web Server")
+        self.assertEqual(templates["ports"]["161/udp"]["nmap"], "nmap -sU -sV -p {port} {target}")
+        self.assertEqual(enumcsh.resolve_service_ports("HTTP", templates), ["80", "8008"])
+        self.assertEqual(enumcsh.find_port_template("8080", templates)["service"], "http-alt")
+    
+    def test_service_ports_are_concrete(self):
+        """Test that services mapped to list and range keys render with real port numbers."""
+        templates = load_json_copy(self.test_templates)
+        templates["ports"]["6000-6063"] = {
+            "service": "x11",
+            "nmap": "nmap -sV -p {port} --script=x11-access {target}",
+            "manual": ["xdpyinfo -display {target}:$(({port}-6000))"],
+        }
+        templates["services"].update({"http-alt": "8000,8080", "x11": "6000-6063", "snmp": "161/udp"})
+        self.assertEqual(enumcsh.resolve_service_ports("http-alt", templates), ["8000", "8080"])
+        self.assertEqual(enumcsh.resolve_service_ports("x11", templates), ["6000"])
+        self.assertEqual(enumcsh.resolve_service_ports("snmp", templates), ["161/udp"])
+        
+        plan = enumcsh.build_port_plan(enumcsh.find_service_ports("x11", templates)[0], templates, "10.0.0.5")
+        self.assertEqual(plan["nmap"], "nmap -sV -p 6000 --script=x11-access 10.0.0.5")
+        self.assertEqual(plan["manual"], ["xdpyinfo -display 10.0.0.5:$((6000-6000))"])
+        
+        # A port already covered by a range template maps the service to the port itself
+        with tempfile.NamedTemporaryFile("w", suffix=".services", delete=False) as f:
+            f.write("x11\t6001/tcp\t0.0001\n")
+        try:
+            added = enumcsh.import_nmap_services(Path(f.name), templates)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(added, 0)
+        self.assertNotIn("6001", templates["ports"])
+        self.assertEqual(enumcsh.resolve_service_ports("x11", templates), ["6000", "6001"])
+
+    def test_plain_port_lookup_skips_rich(self):
+        """Test that the --plain port lookup never imports rich or pygments."""
+        code = (
+            "import sys, enumcsh\n"
+            "enumcsh.app(['--plain', 'port', '-p', '80', '--templates', sys.argv[1]], standalone_mode=False)\n"
+            "print(sorted(m for m in ('rich', 'pygments') if m in sys.modules))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code, str(self.test_templates_path.resolve())],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(enumcsh.__file__))
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("curl -v http://target/", result.stdout)
+        self.assertNotIn("_____", result.stdout)
+        self.assertTrue(result.stdout.rstrip().endswith("[]"))
+
+    def test_split_port_spec(self):
+        """Test splitting port specs into resumable chunks."""
+        self.assertEqual(enumcsh.split_port_spec(None), [None])
+        self.assertEqual(enumcsh.split_port_spec("1-5,22,80", chunk_size=4), ["1-4", "5,22,80"])
+        self.assertEqual(enumcsh.split_port_spec("http,22"), ["http,22"])
+    
+    @patch("enumcsh.console")
+    def test_run_stored_scan_resume_and_reuse(self, mock_console):
+        """Test that stored scans resume from finished chunks and reuse fresh results."""
+        with tempfile.TemporaryDirectory() as tmp:
+            store = enumcsh.ResultStore(Path(tmp) / "results.db")
+            
+            # First run is interrupted after the first chunk
+            def interrupted(target, ports, raise_errors=False):
+                if ports == "3-4":
+                    raise KeyboardInterrupt
+                return ["2"]
+            with patch("enumcsh.run_nmap_scan", side_effect=interrupted):
+                with self.assertRaises(KeyboardInterrupt):
+                    enumcsh.run_stored_scan("10.0.0.5", "1-4", store, ttl=0, chunk_size=2)
+            
+            # The resumed run only scans the missing chunk
+            with patch("enumcsh.run_nmap_scan", return_value=["4"]) as mock_scan:
+                ports = enumcsh.run_stored_scan("10.0.0.5", "1-4", store, ttl=0, chunk_size=2)
+                mock_scan.assert_called_once_with("10.0.0.5", "3-4", raise_errors=True)
+            self.assertEqual(ports, ["2", "4"])
+            
+            # A fresh result is reused without scanning
+            with patch("enumcsh.run_nmap_scan") as mock_scan:
+                self.assertEqual(enumcsh.run_stored_scan("10.0.0.5", "1-4", store, ttl=60, chunk_size=2), ["2", "4"])
+                mock_scan.assert_not_called()
+            
+            # A new run where port 2 closed and port 3 opened
+            with patch("enumcsh.run_nmap_scan", side_effect=[[], ["3", "4"]]):
+                enumcsh.run_stored_scan("10.0.0.5", "1-4", store, ttl=0, chunk_size=2)
+            self.assertEqual(
+                store.changes("10.0.0.5", "1-4", enumcsh.NMAP_SCAN_OPTIONS),
+                [("2", "open", "closed"), ("3", "closed", "open")]
+            )
+            store.close()
+
+    def test_daemon_query(self):
+        """Test forwarding lookups to a running daemon over local HTTP."""
+        holder = enumcsh.TemplateHolder(self.test_templates_path)
+        server = enumcsh.make_daemon_server(holder, "127.0.0.1", 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                state_path = Path(tmp) / "serve.json"
+                with open(state_path, "w") as f:
+                    json.dump({
+                        "host": "127.0.0.1",
+                        "port": server.server_address[1],
+                        "templates": str(self.test_templates_path.resolve()),
+                    }, f)
+                with patch("enumcsh.DEFAULT_DAEMON_STATE_PATH", state_path), \
+                        patch.dict(os.environ, {"ENUMCSH_NO_DAEMON": ""}):
+                    response = enumcsh.query_daemon("/port", {"port": "8081", "target": "10.0.0.5"}, self.test_templates_path)
+                    self.assertTrue(response["plans"][0]["generic"])
+                    self.assertEqual(response["plans"][0]["nmap"], "nmap -sV -p 8081 -sC 10.0.0.5")
+                    
+                    response = enumcsh.query_daemon("/service", {"service": "ftp"}, self.test_templates_path)
+                    self.assertIn("not found", response["error"])
+                    
+                    # A daemon serving other templates is not used
+                    self.assertIsNone(enumcsh.query_daemon("/port", {"port": "80"}, Path("other.json")))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_run_batch_jsonl(self):
+        """Test resolving JSON Lines records into JSON Lines plans."""
+        input_stream = io.StringIO(
+            '{"target": "10.0.0.5", "port": "80"}\n'
+            '\n'
+            '{"target": "10.0.0.6", "service": "HTTP"}\n'
+            '{"target": "10.0.0.7", "service": "gopher"}\n'
+            'not json\n'
+        )
+        output_stream = io.StringIO()
+        count = enumcsh.run_batch(input_stream, output_stream, self.test_templates)
+        results = [json.loads(line) for line in output_stream.getvalue().splitlines()]
+        
+        self.assertEqual(count, 4)
+        self.assertEqual(results[0]["nmap"], "nmap -sV -p 80 -sC --script=http-* 10.0.0.5")
+        self.assertEqual(results[1]["manual"], ["curl -v http://10.0.0.6/"])
+        self.assertIn("not found", results[2]["error"])
+        self.assertIn("line 5", results[3]["error"])
+    
+    def test_run_batch_csv(self):
+        """Test resolving CSV records with a header row."""
+        input_stream = io.StringIO("target,port,service\n10.0.0.5,8081,\n10.0.0.6,,http\n")
+        output_stream = io.StringIO()
+        enumcsh.run_batch(input_stream, output_stream, self.test_templates)
+        results = [json.loads(line) for line in output_stream.getvalue().splitlines()]
+        
+        self.assertEqual([result["port"] for result in results], ["8081", "80"])
+        self.assertTrue(results[0]["generic"])
+        self.assertEqual(results[0]["manual"], ["nc -nv 10.0.0.5 8081"])
+
+    def test_search_templates(self):
+        """Test fuzzy search over names, aliases, descriptions and commands."""
+        templates = load_json_copy(self.test_templates)
+        templates["ports"]["445"] = {
+            "service": "smb",
+            "aliases": ["microsoft-ds", "cifs"],
+            "description": "Server Message Block",
+            "nmap": "nmap -sV -p 445 -sC --script=smb-* {target}",
+            "manual": ["smbclient -L //{target}/ -N"],
+        }
+        templates["services"]["smb"] = "445"
+        
+        index = enumcsh.SearchIndex(templates)
+        self.assertEqual(index.search("microsoft-ds")[0], (1.0, "445"))
+        self.assertEqual(index.search("smbclient")[0][1], "445")
+        self.assertEqual(index.search("web serv")[0][1], "80")
+        self.assertEqual(index.search("htp")[0][1], "80")
+        self.assertEqual(index.search("zzzz"), [])
+        self.assertEqual(index.complete("mi"), ["microsoft-ds"])
+        
+        self.assertEqual(enumcsh.find_service_ports("CIFS", templates), ["445"])
+        self.assertEqual(enumcsh.find_service_ports("samba", templates), [])
+
+    def test_format_plans(self):
+        """Test the bulk JSON, Markdown and shell renderers."""
+        plans = [
+            enumcsh.build_port_plan("80", self.test_templates, "10.0.0.5"),
+            enumcsh.build_port_plan("8081", self.test_templates, "10.0.0.6"),
+        ]
+        self.assertEqual(json.loads(enumcsh.format_plans(plans, "json")), plans)
+        
+        markdown = enumcsh.format_plans(plans, "markdown")
+        self.assertIn("## 10.0.0.6", markdown)
+        self.assertIn("```bash\nnmap -sV -p 8081 -sC 10.0.0.6\n```", markdown)
+        
+        with patch("enumcsh.shutil.which", side_effect=lambda name: "/usr/bin/curl" if name == "curl" else None):
+            script = enumcsh.format_plans(plans, "sh")
+        self.assertTrue(script.startswith("#!/bin/sh"))
+        self.assertIn("\ncurl -v http://10.0.0.5/\n", script)
+        self.assertIn("# nc -nv 10.0.0.6 8081", script)
+        self.assertIn("# msf> use auxiliary/scanner/http/http_version", script)
+        
+        # Streaming one group at a time produces the same output
+        for output_format in ("json", "markdown", "sh", "plain"):
+            self.assertEqual(
+                "".join(enumcsh.iter_formatted_plans([plans[:1], plans[1:]], output_format)),
+                enumcsh.format_plans(plans, output_format),
+            )
+        self.assertEqual(json.loads("".join(enumcsh.iter_formatted_plans([], "json"))), [])
+    
+    @patch("enumcsh.console")
+    def test_display_port_plans_highlights_once_per_batch(self, mock_console):
+        """Test that a batch of rich tables runs one highlight pass per language."""
+        from rich.syntax import Syntax
+        
+        plans = [enumcsh.build_port_plan(port, self.test_templates, "10.0.0.5") for port in ("80", "81", "82")]
+        with patch.object(Syntax, "highlight", autospec=True, side_effect=Syntax.highlight) as mock_highlight:
+            enumcsh.display_port_plans(plans)
+        self.assertEqual(mock_highlight.call_count, 2)
+        self.assertEqual(mock_console.print.call_count, 3)
+        
+        # A host's ports are rendered as one batch, with the notice for ports without a template
+        with patch("enumcsh.display_port_plans") as mock_display:
+            plans = enumcsh.display_ports_info(["80", "12345", "22"], self.test_templates, "10.0.0.5", {"22": "ssh"})
+        mock_display.assert_called_once_with(plans)
+        self.assertEqual([plan["port"] for plan in plans], ["80", "12345", "22"])
+        mock_console.print.assert_any_call(
+            "[bold yellow]No specific template for port 12345. Using generic template.[/bold yellow]"
+        )
+
+    @patch("enumcsh.console")
+    def test_prescan_loopback(self, mock_console):
+        """Test the TCP connect pre-scanner against loopback listeners."""
+        import socket
+        
+        listeners = []
+        for _ in range(2):
+            listener = socket.socket()
+            listener.bind(("127.0.0.1", 0))
+            listener.listen()
+            listeners.append(listener)
+        open_ports = sorted(str(listener.getsockname()[1]) for listener in listeners)
+        # A port that was just released is closed
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = str(closed.getsockname()[1])
+        closed.close()
+        try:
+            spec = ",".join(open_ports + [closed_port])
+            self.assertEqual(enumcsh.tcp_connect_scan("127.0.0.1", spec, concurrency=2, timeout=1, rate=1000), open_ports)
+            
+            # Only the open ports reach Nmap's service detection stage
+            with patch("enumcsh.run_nmap_scan", return_value=open_ports) as mock_scan:
+                self.assertEqual(enumcsh.run_prescan_scan("127.0.0.1", spec), open_ports)
+                mock_scan.assert_called_once_with("127.0.0.1", ",".join(open_ports), raise_errors=True, service_detection=True)
+            
+            # Without Nmap the sweep results are used as they are
+            with patch("enumcsh.run_nmap_scan", side_effect=RuntimeError("nmap: not found")):
+                self.assertEqual(enumcsh.run_prescan_scan("127.0.0.1", spec), open_ports)
+        finally:
+            for listener in listeners:
+                listener.close()
+    
+    @patch("enumcsh.console")
+    def test_prescan_socket_budget(self, mock_console):
+        """Test the pre-scanner backs off when out of file descriptors and stays within its socket budget."""
+        import errno
+        import socket
+        
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = str(listener.getsockname()[1])
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = str(closed.getsockname()[1])
+        closed.close()
+        
+        real_socket = socket.socket
+        failures = [OSError(errno.EMFILE, "Too many open files")] * 2
+        budget = enumcsh.SocketBudget(2)
+        peak = []
+        
+        def flaky_socket(*args, **kwargs):
+            # socketpair() wraps existing descriptors for the event loop itself
+            if len(args) < 4 and "fileno" not in kwargs:
+                peak.append(budget.in_use)
+                if failures:
+                    raise failures.pop()
+            return real_socket(*args, **kwargs)
+        
+        try:
+            with patch("enumcsh.get_socket_budget", return_value=budget), \
+                 patch("socket.socket", side_effect=flaky_socket):
+                spec = ",".join([port, closed_port] * 4)
+                result = enumcsh.tcp_connect_scan("127.0.0.1", spec, concurrency=50, timeout=1, rate=1000)
+            # EMFILE was retried rather than aborting the host's sweep
+            self.assertEqual(result, [port])
+            self.assertFalse(failures)
+            self.assertLessEqual(max(peak), 2)
+            self.assertEqual(budget.in_use, 0)
+        finally:
+            listener.close()
+        
+        self.assertEqual(
+            enumcsh.build_scan_command("10.0.0.5", "22,80", service_detection=True), "nmap -sV -T4 -p 22,80 10.0.0.5"
+        )
+        with self.assertRaises(ValueError):
+            enumcsh.tcp_connect_scan("127.0.0.1", "http")
+
+    @patch("enumcsh.console")
+    def test_banner_identification(self, mock_console):
+        """Test identifying services on unknown ports from their banners."""
+        import socket
+        
+        templates = enumcsh.load_templates(enumcsh.DEFAULT_TEMPLATES_PATH, use_cache=False)
+        matcher = enumcsh.SignatureMatcher(templates["signatures"] + [{"service": "broken", "pattern": "(["}])
+        self.assertEqual(matcher.match("SSH-2.0-OpenSSH_9.6\r\n"), "ssh")
+        self.assertEqual(matcher.match("HTTP/1.1 400 Bad Request\r\n"), "http")
+        self.assertEqual(matcher.match("220 mail.example.com ESMTP Postfix\r\n"), "smtp")
+        self.assertIsNone(matcher.match("hello"))
+        
+        def serve(listener, greeting, reply):
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                with conn:
+                    if greeting:
+                        conn.sendall(greeting)
+                    elif conn.recv(1024):
+                        conn.sendall(reply)
+        
+        listeners = {}
+        for name, greeting, reply in (("ssh", b"SSH-2.0-OpenSSH_9.6\r\n", b""), ("http", b"", b"HTTP/1.0 200 OK\r\n\r\n")):
+            listener = socket.socket()
+            listener.bind(("127.0.0.1", 0))
+            listener.listen()
+            threading.Thread(target=serve, args=(listener, greeting, reply), daemon=True).start()
+            listeners[name] = listener
+        try:
+            ports = {name: str(listener.getsockname()[1]) for name, listener in listeners.items()}
+            endpoints = [("127.0.0.1", port) for port in ports.values()] + [("127.0.0.1", "22")]
+            services = enumcsh.identify_services(endpoints, templates, timeout=0.5)
+        finally:
+            for listener in listeners.values():
+                listener.close()
+        # Port 22 has a template, so it is not probed
+        self.assertEqual(services, {("127.0.0.1", ports["ssh"]): "ssh", ("127.0.0.1", ports["http"]): "http"})
+        
+        # The matched template is rendered for the actual port
+        plan = enumcsh.build_port_plan("2222", templates, "10.0.0.5", service="ssh")
+        self.assertFalse(plan["generic"])
+        self.assertEqual(plan["nmap"], "nmap -sV -p 2222 -sC --script=ssh-* 10.0.0.5")
+        self.assertIn("ssh -v -p 2222 10.0.0.5", plan["manual"])
+        plan = enumcsh.build_port_plan("8081", templates, "10.0.0.5", service="http")
+        self.assertIn("curl -v http://10.0.0.5:8081/", plan["manual"])
+        for port, service, command in (
+            ("2121", "ftp", "ftp 10.0.0.5 2121"),
+            ("3307", "mysql", "mysql -h 10.0.0.5 -P 3307 -u root -p"),
+            ("5433", "postgresql", "psql -h 10.0.0.5 -p 5433 -U postgres"),
+            ("4443", "https", "sslscan 10.0.0.5:4443"),
+        ):
+            self.assertIn(command, enumcsh.build_port_plan(port, templates, "10.0.0.5", service=service)["manual"])
+        plan = enumcsh.build_port_plan("6379", templates, "10.0.0.5", service="redis")
+        self.assertTrue(plan["generic"])
+        self.assertEqual(plan["service"], "redis")
+        # Retargeting works on a copy
+        self.assertEqual(templates["ports"]["22"]["nmap"], "nmap -sV -p 22 -sC --script=ssh-* {target}")
+
+    @patch("enumcsh.build_scan_command", return_value=f'"{sys.executable}" -c "print(\'22/tcp open  ssh\')"')
+    @patch("enumcsh.console")
+    def test_trace_hooks(self, mock_console, mock_build):
+        """Test that phases and child processes are reported to trace hooks."""
+        recorder = enumcsh.add_trace_hook(enumcsh.TraceRecorder())
+        try:
+            enumcsh.load_templates(self.test_templates_path)
+            enumcsh.run_nmap_scan("10.0.0.5", "22")
+        finally:
+            enumcsh.remove_trace_hook(recorder)
+        # Removed hooks get no more events
+        enumcsh.load_templates(self.test_templates_path)
+        
+        self.assertEqual([event["name"] for event in recorder.events], ["load_templates", "nmap", "parse_nmap_output"])
+        nmap_event = recorder.events[1]
+        self.assertEqual((nmap_event["cat"], nmap_event["ph"]), ("child", "X"))
+        self.assertEqual(nmap_event["args"]["returncode"], 0)
+        self.assertIn("children_cpu_ms", nmap_event["args"])
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            trace_path = Path(tmp) / "trace.json"
+            recorder.write(trace_path)
+            with open(trace_path) as f:
+                trace = json.load(f)
+        self.assertEqual(trace["traceEvents"][:3], recorder.events)
+        self.assertEqual(trace["traceEvents"][-1]["ph"], "C")
+        self.assertEqual({phase["name"] for phase in trace["otherData"]["phases"]}, {"load_templates", "nmap", "parse_nmap_output"})
+    
+    def test_trace_option_writes_chrome_trace(self):
+        """Test that --trace writes a trace file for a CLI run."""
+        with tempfile.TemporaryDirectory() as tmp:
+            trace_path = Path(tmp) / "trace.json"
+            subprocess.run(
+                [sys.executable, "enumcsh.py", "--plain", "--trace", str(trace_path), "port", "-p", "80",
+                 "-t", "10.0.0.5", "--templates", str(self.test_templates_path)],
+                cwd=os.path.dirname(os.path.abspath(enumcsh.__file__)), capture_output=True, text=True, check=True,
+                env={**os.environ, "ENUMCSH_NO_DAEMON": "1"},
+            )
+            with open(trace_path) as f:
+                names = [event["name"] for event in json.load(f)["traceEvents"]]
+        self.assertIn("load_templates", names)
+        self.assertIn("render", names)
+
+    def test_import_scan_files(self):
+        """Test streaming findings from Nmap XML, grepable Nmap and masscan files."""
+        import gzip
+        
+        nmap_xml = """<?xml version="1.0"?>
+<nmaprun scanner="nmap">
+<hosthint><status state="up"/><address addr="10.0.0.99" addrtype="ipv4"/></hosthint>
+<host><address addr="10.0.0.5" addrtype="ipv4"/><address addr="00:11:22:33:44:55" addrtype="mac"/>
+<ports>
+<port protocol="tcp" portid="22"><state state="open"/><service name="ssh"/></port>
+<port protocol="tcp" portid="2222"><state state="open"/><service name="ssh"/></port>
+<port protocol="tcp" portid="25"><state state="closed"/><service name="smtp"/></port>
+<port protocol="udp" portid="161"><state state="open"/><service name="snmp"/></port>
+</ports></host>
+</nmaprun>
+"""
+        gnmap = (
+            "# Nmap 7.94 scan initiated\n"
+            "Host: 10.0.0.6 (web.local)\tStatus: Up\n"
+            "Host: 10.0.0.6 (web.local)\tPorts: 80/open/tcp//http//nginx 1.18, Ubuntu/, 9999/open/tcp//tcpwrapped///, "
+            "443/filtered/tcp//https///\tIgnored State: closed (997)\n"
+        )
+        masscan = (
+            "[\n"
+            '{"ip": "10.0.0.7", "timestamp": "1700000000", "ports": [{"port": 80, "proto": "tcp", "status": "open"}]},\n'
+            '{"ip": "10.0.0.7", "timestamp": "1700000001", "ports": [{"port": 80, "proto": "tcp", "service": {"name": "http"}}]},\n'
+            '{"ip": "10.0.0.7", "timestamp": "1700000002", "ports": [{"port": 3306, "proto": "tcp", "status": "closed"}]}\n'
+            "]\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {}
+            for name, content in (("scan.xml.gz", nmap_xml), ("scan.gnmap", gnmap), ("scan.json", masscan)):
+                paths[name] = Path(tmp) / name
+                with (gzip.open if name.endswith(".gz") else open)(paths[name], "wt") as f:
+                    f.write(content)
+            
+            self.assertEqual(dict(enumcsh.iter_host_findings(enumcsh.iter_scan_file(paths["scan.xml.gz"]))), {
+                "10.0.0.5": {"22": "ssh", "2222": "ssh", "161/udp": "snmp"},
+            })
+            self.assertEqual(dict(enumcsh.iter_host_findings(enumcsh.iter_scan_file(paths["scan.gnmap"]))), {
+                "10.0.0.6": {"80": "http", "9999": None},
+            })
+            self.assertEqual(dict(enumcsh.iter_host_findings(enumcsh.iter_scan_file(paths["scan.json"]))), {
+                "10.0.0.7": {"80": "http"},
+            })
+            with open(Path(tmp) / "broken.xml", "w") as f:
+                f.write("<nmaprun><host>")
+            with self.assertRaises(ValueError):
+                list(enumcsh.iter_scan_file(Path(tmp) / "broken.xml"))
+        
+        templates = enumcsh.load_templates(enumcsh.DEFAULT_TEMPLATES_PATH, use_cache=False)
+        [plans] = enumcsh.plan_scan_findings([("10.0.0.5", {"2222": "ssh", "22": "ssh", "9999": None})], templates)
+        self.assertEqual([plan["port"] for plan in plans], ["22", "2222", "9999"])
+        # The scanner's service name picks the template for ports without one
+        self.assertEqual(plans[1]["nmap"], "nmap -sV -p 2222 -sC --script=ssh-* 10.0.0.5")
+        self.assertTrue(plans[2]["generic"])
+
+    @patch("enumcsh.console")
+    def test_pipeline(self, mock_console):
+        """Test running a step DAG with conditions, skipped branches and a state file."""
+        templates = load_json_copy(self.test_templates)
+        templates["ports"]["80"]["steps"] = [
+            {"id": "probe", "cmd": "echo 'HTTP/1.1 200 OK from {target}:{port}'"},
+            {"id": "dirs", "cmd": "echo dirs", "after": ["probe"], "when": {"step": "probe", "output": "HTTP/1\\.1 200"}, "weight": 8},
+            {"id": "tls", "cmd": "echo tls", "when": {"step": "probe", "output": "HTTPS"}},
+            {"id": "after-tls", "cmd": "echo after", "after": ["tls"]},
+            {"id": "broken", "cmd": "exit 3"},
+            {"id": "after-broken", "cmd": "echo never", "after": ["broken"]},
+            {"id": "on-broken", "cmd": "echo fallback", "when": {"step": "broken", "exit": 3}},
+        ]
+        # Only the declared steps, not the ones derived from the template's commands
+        del templates["ports"]["80"]["nmap"]
+        templates["ports"]["80"]["manual"] = []
+        nodes = enumcsh.build_pipeline([("127.0.0.1", "80")], templates)
+        self.assertEqual(list(nodes)[0], "127.0.0.1:80:probe")
+        self.assertEqual(nodes["127.0.0.1:80:tls"]["after"], ["127.0.0.1:80:probe"])
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            state_path = Path(tmp) / "state.json"
+            results = enumcsh.run_pipeline(nodes, Path(tmp) / "logs", capacity=2, state=enumcsh.PipelineState(state_path))
+            outcome = {result["step"]: "skipped" if result.get("skipped") else result["returncode"] for result in results}
+            self.assertEqual(outcome, {
+                "probe": 0, "dirs": 0, "tls": "skipped", "after-tls": "skipped", "broken": 3, "after-broken": "skipped",
+                "on-broken": 0,
+            })
+            
+            # A rerun reuses the steps that succeeded and retries the failed one
+            with patch("enumcsh.run_logged_command", wraps=enumcsh.run_logged_command) as mock_run:
+                results = enumcsh.run_pipeline(nodes, Path(tmp) / "logs", state=enumcsh.PipelineState(state_path))
+            self.assertEqual([call.args[0] for call in mock_run.call_args_list], ["exit 3"])
+            self.assertTrue(all(result.get("cached") for result in results if result["step"] in ("probe", "dirs")))
+        
+        templates["ports"]["80"]["steps"] = [{"id": "a", "cmd": "true", "after": ["b"]}, {"id": "b", "cmd": "true", "after": ["a"]}]
+        with self.assertRaises(ValueError):
+            enumcsh.build_pipeline([("127.0.0.1", "80")], templates)
+    
+    def test_template_steps_derive_from_commands(self):
+        """Test that pipeline steps come from the template's commands and refinements reuse them."""
+        port_data = {
+            "nmap": "nmap -sV -p 80 {target}",
+            "manual": ["curl -v http://{target}/", "Check for default pages", "curl -vk https://{target}/", "gobuster dir -u http://{target}/"],
+            "steps": [
+                {"id": "nmap", "weight": 2},
+                {"id": "curl-2", "after": ["curl"]},
+                {"id": "gobuster", "when": {"step": "curl", "output": "< HTTP"}},
+                {"id": "after-gobuster", "cmd": "echo done", "after": ["gobuster"]},
+                {"id": "probe", "cmd": "echo probe"},
+            ],
+        }
+        with patch("enumcsh.shutil.which", side_effect=lambda name: f"/usr/bin/{name}" if name == "curl" else None):
+            steps = enumcsh.template_steps(port_data)
+        # gobuster is not installed, so its refinement and the step after it are dropped
+        self.assertEqual([step["id"] for step in steps], ["nmap", "curl", "curl-2", "probe"])
+        self.assertEqual(steps[0], {"id": "nmap", "cmd": "nmap -sV -p 80 {target}", "weight": 2})
+        self.assertEqual(steps[2]["cmd"], "curl -vk https://{target}/")
+        
+        # Without curl, the bundled web template's gobuster and nikto steps (which wait on curl) are dropped
+        templates = enumcsh.load_templates(enumcsh.DEFAULT_TEMPLATES_PATH, use_cache=False)
+        with patch("enumcsh.shutil.which", side_effect=lambda name: None if name == "curl" else f"/usr/bin/{name}"):
+            nodes = enumcsh.build_pipeline([("10.0.0.5", "80"), ("10.0.0.5", "22")], templates)
+        self.assertIn("10.0.0.5:80:nmap", nodes)
+        self.assertFalse([key for key in nodes if key.startswith("10.0.0.5:80:") and key != "10.0.0.5:80:nmap"])
+    
+    @patch("enumcsh.console")
+    @patch("enumcsh.os.getloadavg", return_value=(0.0, 0.0, 0.0))
+    def test_adaptive_scheduler(self, mock_load, mock_console):
+        """Test priority ordering and concurrency/timing adjustment on load and packet loss."""
+        calls = []
+        
+        def fake_scan(target, ports, timing, on_line):
+            calls.append((target, timing))
+            if target == "lossy":
+                on_line("Increasing send delay for 10.0.0.9 from 0 to 5 due to 11 out of 33 dropped probes since last increase.")
+            return ["22"]
+        
+        scheduler = enumcsh.AdaptiveScheduler(max_concurrency=1, timing=4)
+        results = dict(scheduler.run(["low", "lossy", "high"], None, fake_scan, {"high": 10, "lossy": 5}))
+        self.assertEqual([target for target, _ in calls], ["high", "lossy", "low"])
+        self.assertEqual(results["low"], ["22"])
+        self.assertEqual(calls[-1], ("low", 3))
+        
+        scheduler = enumcsh.AdaptiveScheduler(max_concurrency=8, timing=4)
+        for _ in range(3):
+            scheduler.observe(1.0, 0, 1)
+        self.assertEqual((scheduler.concurrency, scheduler.timing), (5, 4))
+        mock_load.return_value = (scheduler.cpu_count * 4.0, 0.0, 0.0)
+        scheduler.observe(1.0, 0, 1)
+        self.assertEqual((scheduler.concurrency, scheduler.timing), (2, 4))
+        
+        # More child processes than two per CPU counts as overload
+        scheduler = enumcsh.AdaptiveScheduler(max_concurrency=8, timing=4)
+        mock_load.return_value = (0.0, 0.0, 0.0)
+        with patch("enumcsh.count_child_processes", return_value=scheduler.cpu_count * 2 + 1):
+            scheduler.observe(1.0, 0, 1)
+        self.assertEqual(scheduler.concurrency, 1)
+        self.assertIn("child processes", scheduler.adjustments[-1][2])
+        self.assertIsInstance(enumcsh.count_child_processes(), (int, type(None)))
+        
+        # Networks are matched by membership, so a /8 is not expanded
+        priorities = enumcsh.parse_priorities(["10.0.0.0/8=7", "10.0.0.5=9", "10.1.0.1-20=3", "web-01=2"])
+        self.assertEqual(priorities.get("10.200.3.4"), 7)
+        self.assertEqual(priorities.get("10.0.0.5"), 9)
+        self.assertEqual(priorities.get("10.1.0.20"), 3)
+        self.assertEqual(priorities.get("10.1.0.21"), 7)
+        self.assertEqual(priorities.get("web-01"), 2)
+        self.assertEqual(priorities.get("192.168.1.1"), 0)
+        self.assertEqual(priorities.get("::1"), 0)
+        with self.assertRaises(ValueError):
+            enumcsh.parse_priorities(["10.0.0.1"])
+        self.assertIn("-T2 -p 22", enumcsh.build_scan_command("10.0.0.1", "22", timing=2))
+    
+    @patch("enumcsh.run_captured", return_value={"returncode": 0, "duration": 0.1, "bytes": 0, "log": None})
+    @patch("enumcsh.console")
+    def test_nmap_scan_verbose(self, mock_console, mock_run):
+        """Test verbose Nmap scans, which report dropped probes to the adaptive scheduler."""
+        enumcsh.run_nmap_scan("10.0.0.1", "22", timing=3, on_line=lambda line: None, verbose=True)
+        self.assertEqual(mock_run.call_args.args[0], "nmap -v -T3 -p 22 10.0.0.1")
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file